@@ -0,0 +1,151 @@
+"""
+Admission control in front of the food detector.
+
+At most `max_concurrent` analyses run at once and at most `max_queue` more
+wait for a slot; anything beyond that is turned away immediately with
+AnalysisOverloaded (HTTP 429) instead of piling onto the CPU and dragging
+every request's latency down with it.
+"""
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+class AnalysisOverloaded(Exception):
+    """No analysis slot is available; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f'Analysis capacity exhausted, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded wait queue, usable from threads and coroutines."""
+
+    # Poll interval for coroutines waiting on a slot
+    ASYNC_POLL_SECONDS = 0.005
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._avg_hold = 1.0  # Moving average of seconds a slot is held
+
+    def state(self) -> dict:
+        """Current load, for the metrics endpoint."""
+        with self._cond:
+            return {
+                'active': self._active,
+                'queue_depth': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+            }
+
+    @contextmanager
+    def slot(self, wait: bool = True):
+        """
+        Hold an analysis slot, waiting up to queue_timeout in the queue; without
+        `wait`, background work that must not hold up requests is refused at once.
+        """
+        start = time.monotonic()
+        with self._cond:
+            if not self._has_free_slot():
+                if not wait:
+                    self._reject('admission.busy')
+                self._enqueue()
+                try:
+                    admitted = self._cond.wait_for(self._has_free_slot, timeout=self.queue_timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._reject('admission.timed_out')
+            self._active += 1
+        admitted_at = self._admit(start)
+        try:
+            yield admitted_at - start
+        finally:
+            self._release(admitted_at)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async variant of slot(); waits without blocking the event loop."""
+        start = time.monotonic()
+        with self._cond:
+            admitted = self._has_free_slot()
+            if admitted:
+                self._active += 1
+            else:
+                self._enqueue()
+        if not admitted:
+            try:
+                while not admitted:
+                    await asyncio.sleep(self.ASYNC_POLL_SECONDS)
+                    with self._cond:
+                        if self._has_free_slot():
+                            self._active += 1
+                            admitted = True
+                        elif time.monotonic() - start >= self.queue_timeout:
+                            self._reject('admission.timed_out')
+            finally:
+                with self._cond:
+                    self._waiting -= 1
+        admitted_at = self._admit(start)
+        try:
+            yield admitted_at - start
+        finally:
+            self._release(admitted_at)
+
+    def _has_free_slot(self) -> bool:
+        return self._active < self.max_concurrent
+
+    def _enqueue(self) -> None:
+        """Join the wait queue or reject if it is full (caller holds the lock)."""
+        if not self._has_free_slot() and self._waiting >= self.max_queue:
+            self._reject('admission.rejected')
+        self._waiting += 1
+        metrics.observe('admission.queue_depth', self._waiting)
+
+    def _reject(self, counter: str) -> None:
+        metrics.incr(counter)
+        # Time for the work ahead of a new arrival to drain
+        backlog = (self._waiting + 1) / max(self.max_concurrent, 1)
+        raise AnalysisOverloaded(max(1, math.ceil(self._avg_hold * backlog)))
+
+    def _admit(self, start: float) -> float:
+        admitted_at = time.monotonic()
+        metrics.incr('admission.admitted')
+        metrics.observe('admission.wait_ms', (admitted_at - start) * 1000)
+        return admitted_at
+
+    def _release(self, admitted_at: float) -> None:
+        held = time.monotonic() - admitted_at
+        with self._cond:
+            self._active -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            self._cond.notify()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Process-wide admission controller configured from settings."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                max_concurrent=settings.NUTRISCAN_ANALYSIS_MAX_CONCURRENT,
+                max_queue=settings.NUTRISCAN_ANALYSIS_MAX_QUEUE,
+                queue_timeout=settings.NUTRISCAN_ANALYSIS_QUEUE_TIMEOUT,
+            )
+        return _controller
@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .ingest import invalidate_catalog
+
+        # The cached name -> FoodItem map (api/cache.py) is stale once the catalog changes
+        post_save.connect(invalidate_catalog, sender='api.FoodItem', dispatch_uid='invalidate_catalog_save')
+        post_delete.connect(invalidate_catalog, sender='api.FoodItem', dispatch_uid='invalidate_catalog_delete')
+
+        # Off by default so management commands and tests don't pay for it;
+        # gunicorn.conf.py turns it on so workers fork from a warmed master.
+        if settings.NUTRISCAN_WARMUP:
+            from .warmup import warm_up
+            warm_up()
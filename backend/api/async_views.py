@@ -0,0 +1,167 @@
+"""
+Native async views, served without a thread per request under ASGI.
+
+Run with an ASGI server (e.g. `uvicorn nutriscan.asgi:application`). The
+upload body is buffered by Django's ASGI handler without blocking a thread,
+decode/analysis runs in the bounded analysis executor, and database writes
+go through the async ORM.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils.timezone import now
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .admission import AnalysisOverloaded, get_admission
+from .daily_logs import get_or_create_log, record_scan_added
+from .executor import get_analysis_executor
+from .isolation import AnalysisAborted
+from .image_probe import ImageRejected, guard_upload
+from .ingest import (
+    resolve_basename, match_filename, analyze_image_cached, apply_result, food_id_for,
+    main_food_name, queue_feature_extraction,
+)
+from .metrics import metrics
+from .models import NutritionScan, DailyNutritionLog
+from .serializers import NutritionScanDetailSerializer
+
+logger = logging.getLogger(__name__)
+
+
+async def process_image_async(request):
+    """
+    Async variant of POST /api/scans/process_image/ with the same form fields and response.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        # Multipart parsing and authentication touch sync code
+        try:
+            files, post, user = await sync_to_async(_read_request)(request)
+        except APIException as e:
+            # e.g. a session-authenticated request without a CSRF token, as DRF answers it
+            return JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+
+        image_file = files.get('image')
+        if not image_file:
+            return JsonResponse({'error': 'No image file provided'}, status=400)
+
+        # Validate image
+        if not image_file.content_type.startswith('image/'):
+            return JsonResponse({'error': 'File must be an image'}, status=400)
+
+        # Check the header against the size budgets before storing or decoding anything.
+        # Runs in a plain thread: an open upload can't be sent to a process pool.
+        try:
+            image_file = await sync_to_async(guard_upload, thread_sensitive=False)(image_file)
+        except ImageRejected as e:
+            return JsonResponse({'error': str(e)}, status=e.status_code)
+
+        basename = resolve_basename(post.get('original_filename', '').strip(), image_file.name)
+        analysis_mode = post.get('analysis_mode', '')
+        degraded = False
+
+        result = match_filename(basename)
+        analyzed = result is None
+        if result is not None:
+            # Create scan record
+            scan = await NutritionScan.objects.acreate(image=image_file, user=user)
+        else:
+            scan = None
+            try:
+                # Image analysis needs a detector slot; claim it before storing anything
+                try:
+                    async with get_admission().aslot():
+                        scan = await NutritionScan.objects.acreate(image=image_file, user=user)
+                        result = await _analyze(scan.image.path, analysis_mode)
+                except AnalysisOverloaded as e:
+                    if not settings.NUTRISCAN_OVERLOAD_DEGRADE:
+                        response = JsonResponse({'error': str(e)}, status=429)
+                        response['Retry-After'] = str(e.retry_after)
+                        return response
+                    # Shed load with the cheap coarse stage instead of queueing
+                    metrics.incr('admission.degraded')
+                    degraded = True
+                    scan = await NutritionScan.objects.acreate(image=image_file, user=user)
+                    result = await _analyze(scan.image.path, 'coarse', degraded=True)
+            except (AnalysisOverloaded, AnalysisAborted) as e:
+                # The image hung or crashed its analysis worker, or no spare worker
+                # could take the degraded analysis; don't keep it
+                await sync_to_async(scan.image.delete)(save=False)
+                await scan.adelete()
+                if isinstance(e, AnalysisAborted):
+                    return JsonResponse({'error': str(e)}, status=e.status_code)
+                response = JsonResponse({'error': str(e)}, status=429)
+                response['Retry-After'] = str(e.retry_after)
+                return response
+
+        # Update scan with results
+        apply_result(scan, result)
+        scan.food_id = await sync_to_async(food_id_for)(main_food_name(result))
+        await scan.asave()
+        if analyzed and not degraded:
+            await sync_to_async(queue_feature_extraction)(scan)
+
+        # Update daily log if user is authenticated
+        if user is not None:
+            await _update_daily_log(user, scan)
+
+        response = JsonResponse(NutritionScanDetailSerializer(scan).data, status=201)
+        if degraded:
+            response['X-Analysis-Degraded'] = 'coarse'
+        return response
+
+    except Exception as e:
+        logger.exception('Error processing image: %s', e)
+        return JsonResponse({'error': f'Failed to process image: {str(e)}'}, status=500)
+
+
+# Like DRF's views: skip the middleware's CSRF check, which SessionAuthentication
+# applies to session-authenticated requests instead (see _read_request). Set
+# directly because Django 4.2's @csrf_exempt wraps coroutine functions in a sync wrapper.
+process_image_async.csrf_exempt = True
+
+
+async def _analyze(image_path, analysis_mode, degraded=False):
+    """Run image analysis in the bounded analysis executor."""
+    return await asyncio.get_running_loop().run_in_executor(
+        get_analysis_executor(), analyze_image_cached, image_path, analysis_mode, degraded
+    )
+
+
+def _read_request(request):
+    """
+    Parse the multipart body and authenticate the user with the DRF views'
+    authentication classes, CSRF check included (sync: runs in a worker
+    thread). Raises APIException for a request they reject.
+    """
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    user = Request(request, authenticators=authenticators).user
+    user = user if user.is_authenticated else None
+    return request.FILES, request.POST, user
+
+
+@sync_to_async
+def _update_daily_log(user, scan):
+    """Add a scan to today's daily log with a single atomic UPDATE (and to the rolling sums)."""
+    # One transaction for both, rolling sums first (see api/rolling_stats.py); the
+    # async ORM can't open one
+    with transaction.atomic(savepoint=False):
+        log, _ = get_or_create_log(user, now().date())
+        record_scan_added(scan, log.date)
+        DailyNutritionLog.objects.filter(pk=log.pk).update(
+            total_calories=F('total_calories') + scan.calories,
+            total_protein=F('total_protein') + scan.protein,
+            total_carbs=F('total_carbs') + scan.carbs,
+            total_fat=F('total_fat') + scan.fat,
+            scan_count=F('scan_count') + 1,
+            updated_at=now(),
+        )
@@ -0,0 +1,198 @@
+"""
+Shared cache tier for analysis results and catalog lookups.
+
+Values live in the 'shared' cache alias (CACHES in settings). Its file,
+database or memcached backend is seen by every worker process, so unlike a
+per-process cache its hit rate doesn't fall as workers are added.
+
+Keys are namespaced and versioned: `<namespace>:v<n>:<key>`, where n is the
+namespace's current version, itself kept in the cache. `bump()` invalidates
+a whole namespace at once; NUTRISCAN_CACHE_VERSION (the alias's VERSION)
+invalidates everything. Each namespace has its own TTL setting.
+
+`get_or_compute()` is single-flight: on a miss one caller computes the value
+while the others wait for it instead of all computing it at once. Within a
+process one lock per key lines its callers up; across processes the
+owner holds a lock key set with `add`, which is atomic on memcached and
+database backends and best effort on the file backend. A waiter that isn't
+answered within NUTRISCAN_CACHE_LOCK_TIMEOUT computes the value itself.
+
+Cache errors (e.g. memcached being down) never fail a request: the value is
+computed as if it had missed. Each namespace counts hits, misses, waits and
+errors as `cache.<namespace>.<event>` in the metrics registry.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'shared'
+_MISSING = object()
+_POLL_MIN, _POLL_MAX = 0.01, 0.2  # Seconds between a waiter's checks, doubling
+
+
+class CacheNamespace:
+    """One kind of cached value: its key prefix, version and TTL (the named setting, in seconds)."""
+
+    def __init__(self, name: str, ttl_setting: str):
+        self.name = name
+        self.ttl_setting = ttl_setting
+        self._locks = {}  # cache key -> [lock, callers holding or waiting for it]
+        self._locks_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, self.ttl_setting)
+
+    @property
+    def _cache(self):
+        return caches[CACHE_ALIAS]
+
+    def get_or_compute(self, key: str, compute, cacheable=None):
+        """
+        The cached value of `key`, else compute(), stored under it unless
+        cacheable(value) is false. One caller computes at a time.
+        """
+        try:
+            cache_key = self._key(key)
+            value = self._cache.get(cache_key, _MISSING)
+        except Exception:
+            self._error('get')
+            return compute()
+        if value is not _MISSING:
+            self._count('hit')
+            return value
+
+        with self._local_lock(cache_key):
+            owner, value = self._claim(cache_key)
+            if value is not _MISSING:
+                self._count('wait_hit')
+                return value
+            self._count('miss')
+            try:
+                value = compute()
+                if cacheable is None or cacheable(value):
+                    try:
+                        self._cache.set(cache_key, value, self.ttl)
+                    except Exception:
+                        self._error('set')
+            finally:
+                if owner:
+                    self._release(cache_key)
+            return value
+
+    def bump(self) -> None:
+        """Invalidate every entry in the namespace by moving it to a new version."""
+        try:
+            self._cache.incr(self._version_key())
+        except ValueError:
+            self._version()  # Not set (or evicted): starts at a fresh version
+        except Exception:
+            self._error('bump')
+
+    @contextmanager
+    def _local_lock(self, cache_key: str):
+        """Serialize this process's callers of one key."""
+        with self._locks_lock:
+            entry = self._locks.setdefault(cache_key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[cache_key]
+
+    def _claim(self, cache_key: str):
+        """
+        (owner, value): take the cross-process lock for computing `cache_key`,
+        or wait for its owner to store the value. owner is False, with
+        value _MISSING, when the wait timed out or the cache failed.
+        """
+        timeout = settings.NUTRISCAN_CACHE_LOCK_TIMEOUT
+        lock_key = cache_key + ':lock'
+        try:
+            # Filled by another thread of this process while we waited for the local lock
+            value = self._cache.get(cache_key, _MISSING)
+            if value is not _MISSING:
+                return False, value
+            if self._cache.add(lock_key, os.getpid(), math.ceil(timeout)):
+                return True, _MISSING
+            self._count('wait')
+            deadline = time.monotonic() + timeout
+            pause = _POLL_MIN
+            while time.monotonic() < deadline:
+                time.sleep(pause)
+                pause = min(pause * 2, _POLL_MAX)
+                value = self._cache.get(cache_key, _MISSING)
+                if value is not _MISSING:
+                    return False, value
+                if self._cache.add(lock_key, os.getpid(), math.ceil(timeout)):
+                    return True, _MISSING  # The owner gave up without storing a value
+            self._count('wait_timeout')
+        except Exception:
+            self._error('lock')
+        return False, _MISSING
+
+    def _release(self, cache_key: str) -> None:
+        try:
+            self._cache.delete(cache_key + ':lock')
+        except Exception:
+            self._error('unlock')
+
+    def _key(self, key: str) -> str:
+        return f'{self.name}:v{self._version()}:{key}'
+
+    def _version_key(self) -> str:
+        return f'{self.name}:version'
+
+    def _version(self) -> int:
+        version = self._cache.get(self._version_key())
+        if version is None:
+            # add() isn't atomic on the file backend: this process's threads
+            # take turns, so they can't each seed (and use) a different version
+            with self._version_lock:
+                version = self._cache.get(self._version_key())
+                if version is None:
+                    # Start from the clock, not 1, so a version evicted from the cache
+                    # can't come back as one whose entries are still stored
+                    self._cache.add(self._version_key(), int(time.time() * 1000), None)
+                    version = self._cache.get(self._version_key(), 0)
+        return version
+
+    def _count(self, event: str) -> None:
+        metrics.incr(f'cache.{self.name}.{event}')
+
+    def _error(self, operation: str) -> None:
+        self._count('errors')
+        logger.warning('Shared cache %s failed for namespace %s', operation, self.name, exc_info=True)
+
+
+ANALYSIS = CacheNamespace('analysis', 'NUTRISCAN_ANALYSIS_CACHE_TTL')
+CATALOG = CacheNamespace('catalog', 'NUTRISCAN_CATALOG_CACHE_TTL')
+
+
+def cache_stats(snapshot: dict) -> dict:
+    """Per-namespace cache counters and hit rate from a metrics snapshot."""
+    stats = {}
+    for name, count in snapshot['counters'].items():
+        if name.startswith('cache.'):
+            namespace, event = name[len('cache.'):].rsplit('.', 1)
+            stats.setdefault(namespace, {})[event] = count
+    for counts in stats.values():
+        hits = counts.get('hit', 0) + counts.get('wait_hit', 0)
+        lookups = hits + counts.get('miss', 0)
+        counts['hit_rate'] = round(hits / lookups, 4) if lookups else None
+    return stats
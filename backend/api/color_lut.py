@@ -0,0 +1,158 @@
+"""
+Quantized RGB colour lookup table for per-pixel food voting.
+
+Every colour, quantized to `bits` bits per channel (32x32x32 by default), maps
+to the food it votes for, or to 0 for "no vote" (plate, table, background).
+The table is built offline from labelled reference images with
+`python manage.py build_color_lut` and memory-mapped at runtime, so all
+worker processes share the same read-only pages.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BITS = 5
+
+# File layout: header, UTF-8 JSON list of labels, then one byte per colour bin.
+MAGIC = b'NSLUT'
+VERSION = 1
+HEADER = struct.Struct('<5sBBxI')  # magic, version, bits, padding, labels length
+
+
+def quantized_colors(img, bits: int = DEFAULT_BITS) -> list:
+    """
+    Return [(count, bin_index), ...] for an RGB image quantized to `bits` per channel.
+    The per-colour tally is done in C by PIL (`getcolors`), not per pixel in Python.
+    """
+    shift = 8 - bits
+    quantized = img.point(lambda v: v >> shift)
+    colors = quantized.getcolors(maxcolors=img.width * img.height) or []
+    return [(count, (r << (2 * bits)) | (g << bits) | b) for count, (r, g, b) in colors]
+
+
+class ColorLUT:
+    """Read-only colour bin -> food label table."""
+
+    def __init__(self, labels: list, bits: int, table):
+        self.labels = labels
+        self.bits = bits
+        self.table = table
+
+    @classmethod
+    def open(cls, path: str) -> 'ColorLUT':
+        """Memory-map a LUT file written by `write_lut`."""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, bits, labels_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a colour LUT file (version {VERSION}): {path}")
+
+        offset = HEADER.size
+        labels = json.loads(mm[offset:offset + labels_len].decode('utf-8'))
+        offset += labels_len
+        table = memoryview(mm)[offset:offset + (1 << (3 * bits))]
+        return cls(labels, bits, table)
+
+    def vote(self, img) -> Counter:
+        """Tally per-pixel votes for an RGB image. Returns Counter(label -> pixel count)."""
+        return self.vote_colors(quantized_colors(img, self.bits), self.bits)
+
+    def vote_colors(self, colors: list, bits: int) -> Counter:
+        """
+        Tally votes from a `quantized_colors` histogram taken at `bits` per
+        channel, which may be finer than the LUT's own (e.g. stored features).
+        """
+        if bits < self.bits:
+            raise ValueError(f"Histogram has {bits} bits per channel, the LUT needs {self.bits}")
+        votes = Counter()
+        table = self.table
+        shift = bits - self.bits
+        mask = (1 << bits) - 1
+        for count, index in colors:
+            if shift:
+                r, g, b = (index >> (2 * bits)) >> shift, ((index >> bits) & mask) >> shift, (index & mask) >> shift
+                index = (r << (2 * self.bits)) | (g << self.bits) | b
+            label_index = table[index]
+            if label_index:
+                votes[self.labels[label_index - 1]] += count
+        return votes
+
+
+def build_lut(samples, bits: int = DEFAULT_BITS, min_purity: float = 0.6) -> ColorLUT:
+    """
+    Build a LUT from an iterable of (label, RGB image) reference samples.
+
+    Each bin votes for the label whose images use that colour most often,
+    normalised by the label's total pixel count so labels with more reference
+    images don't dominate. Bins shared across labels (below `min_purity`)
+    cast no vote, which is what keeps plates and backgrounds out of the tally.
+    """
+    bin_counts = defaultdict(Counter)
+    label_totals = Counter()
+    for label, img in samples:
+        for count, index in quantized_colors(img, bits):
+            bin_counts[index][label] += count
+            label_totals[label] += count
+
+    labels = sorted(label_totals)
+    if len(labels) > 255:
+        raise ValueError("A colour LUT supports at most 255 labels")
+    label_numbers = {label: n + 1 for n, label in enumerate(labels)}
+
+    table = bytearray(1 << (3 * bits))
+    for index, counts in bin_counts.items():
+        frequencies = {label: count / label_totals[label] for label, count in counts.items()}
+        label, best = max(frequencies.items(), key=lambda item: item[1])
+        if best / sum(frequencies.values()) >= min_purity:
+            table[index] = label_numbers[label]
+
+    return ColorLUT(labels, bits, bytes(table))
+
+
+def write_lut(lut: ColorLUT, path: str) -> None:
+    """Write a LUT to disk atomically."""
+    labels = json.dumps(lut.labels).encode('utf-8')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, lut.bits, len(labels)))
+        f.write(labels)
+        f.write(bytes(lut.table))
+    os.replace(tmp_path, path)
+
+
+# path -> (st_mtime_ns, ColorLUT or None) of the file last opened there; (None, None) if missing
+_opened = {}
+
+
+def load_lut(path: str):
+    """
+    The LUT at `path`, opened once per process and again after the file is
+    rewritten (write_lut replaces it, so its modification time changes).
+    Returns None if it is missing or invalid; the file is checked again on
+    every call, so a LUT built later is picked up.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError as e:
+        # Warn once, not for every image, until the file shows up
+        if _opened.get(path) != (None, None):
+            logger.warning("Colour LUT unavailable at %s: %s", path, e)
+            _opened[path] = (None, None)
+        return None
+    opened = _opened.get(path)
+    if opened is None or opened[0] != mtime_ns:
+        try:
+            lut = ColorLUT.open(path)
+        except (OSError, ValueError) as e:
+            logger.warning("Colour LUT unavailable at %s: %s", path, e)
+            lut = None
+        # Replacing the entry drops the old LUT's memory map
+        opened = _opened[path] = (mtime_ns, lut)
+    return opened[1]
@@ -0,0 +1,156 @@
+"""
+Keeping DailyNutritionLog totals consistent with the scans they summarize.
+
+A log is keyed by (user, UTC date the scan was made) and holds the sums of
+that day's scans. process_image adds each new scan; scan edits and deletes
+apply their difference with `apply_scan_change`. `rebuild_daily_logs`
+recomputes the totals from the scans with one grouped query and writes only
+the logs that differ, for drift from anything else (older versions, manual
+edits, bulk deletes). Every change is carried on into the users' rolling
+window sums (api/rolling_stats.py).
+"""
+import math
+from datetime import timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils.timezone import now
+
+from .models import DailyNutritionLog, NutritionScan
+from .rolling_stats import apply_log_change, reset_rolling_stats
+
+# Scan field -> DailyNutritionLog total it contributes to
+LOG_TOTALS = {'calories': 'total_calories', 'protein': 'total_protein', 'carbs': 'total_carbs', 'fat': 'total_fat'}
+
+
+def scan_values(scan) -> dict:
+    """A scan's contribution to its daily log."""
+    return {field: getattr(scan, field) for field in LOG_TOTALS}
+
+
+def get_or_create_log(user, date):
+    """
+    (log, created) for the user's log for `date`, like get_or_create. A new
+    log is counted in the rolling sums before it is written (see api/rolling_stats.py).
+    """
+    try:
+        return DailyNutritionLog.objects.get(user=user, date=date), False
+    except DailyNutritionLog.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            apply_log_change(user.pk, date, {'log_days': 1})
+            return DailyNutritionLog.objects.create(user=user, date=date), True
+    except IntegrityError:
+        # Created meanwhile; rolling back took our count out again
+        return DailyNutritionLog.objects.get(user=user, date=date), False
+
+
+def record_scan_added(scan, date) -> None:
+    """Count a scan in the rolling sums; call before adding it to the user's log for `date`."""
+    changes = {total: getattr(scan, field) for field, total in LOG_TOTALS.items()}
+    apply_log_change(scan.user_id, date, dict(changes, scan_count=1))
+
+
+def apply_scan_change(scan, before: dict = None, after: dict = None) -> None:
+    """
+    Adjust the scan's daily log by after - before (each a `scan_values` dict,
+    None for a scan that doesn't exist on that side) with a single UPDATE,
+    and the user's rolling sums with another. Call in a transaction.
+
+    Nothing is written when the totals don't change or the scan has no user.
+    A missing log is left missing; rebuild_daily_logs creates it.
+    """
+    if scan.user_id is None:
+        return
+    changes = {}
+    for field, total in LOG_TOTALS.items():
+        change = (after or {}).get(field, 0) - (before or {}).get(field, 0)
+        if change:
+            changes[total] = change
+    count_change = (after is not None) - (before is not None)
+    if count_change:
+        changes['scan_count'] = count_change
+    if not changes:
+        return
+    date = scan.created_at.date()
+    # The rolling sums first (see api/rolling_stats.py)
+    apply_log_change(scan.user_id, date, changes)
+    updated = DailyNutritionLog.objects.filter(user_id=scan.user_id, date=date).update(
+        updated_at=now(), **{field: F(field) + change for field, change in changes.items()}
+    )
+    if not updated:
+        # No log to change after all: take it back out of the rolling sums too
+        apply_log_change(scan.user_id, date, {field: -change for field, change in changes.items()})
+
+
+def rebuild_daily_logs(user_ids=None, start=None, end=None, dry_run=False) -> dict:
+    """
+    Recompute daily logs from the scans, optionally only for some users and
+    for dates in [start, end].
+
+    Totals come from one `GROUP BY user, date` aggregate; logs whose stored
+    totals differ are written with one bulk upsert. Logs left without scans
+    are zeroed rather than deleted. Returns counts of logs created, updated
+    and unchanged. Rewritten users' rolling sums are rebuilt on their next read.
+    """
+    scans = NutritionScan.objects.filter(user__isnull=False)
+    logs = DailyNutritionLog.objects.all()
+    if user_ids is not None:
+        scans = scans.filter(user_id__in=user_ids)
+        logs = logs.filter(user_id__in=user_ids)
+
+    # Logs are keyed by the UTC date, as now().date() in process_image
+    scans = scans.annotate(day=TruncDate('created_at', tzinfo=timezone.utc))
+    if start is not None:
+        scans = scans.filter(day__gte=start)
+        logs = logs.filter(date__gte=start)
+    if end is not None:
+        scans = scans.filter(day__lte=end)
+        logs = logs.filter(date__lte=end)
+
+    expected = {
+        (row.pop('user_id'), row.pop('day')): row
+        for row in scans.values('user_id', 'day').order_by().annotate(
+            scan_count=Count('id'), **{total: Sum(field) for field, total in LOG_TOTALS.items()}
+        )
+    }
+    stored = {
+        (log.user_id, log.date): log
+        for log in logs.only('id', 'user_id', 'date', *LOG_TOTALS.values(), 'scan_count')
+    }
+    empty = dict({total: 0.0 for total in LOG_TOTALS.values()}, scan_count=0)
+
+    rows = []
+    created = updated = unchanged = 0
+    for key in expected.keys() | stored.keys():
+        totals = expected.get(key, empty)
+        log = stored.get(key)
+        if log is not None and _same_totals(log, totals):
+            unchanged += 1
+            continue
+        if log is None:
+            created += 1
+        else:
+            updated += 1
+        user_id, date = key
+        rows.append(DailyNutritionLog(user_id=user_id, date=date, **totals))
+
+    if rows and not dry_run:
+        DailyNutritionLog.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True, unique_fields=['user', 'date'],
+            update_fields=[*LOG_TOTALS.values(), 'scan_count', 'updated_at'],
+        )
+        reset_rolling_stats({row.user_id for row in rows})
+    return {'created': created, 'updated': updated, 'unchanged': unchanged}
+
+
+def _same_totals(log, totals: dict) -> bool:
+    if log.scan_count != totals['scan_count']:
+        return False
+    # Sums of floats depend on the order they were added in
+    return all(
+        math.isclose(getattr(log, total), totals[total], rel_tol=1e-9, abs_tol=1e-6)
+        for total in LOG_TOTALS.values()
+    )
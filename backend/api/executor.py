@@ -0,0 +1,41 @@
+"""
+Bounded executor for CPU-bound image analysis.
+
+The async upload view hands decode/analysis work to this pool so the event
+loop stays free to accept and read other uploads. Set
+NUTRISCAN_ANALYSIS_EXECUTOR to 'process' to sidestep the GIL for the
+pure-Python colour loops, or 'thread' (default) to keep everything in-process.
+"""
+import threading
+
+import django
+from django.conf import settings
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_analysis_executor():
+    """Return the process-wide analysis executor, creating it on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Imported here: the process pool pulls in multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+            workers = settings.NUTRISCAN_ANALYSIS_WORKERS
+            if settings.NUTRISCAN_ANALYSIS_EXECUTOR == 'process':
+                # Spawned children (macOS/Windows) need Django configured again
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        return _executor
+
+
+def shutdown_analysis_executor(wait: bool = True) -> None:
+    """Stop the executor (e.g. on server shutdown); the next call to get_analysis_executor starts a new one."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,89 @@
+"""
+Stored image features: everything the detector classifies from, in a compact
+binary form, so scans can be re-classified without decoding the image again.
+
+One payload holds, for one image:
+- full stage: colour profile, pixel count and quantized colour histogram of
+  the 200px thumbnail analyze_image uses
+- coarse stage: the same for the tiny cascade decode (at `coarse_size`)
+- plate tiles: mean and variance per tile of the plate grid (at `grid`)
+
+Layout (zlib-compressed, little-endian):
+    header   magic, schema version, coarse_size, grid
+    stage x2 profile (6 x u32), pixels (u32), colour bits (u8), n colours (u32),
+             then n colour bins (u16) and n counts (u32)
+    tiles    n tiles (u16), then 6 x u32 per tile
+
+Bump FEATURE_SCHEMA_VERSION whenever the layout or the way a value is
+computed changes; older payloads then raise FeaturesUnavailable and callers
+fall back to the image.
+"""
+import struct
+import zlib
+from collections import namedtuple
+
+FEATURE_SCHEMA_VERSION = 2
+# Histograms are stored at this many bits per channel (LUTs with more need the image)
+FEATURE_BITS = 5
+
+MAGIC = b'NSFT'
+_HEADER = struct.Struct('<4sBHB')
+_STAGE = struct.Struct('<7IBI')
+_TILE_COUNT = struct.Struct('<H')
+
+PROFILE_KEYS = ('avg_r', 'avg_g', 'avg_b', 'r_var', 'g_var', 'b_var')
+
+# profile: dict as built by LocalFoodDetector._profile_image
+# colors: [(count, bin_index), ...] as returned by color_lut.quantized_colors at `bits`
+StageFeatures = namedtuple('StageFeatures', ['profile', 'pixels', 'colors', 'bits'])
+# tiles: [(avg_r, avg_g, avg_b, r_var, g_var, b_var), ...] in row-major order
+ImageFeatures = namedtuple('ImageFeatures', ['coarse_size', 'grid', 'full', 'coarse', 'tiles'])
+
+
+class FeaturesUnavailable(Exception):
+    """Stored features can't reproduce the requested analysis; analyze the image instead."""
+
+
+def encode_features(features: ImageFeatures) -> bytes:
+    parts = [_HEADER.pack(MAGIC, FEATURE_SCHEMA_VERSION, features.coarse_size, features.grid)]
+    for stage in (features.full, features.coarse):
+        counts = [count for count, _ in stage.colors]
+        bins = [index for _, index in stage.colors]
+        parts.append(_STAGE.pack(
+            *(stage.profile[key] for key in PROFILE_KEYS), stage.pixels, stage.bits, len(stage.colors)
+        ))
+        parts.append(struct.pack(f'<{len(bins)}H', *bins))
+        parts.append(struct.pack(f'<{len(counts)}I', *counts))
+    parts.append(_TILE_COUNT.pack(len(features.tiles)))
+    parts.append(struct.pack(f'<{6 * len(features.tiles)}I', *(value for tile in features.tiles for value in tile)))
+    return zlib.compress(b''.join(parts))
+
+
+def decode_features(payload: bytes) -> ImageFeatures:
+    """Inverse of encode_features. Raises FeaturesUnavailable for other schema versions or bad data."""
+    try:
+        data = zlib.decompress(payload)
+        magic, version, coarse_size, grid = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FEATURE_SCHEMA_VERSION:
+            raise FeaturesUnavailable(f'Feature schema {version} is not {FEATURE_SCHEMA_VERSION}')
+        offset = _HEADER.size
+
+        stages = []
+        for _ in range(2):
+            *profile_values, pixels, bits, n = _STAGE.unpack_from(data, offset)
+            offset += _STAGE.size
+            bins = struct.unpack_from(f'<{n}H', data, offset)
+            offset += 2 * n
+            counts = struct.unpack_from(f'<{n}I', data, offset)
+            offset += 4 * n
+            profile = dict(zip(PROFILE_KEYS, profile_values))
+            profile['brightness'] = (profile['avg_r'] + profile['avg_g'] + profile['avg_b']) // 3
+            stages.append(StageFeatures(profile, pixels, list(zip(counts, bins)), bits))
+
+        (n_tiles,) = _TILE_COUNT.unpack_from(data, offset)
+        offset += _TILE_COUNT.size
+        values = struct.unpack_from(f'<{6 * n_tiles}I', data, offset)
+        tiles = [values[i:i + 6] for i in range(0, len(values), 6)]
+    except (zlib.error, struct.error, TypeError) as e:
+        raise FeaturesUnavailable(f'Unreadable feature payload: {e}')
+    return ImageFeatures(coarse_size, grid, stages[0], stages[1], tiles)
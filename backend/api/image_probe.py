@@ -0,0 +1,102 @@
+"""
+Pre-decode validation for uploaded images.
+
+Only the image header is read (format, dimensions, frame count), so oversized
+or malicious uploads are rejected before any pixels are decoded, anything is
+written to storage, or a scan row is created. PIL is imported on first use.
+"""
+import io
+import os
+import warnings
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'GIF', 'BMP'}
+
+# JPEG can be decoded at 1/8 scale per side, which keeps downscaling cheap
+JPEG_FORMATS = {'JPEG', 'MPO'}
+JPEG_MAX_REDUCTION = 8 * 8
+
+ImageProbe = namedtuple('ImageProbe', ['format', 'width', 'height', 'frames'])
+
+
+class ImageRejected(Exception):
+    """An upload failed validation; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def probe_image(upload) -> ImageProbe:
+    """Read only the header of an uploaded image. Raises ImageRejected if it isn't one."""
+    from PIL import Image
+
+    upload.seek(0)
+    try:
+        with warnings.catch_warnings():
+            # The pixel budget is enforced by guard_upload, not PIL's bomb warning
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            img = Image.open(upload)
+        # Not closed: that would close the upload itself
+        return ImageProbe(img.format, img.width, img.height, getattr(img, 'n_frames', 1))
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(f'Image is too large: {e}', status_code=413)
+    except (OSError, SyntaxError, ValueError):
+        raise ImageRejected('File is not a valid image')
+    finally:
+        upload.seek(0)
+
+
+def guard_upload(upload):
+    """
+    Check an upload against the configured byte, pixel and frame budgets.
+
+    Returns the upload unchanged, or (with NUTRISCAN_OVERSIZE_POLICY =
+    'downscale') a smaller JPEG re-encode of an over-budget JPEG. Raises
+    ImageRejected for anything that can't be accepted cheaply.
+    """
+    if upload.size > settings.NUTRISCAN_MAX_UPLOAD_BYTES:
+        raise ImageRejected(
+            f'Image exceeds {settings.NUTRISCAN_MAX_UPLOAD_BYTES} bytes', status_code=413
+        )
+
+    probe = probe_image(upload)
+    if probe.format not in ALLOWED_FORMATS:
+        raise ImageRejected(f'Unsupported image format: {probe.format}')
+    if probe.frames > settings.NUTRISCAN_MAX_IMAGE_FRAMES:
+        raise ImageRejected(f'Image has too many frames ({probe.frames})', status_code=413)
+
+    pixels = probe.width * probe.height
+    if pixels <= settings.NUTRISCAN_MAX_IMAGE_PIXELS:
+        return upload
+
+    if (settings.NUTRISCAN_OVERSIZE_POLICY == 'downscale'
+            and probe.format in JPEG_FORMATS
+            and pixels <= settings.NUTRISCAN_MAX_IMAGE_PIXELS * JPEG_MAX_REDUCTION):
+        return downscale_upload(upload, settings.NUTRISCAN_STORAGE_MAX_DIMENSION)
+
+    raise ImageRejected(
+        f'Image is {probe.width}x{probe.height}, over the {settings.NUTRISCAN_MAX_IMAGE_PIXELS} pixel limit',
+        status_code=413,
+    )
+
+
+def downscale_upload(upload, max_dimension: int) -> ContentFile:
+    """Re-encode a JPEG upload to fit within max_dimension, decoding at reduced scale."""
+    from PIL import Image
+
+    upload.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        img = Image.open(upload)
+        img.draft('RGB', (max_dimension, max_dimension))
+        img = img.convert('RGB')
+    img.thumbnail((max_dimension, max_dimension))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    name = os.path.splitext(os.path.basename(upload.name or 'upload'))[0] + '.jpg'
+    return ContentFile(buffer.getvalue(), name=name)
@@ -0,0 +1,321 @@
+"""
+Upload ingest pipeline shared by the sync and async process_image views.
+
+`analyze_upload` only reads the stored image and returns a result dict, so it
+can run in a worker thread or process away from the request.
+"""
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .admission import AnalysisOverloaded, get_admission
+from .cache import ANALYSIS, CATALOG
+from .executor import get_analysis_executor
+from .features import FEATURE_SCHEMA_VERSION, FeaturesUnavailable, decode_features, encode_features
+from .log_pipeline import kv
+from .memory_profile import memory_span
+from .metrics import metrics
+from .local_food_detector import LocalFoodDetector, match_food_from_filename
+from .isolation import AnalysisAborted
+from .models import FoodItem, ScanFeatures
+from .services import NutritionAnalysisService
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_basename(original_filename: str, stored_name: str) -> str:
+    """Name used for filename matching: the client's original name, else the file's name."""
+    # First, check if original filename was sent as form field (from updated frontend)
+    if original_filename:
+        return original_filename
+    # Fallback to the uploaded file's own name
+    return os.path.basename(stored_name)
+
+
+def match_filename(basename: str):
+    """
+    Demo nutrition for a food named in the filename, or None.
+
+    This allows uploads like "biryani.jpg", "my_rice_photo.jpg", "paneer_curry.jpg" etc.
+    to return the corresponding demo nutrition without requiring exact demo filenames.
+    """
+    # Try to match any known food in the uploaded filename
+    matched_food = match_food_from_filename(basename)
+
+    detector_db = LocalFoodDetector.FOOD_DATABASE
+
+    # One record per upload; values are only formatted if the record is written
+    logger.info('upload.filename_match', extra=kv(basename=basename, matched=matched_food))
+
+    # If a food name was detected in the filename, use demo nutrition
+    if matched_food and matched_food in detector_db:
+        data = detector_db[matched_food]
+        return {
+            'food_item': matched_food.title(),
+            'calories': data.get('calories', 0),
+            'protein': data.get('protein', 0),
+            'carbs': data.get('carbs', 0),
+            'fat': data.get('fat', 0),
+            'portion_size': data.get('portion', '1 plate'),
+            'confidence': 98.0  # High confidence for filename-matched foods
+        }
+    return None
+
+
+def analysis_kind(analysis_mode: str = '') -> str:
+    """'coarse', 'plate' or 'full' for a request's analysis_mode (empty uses the configured default)."""
+    analysis_mode = (analysis_mode or '').strip().lower()
+    if analysis_mode == 'coarse':
+        return 'coarse'
+    if analysis_mode == 'plate' or (not analysis_mode and settings.NUTRISCAN_PLATE_ANALYSIS):
+        return 'plate'
+    return 'full'
+
+
+@memory_span('analysis')
+def analyze_stored_image(image_path: str, analysis_mode: str = '', extract_features: bool = False) -> dict:
+    """
+    Analyze the image itself.
+    'plate' splits mixed plates into items; 'coarse' is the cheap first cascade
+    stage used to shed load.
+
+    With `extract_features` the image's features are extracted first and
+    classified, and the encoded features are returned under 'features' for the
+    caller to store. Extraction decodes the image at every stage, skipping
+    the cascade's early exit and the plate budget, so only batch commands
+    ask for it (see analyze_upload); uploads are analyzed directly and get
+    their features afterwards (queue_feature_extraction). The coarse
+    load-shedding path never extracts.
+    """
+    analysis_service = NutritionAnalysisService()
+    kind = analysis_kind(analysis_mode)
+    logger.info('upload.image_analysis', extra=kv(mode=(analysis_mode or '').strip().lower() or 'default'))
+
+    features = None
+    if extract_features and kind != 'coarse':
+        try:
+            features = analysis_service.detector.extract_features(image_path, grid=settings.NUTRISCAN_PLATE_GRID)
+        except Exception as extract_error:
+            logger.warning('Could not extract image features: %s', extract_error, extra=kv(path=image_path))
+
+    try:
+        result = None
+        if features is not None:
+            try:
+                result = analysis_service.analyze_features(features, kind)
+            except FeaturesUnavailable:
+                pass  # e.g. plate tiles in 'lut' mode; the image path below still works
+        if result is None:
+            if kind == 'coarse':
+                result = analysis_service.analyze_image_coarse(image_path)
+            elif kind == 'plate':
+                result = analysis_service.analyze_plate(image_path)
+            else:
+                result = analysis_service.analyze_image(image_path)
+    except Exception as analyze_error:
+        logger.warning('Could not analyze image, using mock analysis: %s', analyze_error,
+                       extra=kv(path=image_path))
+        result = analysis_service.get_mock_analysis()
+        result['fallback'] = True  # Not the image's own analysis: never cached
+        return result
+
+    if features is not None:
+        result['features'] = encode_features(features)
+    return result
+
+
+def analyze_image_isolated(image_path: str, analysis_mode: str = '', degraded: bool = False) -> dict:
+    """
+    analyze_stored_image, in an isolated worker process when
+    NUTRISCAN_ANALYSIS_ISOLATION is on. Raises AnalysisAborted if the
+    analysis had to be killed. A `degraded` analysis (one admission turned
+    away) only uses the pool's spare workers, and raises AnalysisOverloaded
+    rather than wait for one.
+    """
+    if not settings.NUTRISCAN_ANALYSIS_ISOLATION:
+        return analyze_stored_image(image_path, analysis_mode)
+    from .isolation import get_isolated_pool
+
+    return get_isolated_pool().run(analyze_stored_image, image_path, analysis_mode, spare=degraded)
+
+
+def analyze_image_cached(image_path: str, analysis_mode: str = '', degraded: bool = False) -> dict:
+    """
+    analyze_image_isolated through the shared analysis cache: an image whose
+    content was already analyzed with the same settings, by any worker, isn't
+    analyzed again, and concurrent uploads of it are analyzed once.
+    """
+    key = analysis_cache_key(image_path, analysis_kind(analysis_mode))
+    return ANALYSIS.get_or_compute(
+        key, lambda: analyze_image_isolated(image_path, analysis_mode, degraded),
+        cacheable=lambda result: not result.get('fallback'),
+    )
+
+
+def analyze_admitted(image_path: str, analysis_mode: str = ''):
+    """
+    (result, degraded): analyze_image_cached in an admission slot, or the
+    coarse stage when none is free and NUTRISCAN_OVERLOAD_DEGRADE is on.
+    Raises AnalysisOverloaded otherwise, or when the coarse stage can't get a
+    spare isolated worker either. For callers that analyze away from
+    the request thread, like archive uploads.
+    """
+    try:
+        with get_admission().slot():
+            return analyze_image_cached(image_path, analysis_mode), False
+    except AnalysisOverloaded:
+        if not settings.NUTRISCAN_OVERLOAD_DEGRADE:
+            raise
+    metrics.incr('admission.degraded')
+    return analyze_image_cached(image_path, 'coarse', degraded=True), True
+
+
+def analysis_cache_key(image_path: str, kind: str) -> str:
+    """The image's content hash plus a digest of every setting its `kind` analysis depends on."""
+    lut_version = None
+    if settings.NUTRISCAN_DETECTOR_MODE == 'lut':
+        try:
+            lut_version = os.stat(settings.NUTRISCAN_COLOR_LUT_PATH).st_mtime_ns  # Rebuilt in place
+        except OSError:
+            pass
+    config = (
+        kind, settings.NUTRISCAN_DETECTOR_MODE,
+        settings.NUTRISCAN_COLOR_LUT_PATH, lut_version, settings.NUTRISCAN_CASCADE,
+        settings.NUTRISCAN_CASCADE_COARSE_SIZE, settings.NUTRISCAN_CASCADE_MARGIN,
+        settings.NUTRISCAN_PLATE_GRID, settings.NUTRISCAN_PLATE_BUDGET_MS,
+    )
+    return f'{hash_file(image_path)}:{kind}:{hashlib.sha256(repr(config).encode()).hexdigest()[:16]}'
+
+
+def analyze_upload(basename: str, image_path: str, analysis_mode: str = '') -> dict:
+    """
+    Nutrition result for a stored image in a batch command: filename match
+    first, else image analysis, with its features when NUTRISCAN_FEATURE_STORE is on.
+    """
+    return match_filename(basename) or analyze_stored_image(
+        image_path, analysis_mode, extract_features=settings.NUTRISCAN_FEATURE_STORE
+    )
+
+
+def analyze_features_payload(basename: str, payload, analysis_mode: str = '') -> dict:
+    """
+    Same result as analyze_upload, from a stored ScanFeatures payload instead of the image.
+    Raises FeaturesUnavailable when the image has to be analyzed after all.
+    """
+    result = match_filename(basename)
+    if result is not None:
+        return result
+    if payload is None:
+        raise FeaturesUnavailable('No stored features')
+    return NutritionAnalysisService().analyze_features(decode_features(payload), analysis_kind(analysis_mode))
+
+
+def features_row(scan, result: dict):
+    """Unsaved ScanFeatures for a result from analyze_stored_image, or None if it has no features."""
+    payload = result.get('features')
+    if payload is None:
+        return None
+    return ScanFeatures(scan=scan, schema_version=FEATURE_SCHEMA_VERSION, payload=payload)
+
+
+def queue_feature_extraction(scan) -> None:
+    """
+    With NUTRISCAN_FEATURE_STORE, extract an uploaded scan's features in the
+    analysis executor once the scan is committed, after its response.
+    """
+    if not settings.NUTRISCAN_FEATURE_STORE:
+        return
+    scan_id, image_path = scan.pk, scan.image.path
+    transaction.on_commit(lambda: get_analysis_executor().submit(store_scan_features, scan_id, image_path))
+
+
+def store_scan_features(scan_id, image_path: str) -> None:
+    """
+    Extract and store a scan's ScanFeatures (see queue_feature_extraction).
+    Uploads come first: with no analysis slot free right away, or the image
+    too much for its isolated worker, the scan is left for reanalyze_scans.
+    """
+    try:
+        with get_admission().slot(wait=False):
+            payload = extract_features_isolated(image_path)
+    except (AnalysisOverloaded, AnalysisAborted):
+        metrics.incr('features.deferred')
+        return
+    except Exception as extract_error:
+        logger.warning('Could not extract image features: %s', extract_error, extra=kv(path=image_path))
+        return
+    try:
+        ScanFeatures.objects.create(scan_id=scan_id, schema_version=FEATURE_SCHEMA_VERSION, payload=payload)
+    except IntegrityError:
+        pass  # The scan was deleted meanwhile, or a backfill stored its features first
+    else:
+        metrics.incr('features.stored')
+
+
+def extract_features_isolated(image_path: str) -> bytes:
+    """The image's encoded features, extracted in an isolated worker when NUTRISCAN_ANALYSIS_ISOLATION is on."""
+    if not settings.NUTRISCAN_ANALYSIS_ISOLATION:
+        return extract_features_payload(image_path)
+    from .isolation import get_isolated_pool
+
+    return get_isolated_pool().run(extract_features_payload, image_path)
+
+
+def extract_features_payload(image_path: str) -> bytes:
+    detector = NutritionAnalysisService().detector
+    return encode_features(detector.extract_features(image_path, grid=settings.NUTRISCAN_PLATE_GRID))
+
+
+def apply_result(scan, result: dict) -> None:
+    """Copy an analysis result onto a scan (not saved)."""
+    scan.food_item = result.get('food_item', 'Unknown Food')
+    scan.calories = result.get('calories', 0)
+    scan.protein = result.get('protein', 0)
+    scan.carbs = result.get('carbs', 0)
+    scan.fat = result.get('fat', 0)
+    scan.portion_size = result.get('portion_size', '1 plate')
+    scan.confidence = result.get('confidence', 0)
+    scan.items = result.get('items', [])
+
+
+def main_food_name(result: dict) -> str:
+    """Name of a result's main food: the largest item on a plate, else the food_item."""
+    items = result.get('items') or []
+    name = items[0].get('food_item', '') if items else result.get('food_item', '')
+    return (name or '').strip()
+
+
+def catalog_food_ids() -> dict:
+    """{lower-case name: pk} for the whole FoodItem catalog, from the shared cache."""
+    return CATALOG.get_or_compute(
+        'food_ids', lambda: {name.lower(): pk for pk, name in FoodItem.objects.values_list('pk', 'name')}
+    )
+
+
+def food_id_for(name: str):
+    """pk of the FoodItem called `name` (any case), or None when it isn't in the catalog."""
+    return catalog_food_ids().get((name or '').strip().lower())
+
+
+def invalidate_catalog(**kwargs) -> None:
+    """
+    FoodItem post_save/post_delete receiver: drop the cached catalog now, and
+    again on commit in case another worker re-cached it from before the change.
+    Bulk changes (bulk_create, update) send no signals; the catalog TTL bounds those.
+    """
+    CATALOG.bump()
+    transaction.on_commit(CATALOG.bump)
@@ -0,0 +1,258 @@
+"""
+Image analysis in isolated worker processes with hard limits.
+
+A crafted or pathological image can keep PIL's decoder busy (or allocating)
+indefinitely, and nothing inside the web process can interrupt it. With
+NUTRISCAN_ANALYSIS_ISOLATION each analysis instead runs in one of a few
+long-lived subprocesses, and the caller waits at most
+NUTRISCAN_ANALYSIS_TASK_TIMEOUT seconds for its answer. A worker that
+overruns is killed, and one that dies (e.g. a crash in a decoder) is
+discarded; either way the caller gets AnalysisAborted and the next task gets
+a fresh worker. Each worker's address space may grow by at most
+NUTRISCAN_ANALYSIS_MEMORY_LIMIT_MB past its size at start (POSIX), so a
+decompression bomb fails with MemoryError instead of swapping the host.
+
+concurrent.futures' ProcessPoolExecutor isn't used: it can't stop a running
+task, and one dead worker breaks the whole pool.
+
+Analyses the admission controller turned away and degraded to the coarse
+stage (NUTRISCAN_OVERLOAD_DEGRADE) run on a few spare workers instead of
+waiting for an admitted analysis to finish; when those are busy too the
+caller gets AnalysisOverloaded straight away.
+
+Workers are forked where the platform does so, and keep the settings they
+were started with. Metrics the analysis records in a worker are sent back
+with each result and merged into this process's registry.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+
+from .admission import AnalysisOverloaded
+from .metrics import metrics
+
+
+class AnalysisAborted(Exception):
+    """An isolated analysis was stopped; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 422):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _limit_memory(limit_mb: int) -> None:
+    """Let this process's address space grow by at most limit_mb (no-op where RLIMIT_AS is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return  # Windows
+    try:
+        with open('/proc/self/statm') as f:
+            baseline = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        baseline = 0
+    limit = baseline + limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def _worker_main(conn, memory_limit_mb: int) -> None:
+    """Run tasks received on `conn` until told to stop: reply (outcome, value, metrics) for each."""
+    from django.apps import apps
+
+    if not apps.ready:
+        # Spawned children (macOS/Windows) need Django configured again
+        import django
+        django.setup()
+    metrics.reset()  # Counters inherited across fork are the parent's
+    if memory_limit_mb:
+        _limit_memory(memory_limit_mb)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        fn, args = task
+        try:
+            reply = ('ok', fn(*args))
+        except Exception as e:
+            reply = ('error', e)
+        try:
+            conn.send(reply + (metrics.drain(),))
+        except Exception as e:  # An unpicklable result or exception
+            conn.send(('error', RuntimeError(f'{type(e).__name__}: {e}'), {}))
+    logging.shutdown()
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit_mb), name='analysis-isolated', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=None if kill else 1)
+        self.conn.close()
+
+
+class IsolatedPool:
+    """
+    Up to `size` single-task worker processes, plus `spare` more for spare
+    tasks; a task that overruns `timeout` is killed with its worker.
+    """
+
+    def __init__(self, size: int, timeout: float, memory_limit_mb: int = 0, max_tasks: int = 0, spare: int = 0):
+        self.size = size
+        self.spare = spare
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks = max_tasks
+        self._context = multiprocessing.get_context()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._live = 0  # Workers started and not yet stopped, idle or busy
+        self._busy = 0  # Tasks running, other than spare ones
+        self._spare_busy = 0
+
+    def state(self) -> dict:
+        """Current workers, for the metrics endpoint."""
+        with self._cond:
+            return {'workers': self._live, 'idle': len(self._idle), 'size': self.size + self.spare}
+
+    def run(self, fn, *args, spare: bool = False):
+        """
+        fn(*args) in a worker process; fn, args and the result must pickle.
+        Exceptions fn raises are re-raised here. Raises AnalysisAborted if the
+        task times out or its worker dies.
+
+        At most `size` tasks run at once, and further ones wait for a worker.
+        A `spare` task never waits: it runs on one of the `spare` workers kept
+        for such tasks, or raises AnalysisOverloaded when they're all busy.
+        """
+        worker = self._acquire(spare)
+        healthy = False
+        try:
+            try:
+                worker.conn.send((fn, args))
+                if not worker.conn.poll(self.timeout):
+                    metrics.incr('isolation.timeouts')
+                    raise AnalysisAborted(f'Image analysis did not finish within {self.timeout:g}s')
+                outcome, value, worker_metrics = worker.conn.recv()
+            except (EOFError, OSError):
+                metrics.incr('isolation.crashes')
+                raise AnalysisAborted('Image analysis worker exited unexpectedly')
+            healthy = True
+        finally:
+            self._release(worker, healthy, spare)
+
+        metrics.merge(worker_metrics)
+        if outcome == 'error':
+            raise value
+        return value
+
+    def shutdown(self) -> None:
+        """Stop the idle workers; busy ones stop when their task returns."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._live -= len(idle)
+            self.size = self.spare = 0
+        for worker in idle:
+            worker.stop()
+
+    def _acquire(self, spare: bool) -> _Worker:
+        with self._cond:
+            if spare:
+                if self._spare_busy >= self.spare:
+                    metrics.incr('isolation.spare_exhausted')
+                    raise AnalysisOverloaded(1)
+                self._spare_busy += 1
+            else:
+                while self._busy >= self.size:
+                    self._cond.wait()
+                self._busy += 1
+            # Each kind of task stays within its share, so a worker is idle or may be started
+            if self._idle:
+                return self._idle.pop()
+            self._live += 1
+        try:
+            worker = _Worker(self._context, self.memory_limit_mb)
+        except BaseException:
+            with self._cond:
+                self._live -= 1
+                self._done(spare)
+            raise
+        metrics.incr('isolation.workers_started')
+        return worker
+
+    def _release(self, worker: _Worker, healthy: bool, spare: bool) -> None:
+        worker.tasks += 1
+        retire = not healthy or (self.max_tasks and worker.tasks >= self.max_tasks)
+        with self._cond:
+            if retire or self._live > self.size + self.spare:
+                self._live -= 1
+            else:
+                self._idle.append(worker)
+                worker = None
+            self._done(spare)
+        if worker is not None:
+            # Killed mid-task; a healthy one just finishes its loop. The next task starts a replacement.
+            worker.stop(kill=not healthy)
+
+    def _done(self, spare: bool) -> None:
+        """Give back a task's share of the pool; call with self._cond held."""
+        if spare:
+            self._spare_busy -= 1
+        else:
+            self._busy -= 1
+            self._cond.notify()
+
+
+_pool = None
+_lock = threading.Lock()
+
+
+def get_isolated_pool() -> IsolatedPool:
+    """Return the process-wide isolated pool, creating it on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = IsolatedPool(
+                # One worker per admission slot, so admitted analyses never wait here
+                size=settings.NUTRISCAN_ANALYSIS_MAX_CONCURRENT,
+                spare=settings.NUTRISCAN_ANALYSIS_SPARE_WORKERS if settings.NUTRISCAN_OVERLOAD_DEGRADE else 0,
+                timeout=settings.NUTRISCAN_ANALYSIS_TASK_TIMEOUT,
+                memory_limit_mb=settings.NUTRISCAN_ANALYSIS_MEMORY_LIMIT_MB,
+                max_tasks=settings.NUTRISCAN_ANALYSIS_WORKER_MAX_TASKS,
+            )
+        return _pool
+
+
+def shutdown_isolated_pool() -> None:
+    """Stop the pool's workers; the next call to get_isolated_pool starts a new pool."""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
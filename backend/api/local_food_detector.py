@@ -1,9 +1,49 @@
 """
 Local food detection without external APIs.
 Uses image color analysis + heuristics to identify common foods.
+
+PIL is imported where images are opened, so importing this module (e.g. for
+filename matching) doesn't load the image stack.
 """
-from PIL import Image
-from collections import Counter
+from array import array
+from collections import Counter, defaultdict
+import logging
+import time
+
+from .color_lut import load_lut, quantized_colors
+from .features import FEATURE_BITS, FeaturesUnavailable, ImageFeatures, StageFeatures
+from .memory_profile import memory_span
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Food names recognised in uploaded filenames.
+# Ordered by length (longest first) to prioritize "tandoori chicken" over "chicken".
+KNOWN_FOODS = [
+    'tandoori chicken', 'biryani', 'samosa', 'sandwich',
+    'paneer', 'salad', 'pizza', 'pasta', 'naan', 'bread',
+    'sushi', 'apple', 'banana', 'burger', 'chicken',
+    'rice', 'idli', 'dal', 'egg', 'fish'
+]
+
+
+def match_food_from_filename(filename: str):
+    """
+    Return the known food named in a filename, or None.
+    Handles names like "biryani.jpg", "my_rice_photo.jpg", "chicken_tandoori.jpg".
+    """
+    # Replace underscores with spaces (e.g., "tandoori_chicken" -> "tandoori chicken")
+    filename_normalized = filename.lower().replace('_', ' ')
+    for food in KNOWN_FOODS:
+        if food == 'tandoori chicken':
+            # For "tandoori chicken", check if both words appear OR just "tandoori"
+            # This handles "tandoori_grilled.jpg", "chicken_tandoori.jpg", "tandoori_chicken.jpg"
+            if 'tandoori' in filename_normalized and ('chicken' in filename_normalized or 'grilled' in filename_normalized):
+                return 'tandoori chicken'
+        elif food in filename_normalized:
+            return food  # Use first match (longest food names prioritized)
+    return None
 
 
 class LocalFoodDetector:
@@ -92,42 +132,431 @@ class LocalFoodDetector:
         },
     }
     
+    # Detector modes: whole-image average colour, or per-pixel LUT voting
+    MODE_AVERAGE = 'average'
+    MODE_LUT = 'lut'
+
+    # LUT voting: minimum share of pixels that must cast a vote before the
+    # result is trusted; otherwise fall back to the average-colour rules.
+    LUT_MIN_COVERAGE = 0.05
+
+    # Plate analysis: tiles at least this bright and this neutral are empty plate
+    PLATE_MIN_CHANNEL = 235
+    PLATE_MAX_SPREAD = 15
+    # Tiles only reaching the brightness fallback rules (e.g. plate edges
+    # mixed with food) are left unlabelled
+    PLATE_MIN_TILE_CONFIDENCE = 60.0
+    # Regions smaller than this share of the food tiles are treated as noise
+    PLATE_MIN_REGION_SHARE = 0.1
+
+    # Cascade: a coarse-stage label must survive this much perturbation of the
+    # average colour (colour rules) or lead the runner-up by this share of the
+    # votes (LUT) to exit early; anything closer escalates to the full stage.
+    CASCADE_COLOR_MARGIN = 6
+    CASCADE_VOTE_LEAD = 0.5
+
+    def __init__(self, mode: str = MODE_AVERAGE, lut_path: str = None,
+                 cascade: bool = False, coarse_size: int = 32, cascade_margin: int = None):
+        self.mode = mode
+        self.lut_path = lut_path
+        self.cascade = cascade
+        self.coarse_size = coarse_size
+        self.cascade_margin = self.CASCADE_COLOR_MARGIN if cascade_margin is None else cascade_margin
+
+    @memory_span('detector.analyze_image')
     def analyze_image(self, image_path: str) -> tuple:
         """
         Analyze food image using color histogram heuristics.
         Returns (food_name, confidence, nutrition_dict)
         """
         try:
+            if self.cascade:
+                coarse = self._analyze_coarse(image_path)
+                if coarse:
+                    metrics.incr('cascade.exit.coarse')
+                    return coarse
+                metrics.incr('cascade.exit.full')
+
+            from PIL import Image
             img = Image.open(image_path).convert('RGB')
             # Resize for faster processing
             img.thumbnail((200, 200))
-            
-            # Get dominant colors and color distribution
-            pixels = list(img.getdata())
-            r_vals = [p[0] for p in pixels]
-            g_vals = [p[1] for p in pixels]
-            b_vals = [p[2] for p in pixels]
-            
-            avg_r = sum(r_vals) // len(r_vals) if r_vals else 128
-            avg_g = sum(g_vals) // len(g_vals) if g_vals else 128
-            avg_b = sum(b_vals) // len(b_vals) if b_vals else 128
-            
-            # Analyze color distribution
-            color_profile = self._get_color_profile(avg_r, avg_g, avg_b, r_vals, g_vals, b_vals)
-            
-            # Detect food based on color profile
-            detected_food, confidence = self._match_food_by_colors(color_profile)
-            
-            if detected_food and detected_food in self.FOOD_DATABASE:
-                nutrition = self.FOOD_DATABASE[detected_food]
-                return detected_food, confidence, nutrition
-            
-            # Fallback
-            return 'rice', 65.0, self.FOOD_DATABASE['rice']
+
+            return self._full_decision(
+                lambda: self._profile_image(img), lambda: self._image_votes(img), img.width * img.height
+            )
         except Exception as e:
             print(f"Error in local food detection: {e}")
             return 'rice', 50.0, self.FOOD_DATABASE['rice']
     
+    def analyze_image_coarse(self, image_path: str) -> tuple:
+        """
+        Classify from the coarse cascade stage only, however close the call.
+        Used to shed load when the analysis queue is full.
+        Returns (food_name, confidence, nutrition_dict)
+        """
+        try:
+            return self._coarse_only_decision(self._profile_image(self._open_coarse(image_path)))
+        except Exception as e:
+            print(f"Error in local food detection: {e}")
+            return 'rice', 50.0, self.FOOD_DATABASE['rice']
+
+    def _open_coarse(self, image_path: str):
+        """
+        Tiny decode for the coarse stage. JPEGs are decoded at reduced DCT
+        scale, so large photos never pay for a full decode here.
+        """
+        from PIL import Image
+
+        img = Image.open(image_path)
+        img.draft('RGB', (self.coarse_size, self.coarse_size))
+        img = img.convert('RGB')
+        img.thumbnail((self.coarse_size, self.coarse_size))
+        return img
+
+    def _analyze_coarse(self, image_path: str):
+        """
+        First cascade stage: classify from a tiny decode.
+        Returns (food_name, confidence, nutrition_dict) when the decision is
+        clear-cut, or None to escalate.
+        """
+        img = self._open_coarse(image_path)
+        return self._coarse_decision(
+            lambda: self._profile_image(img), lambda: self._image_votes(img), img.width * img.height
+        )
+
+    # The decisions below take the colour profile and LUT votes as callables,
+    # so each is only computed when a rule needs it. They are shared by the
+    # image path and the stored-features path (classify_features).
+
+    def _full_decision(self, get_profile, get_votes, pixel_count: int) -> tuple:
+        if self.mode == self.MODE_LUT:
+            votes = get_votes()
+            detected_food, confidence = self._rank_votes(votes, pixel_count) if votes is not None else (None, 0.0)
+            if detected_food in self.FOOD_DATABASE:
+                return detected_food, confidence, self.FOOD_DATABASE[detected_food]
+
+        # Detect food based on color profile
+        detected_food, confidence = self._match_food_by_colors(get_profile())
+
+        if detected_food and detected_food in self.FOOD_DATABASE:
+            nutrition = self.FOOD_DATABASE[detected_food]
+            return detected_food, confidence, nutrition
+
+        # Fallback
+        return 'rice', 65.0, self.FOOD_DATABASE['rice']
+
+    def _coarse_decision(self, get_profile, get_votes, pixel_count: int):
+        if self.mode == self.MODE_LUT:
+            votes = get_votes()
+            if not votes:
+                return None
+            ranked = votes.most_common(2)
+            food, first = ranked[0]
+            second = ranked[1][1] if len(ranked) > 1 else 0
+            total = sum(votes.values())
+            if (food in self.FOOD_DATABASE
+                    and total >= pixel_count * self.LUT_MIN_COVERAGE
+                    and (first - second) / total >= self.CASCADE_VOTE_LEAD):
+                return food, min(95.0, 50.0 + 50.0 * first / total), self.FOOD_DATABASE[food]
+            return None
+
+        profile = get_profile()
+        food, confidence = self._match_food_by_colors(profile)
+        if food in self.FOOD_DATABASE and self._is_decisive(profile, food):
+            return food, confidence, self.FOOD_DATABASE[food]
+        return None
+
+    def _coarse_only_decision(self, profile: dict) -> tuple:
+        detected_food, confidence = self._match_food_by_colors(profile)
+        if detected_food in self.FOOD_DATABASE:
+            return detected_food, confidence, self.FOOD_DATABASE[detected_food]
+        return 'rice', 65.0, self.FOOD_DATABASE['rice']
+
+    def _is_decisive(self, profile: dict, food: str) -> bool:
+        """True if the colour rules keep choosing `food` when the profile is nudged in any direction."""
+        margin = self.cascade_margin
+        variants = []
+        for channel in ('avg_r', 'avg_g', 'avg_b'):
+            for delta in (-margin, margin):
+                variant = dict(profile)
+                variant[channel] += delta
+                variant['brightness'] = (variant['avg_r'] + variant['avg_g'] + variant['avg_b']) // 3
+                variants.append(variant)
+        for factor in (0.5, 1.5):
+            variant = dict(profile)
+            variant['r_var'] = int(profile['r_var'] * factor)
+            variants.append(variant)
+        return all(self._match_food_by_colors(variant)[0] == food for variant in variants)
+
+    @memory_span('detector.analyze_plate')
+    def analyze_plate(self, image_path: str, grid: int = 6, budget_ms: float = 50.0):
+        """
+        Analyze a mixed plate (e.g. a thali) as several food items.
+
+        The thumbnail is split into a grid x grid set of tiles, whose colour
+        statistics come from one box-filtered pass over the image (see
+        _grid_stats). Each tile is classified, and 4-connected tiles with the
+        same label are merged into regions. Work is bounded by the fixed
+        thumbnail and grid size, and abandoned once `budget_ms` is spent.
+
+        Returns a list of (food_name, confidence, area_share, nutrition_dict),
+        largest first, or None when the image does not split into food
+        regions (or the budget ran out) and should be analyzed as one item.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        try:
+            img = self._open_plate(image_path)
+        except Exception as e:
+            logger.warning('Error in plate analysis: %s', e)
+            return None
+
+        tiles = self._tile_boxes(img, grid)
+        if not tiles:
+            return None
+        stats = self._grid_stats(img, grid)
+
+        # Classify every tile; None marks empty plate/background
+        labels = {}
+        confidences = {}
+        for (position, box), tile_stats in zip(tiles, stats):
+            if time.perf_counter() > deadline:
+                return None
+            # Only the LUT votes need the tile's pixels
+            tile = img.crop(box) if self.mode == self.MODE_LUT else None
+            labels[position], confidences[position] = self._classify_tile_stats(tile_stats, tile)
+        return self._plate_items(labels, confidences)
+
+    def _open_plate(self, image_path: str):
+        from PIL import Image
+
+        img = Image.open(image_path)
+        img.draft('RGB', (400, 400))  # Cheap reduced decode for JPEGs
+        img = img.convert('RGB')
+        img.thumbnail((200, 200))
+        return img
+
+    @staticmethod
+    def _tile_boxes(img, grid: int) -> list:
+        """[((row, col), crop box), ...] in row-major order, or [] if the image is too small."""
+        tile_w, tile_h = img.width // grid, img.height // grid
+        if not tile_w or not tile_h:
+            return []
+        return [
+            ((row, col), (col * tile_w, row * tile_h, (col + 1) * tile_w, (row + 1) * tile_h))
+            for row in range(grid)
+            for col in range(grid)
+        ]
+
+    def _plate_items(self, labels: dict, confidences: dict):
+        """Merge labelled tiles into per-food items (see analyze_plate)."""
+        # Merge 4-connected tiles with the same label into regions
+        regions = []
+        seen = set()
+        for start, food in labels.items():
+            if food is None or start in seen:
+                continue
+            seen.add(start)
+            stack, region = [start], []
+            while stack:
+                row, col = stack.pop()
+                region.append((row, col))
+                for neighbour in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                    if neighbour not in seen and labels.get(neighbour) == food:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+            regions.append((food, region))
+
+        food_tiles = sum(len(region) for _, region in regions)
+        regions = [(food, region) for food, region in regions
+                   if len(region) >= food_tiles * self.PLATE_MIN_REGION_SHARE]
+        if not regions:
+            return None
+
+        # One item per food; separate regions of the same food add up
+        tiles_by_food = defaultdict(list)
+        for food, region in regions:
+            tiles_by_food[food].extend(region)
+        kept_tiles = sum(len(tiles) for tiles in tiles_by_food.values())
+
+        items = []
+        for food, tiles in tiles_by_food.items():
+            confidence = sum(confidences[tile] for tile in tiles) / len(tiles)
+            items.append((food, confidence, len(tiles) / kept_tiles, self.FOOD_DATABASE[food]))
+        items.sort(key=lambda item: item[2], reverse=True)
+        return items
+
+    @staticmethod
+    def _grid_stats(img, grid: int) -> list:
+        """
+        (avg_r, avg_g, avg_b, r_var, g_var, b_var) as ints for each tile of
+        _tile_boxes, in the same order. A box reduction by the tile size
+        averages every tile at once: per channel, once for the means and once
+        for the squared deviations from them. Its cost doesn't grow with grid.
+        """
+        from PIL import Image, ImageMath
+
+        tile_w, tile_h = img.width // grid, img.height // grid
+        if not tile_w or not tile_h:
+            return []
+        img = img.crop((0, 0, tile_w * grid, tile_h * grid))  # Tiles drop the remainder pixels too
+        means, variances = [], []
+        for band in img.split():
+            band = band.convert('F')
+            mean = band.reduce((tile_w, tile_h))
+            # Deviations from the tile's own mean keep float32 precise (E[x²] - E[x]² would not be)
+            deviation = ImageMath.lambda_eval(
+                lambda args: (lambda d: d * d)(args['x'] - args['m']),
+                x=band, m=mean.resize(band.size, Image.NEAREST),
+            )
+            means.append(array('f', mean.tobytes()))
+            variances.append(array('f', deviation.reduce((tile_w, tile_h)).tobytes()))
+        # Nudged up so averages that are whole numbers don't truncate to one less
+        return [
+            tuple(int(means[band][i] + 1e-4) for band in range(3))
+            + tuple(int(variances[band][i] + 1e-4) for band in range(3))
+            for i in range(grid * grid)
+        ]
+
+    def _classify_tile_stats(self, stats: tuple, tile=None) -> tuple:
+        """Classify one plate tile. Returns (food_name, confidence), or (None, 0.0) for empty plate."""
+        avg_r, avg_g, avg_b, r_var, g_var, b_var = stats
+        if (min(avg_r, avg_g, avg_b) >= self.PLATE_MIN_CHANNEL
+                and max(avg_r, avg_g, avg_b) - min(avg_r, avg_g, avg_b) <= self.PLATE_MAX_SPREAD):
+            return None, 0.0
+
+        if self.mode == self.MODE_LUT:
+            if tile is None:
+                if self._lut() is not None:
+                    raise FeaturesUnavailable('Plate tiles are not stored with colour histograms')
+            else:
+                food, confidence = self._match_food_by_votes(tile)
+                if food in self.FOOD_DATABASE:
+                    return food, confidence
+
+        profile = {
+            'avg_r': avg_r, 'avg_g': avg_g, 'avg_b': avg_b,
+            'r_var': r_var, 'g_var': g_var, 'b_var': b_var,
+            'brightness': (avg_r + avg_g + avg_b) // 3
+        }
+        food, confidence = self._match_food_by_colors(profile)
+        if food not in self.FOOD_DATABASE or confidence <= self.PLATE_MIN_TILE_CONFIDENCE:
+            return None, 0.0
+        return food, confidence
+
+    def _lut(self):
+        return load_lut(self.lut_path) if self.lut_path else None
+
+    def _image_votes(self, img):
+        """LUT votes for an image, or None without a LUT."""
+        lut = self._lut()
+        return lut.vote(img) if lut else None
+
+    def _match_food_by_votes(self, img) -> tuple:
+        """
+        Classify by per-pixel votes through the quantized colour LUT.
+        Returns (food_name, confidence), or (None, 0.0) when the LUT is
+        unavailable or too few pixels vote (e.g. mostly plate/background).
+        """
+        votes = self._image_votes(img)
+        if votes is None:
+            return None, 0.0
+        return self._rank_votes(votes, img.width * img.height)
+
+    def _rank_votes(self, votes, pixel_count: int) -> tuple:
+        total_votes = sum(votes.values())
+        if not total_votes or total_votes < pixel_count * self.LUT_MIN_COVERAGE:
+            return None, 0.0
+
+        food, count = votes.most_common(1)[0]
+        share = count / total_votes
+        return food, min(95.0, 50.0 + 50.0 * share)
+
+    @memory_span('detector.extract_features')
+    def extract_features(self, image_path: str, grid: int = 6) -> ImageFeatures:
+        """
+        Everything classify_features needs to reproduce analyze_image,
+        analyze_image_coarse and analyze_plate for this image (see
+        api/features.py). Decodes the image the same ways those methods do.
+        """
+        from PIL import Image
+
+        img = Image.open(image_path).convert('RGB')
+        img.thumbnail((200, 200))
+        plate = self._open_plate(image_path)
+        return ImageFeatures(
+            coarse_size=self.coarse_size,
+            grid=grid,
+            full=self._stage_features(img),
+            coarse=self._stage_features(self._open_coarse(image_path)),
+            tiles=self._grid_stats(plate, grid),
+        )
+
+    def _stage_features(self, img) -> StageFeatures:
+        return StageFeatures(
+            self._profile_image(img), img.width * img.height, quantized_colors(img, FEATURE_BITS), FEATURE_BITS
+        )
+
+    def classify_features(self, features: ImageFeatures, analysis: str = 'full', grid: int = 6):
+        """
+        Same result as analyze_image ('full'), analyze_image_coarse ('coarse')
+        or analyze_plate ('plate', without the time budget), computed from
+        stored features with no image I/O.
+
+        Raises FeaturesUnavailable when the features were extracted with a
+        different coarse size or grid, or the LUT needs finer histograms.
+        """
+        if analysis == 'plate':
+            if features.grid != grid:
+                raise FeaturesUnavailable(f'Features have a {features.grid}x{features.grid} plate grid, not {grid}')
+            if not features.tiles:
+                return None
+            positions = [(row, col) for row in range(grid) for col in range(grid)]
+            labels, confidences = {}, {}
+            for position, stats in zip(positions, features.tiles):
+                labels[position], confidences[position] = self._classify_tile_stats(stats)
+            return self._plate_items(labels, confidences)
+
+        if (analysis == 'coarse' or self.cascade) and features.coarse_size != self.coarse_size:
+            raise FeaturesUnavailable(f'Features have a {features.coarse_size}px coarse stage, not {self.coarse_size}')
+        if analysis == 'coarse':
+            return self._coarse_only_decision(features.coarse.profile)
+
+        if self.cascade:
+            coarse = self._coarse_decision(
+                lambda: features.coarse.profile, lambda: self._stored_votes(features.coarse), features.coarse.pixels
+            )
+            if coarse:
+                metrics.incr('cascade.exit.coarse')
+                return coarse
+            metrics.incr('cascade.exit.full')
+        return self._full_decision(
+            lambda: features.full.profile, lambda: self._stored_votes(features.full), features.full.pixels
+        )
+
+    def _stored_votes(self, stage: StageFeatures):
+        """LUT votes from a stored histogram, or None without a LUT."""
+        lut = self._lut()
+        if lut is None:
+            return None
+        if lut.bits > stage.bits:
+            raise FeaturesUnavailable(f'The LUT needs {lut.bits}-bit histograms, features have {stage.bits}')
+        return lut.vote_colors(stage.colors, stage.bits)
+
+    def _profile_image(self, img) -> dict:
+        """Build the colour profile of an RGB image from its pixels."""
+        # Get dominant colors and color distribution
+        pixels = list(img.getdata())
+        r_vals = [p[0] for p in pixels]
+        g_vals = [p[1] for p in pixels]
+        b_vals = [p[2] for p in pixels]
+        
+        avg_r = sum(r_vals) // len(r_vals) if r_vals else 128
+        avg_g = sum(g_vals) // len(g_vals) if g_vals else 128
+        avg_b = sum(b_vals) // len(b_vals) if b_vals else 128
+        
+        return self._get_color_profile(avg_r, avg_g, avg_b, r_vals, g_vals, b_vals)
+
     def _get_color_profile(self, avg_r: int, avg_g: int, avg_b: int, 
                           r_vals: list, g_vals: list, b_vals: list) -> dict:
         """
@@ -0,0 +1,165 @@
+"""
+Non-blocking structured logging.
+
+Request threads only put LogRecords on a bounded queue; a listener thread
+formats them and writes them to the handlers of the sink logger. Messages are
+%-style templates with their values in `extra=kv(...)`, so nothing is
+formatted unless a handler actually writes the record.
+
+Wired up in settings.LOGGING:
+    root -> QueueLogHandler (+ SamplingFilter) -> queue -> listener thread
+         -> handlers of the 'nutriscan.sink' logger (console, KeyValueFormatter)
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import metrics
+
+
+def kv(**fields) -> dict:
+    """`extra=` payload for a structured record: logger.info('upload.matched', extra=kv(food=food))."""
+    return {'kv': fields}
+
+
+class SinkListener(QueueListener):
+    """Drains the queue into the current handlers of the sink logger."""
+
+    def __init__(self, log_queue, sink: str):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.sink = logging.getLogger(sink)
+
+    def handle(self, record):
+        for handler in self.sink.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Hand records to a listener thread without formatting them.
+
+    When the queue is full the record is dropped (and counted as
+    `logging.dropped` in the metrics) instead of blocking the request.
+    The listener starts on the first record in each process, so worker
+    processes forked after logging was configured get their own thread.
+    """
+
+    def __init__(self, sink: str = 'nutriscan.sink', maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.sink = sink
+        self.listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The stock handler formats here, on the caller's thread; the listener does it instead
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('logging.dropped')
+
+    def _start_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A queue inherited across fork may have been locked mid-put by another thread
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.listener = SinkListener(self.queue, self.sink)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        with self.lock:
+            if self._pid == os.getpid():
+                self.listener.stop()
+                self._pid = None
+
+    def close(self):
+        # Called by logging.shutdown() at exit: drain what is still queued
+        self.flush()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in `rate` INFO-and-below records per message template.
+
+    Warnings and errors always pass. Kept records carry `sample_rate` so
+    counts read from the logs can be scaled back up.
+    """
+
+    # Bound on distinct templates tracked (f-string messages would each be new)
+    MAX_TEMPLATES = 1024
+
+    def __init__(self, rate: int = 1):
+        super().__init__()
+        self.rate = max(int(rate), 1)
+        self._counters = {}
+
+    def filter(self, record):
+        if self.rate == 1 or record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= self.MAX_TEMPLATES:
+                self._counters.clear()
+            counter = self._counters.setdefault(key, itertools.count())
+        if next(counter) % self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class KeyValueFormatter(logging.Formatter):
+    """One `key=value` line per record: ts, level, logger, pid, msg, then the record's kv fields."""
+
+    default_time_format = '%Y-%m-%dT%H:%M:%S'
+    default_msec_format = '%s.%03d'
+
+    def format(self, record):
+        fields = {
+            'ts': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        fields.update(getattr(record, 'kv', None) or {})
+        if getattr(record, 'sample_rate', 1) > 1:
+            fields['sample_rate'] = record.sample_rate
+        line = ' '.join(f'{key}={self._value(value)}' for key, value in fields.items())
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line = f'{line}\n{record.exc_text}'
+        if record.stack_info:
+            line = f'{line}\n{self.formatStack(record.stack_info)}'
+        return line
+
+    @staticmethod
+    def _value(value) -> str:
+        if value is None:
+            return 'null'
+        if isinstance(value, (bool, int, float)):
+            return str(value).lower() if isinstance(value, bool) else str(value)
+        text = str(value)
+        if not text or any(c in text for c in ' ="\n\t'):
+            return json.dumps(text, ensure_ascii=False)
+        return text
@@ -0,0 +1,76 @@
+"""
+Compare the DRF serializer read path with the fast .values() read path.
+
+Seeds N scan rows inside a transaction that is rolled back afterwards, so the
+database is left untouched.
+
+Run: python manage.py benchmark_read_path --rows 1000 10000
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.models import NutritionScan
+from api.renderers import FastJSONRenderer
+from api.serializers import FastScanRowSerializer, NutritionScanSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark scan list serialization: DRF serializer vs fast read path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000],
+                            help='Page sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=3, help='Best of N runs')
+
+    def handle(self, *args, **options):
+        request = APIRequestFactory().get('/api/scans/', HTTP_HOST='localhost')
+        context = {'request': request}
+
+        self.stdout.write(f"{'rows':>7} {'serializer ms':>14} {'fast ms':>9} {'speedup':>8}")
+        for rows in options['rows']:
+            with transaction.atomic():
+                self._seed(rows)
+                queryset = NutritionScan.objects.order_by('-created_at')[:rows]
+
+                def slow():
+                    data = NutritionScanSerializer(queryset.all(), many=True, context=context).data
+                    return JSONRenderer().render(data)
+
+                def fast():
+                    page = queryset.values(*FastScanRowSerializer.fields)
+                    data = FastScanRowSerializer(context=context).many(page)
+                    return FastJSONRenderer().render(data)
+
+                if slow() != fast():
+                    self.stderr.write(self.style.ERROR(f"Output differs at {rows} rows"))
+                slow_ms = self._best(slow, options['repeat'])
+                fast_ms = self._best(fast, options['repeat'])
+                transaction.set_rollback(True)
+
+            self.stdout.write(f"{rows:>7} {slow_ms:>14.1f} {fast_ms:>9.1f} {slow_ms / fast_ms:>7.1f}x")
+
+    @staticmethod
+    def _seed(rows):
+        user = User.objects.create(username='benchmark-read-path')
+        NutritionScan.objects.bulk_create(
+            NutritionScan(
+                user=user, image=f'scans/2025/12/09/meal_{n}.jpg', food_item='Biryani',
+                calories=430, protein=18, carbs=52, fat=16, portion_size='1 cup cooked',
+                confidence=88.0, notes='benchmark' if n % 2 else None,
+            )
+            for n in range(rows)
+        )
+
+    @staticmethod
+    def _best(fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
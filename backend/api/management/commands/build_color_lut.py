@@ -0,0 +1,69 @@
+"""
+Build the quantized colour LUT used by the 'lut' detector mode.
+
+Reference images are labelled by filename, the same way uploads are matched
+(e.g. "biryani_01.jpg" -> biryani).
+
+Run: python manage.py build_color_lut media/scans
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from api.color_lut import DEFAULT_BITS, build_lut, write_lut
+from api.local_food_detector import LocalFoodDetector, match_food_from_filename
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+class Command(BaseCommand):
+    help = 'Build the per-pixel colour vote LUT from labelled reference images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('reference_dir', help='Directory tree of reference images')
+        parser.add_argument('--output', default=settings.NUTRISCAN_COLOR_LUT_PATH,
+                            help='Where to write the LUT file')
+        parser.add_argument('--bits', type=int, default=DEFAULT_BITS,
+                            help='Bits per channel (5 = 32x32x32 bins)')
+        parser.add_argument('--min-purity', type=float, default=0.6,
+                            help='Minimum share of a colour bin one food must hold to get its vote')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['reference_dir']):
+            raise CommandError(f"Not a directory: {options['reference_dir']}")
+        if not 1 <= options['bits'] <= 8:
+            raise CommandError('--bits must be between 1 and 8')
+
+        per_label = {}
+
+        def samples():
+            for root, _dirs, files in os.walk(options['reference_dir']):
+                for name in sorted(files):
+                    if not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    label = match_food_from_filename(name)
+                    if label not in LocalFoodDetector.FOOD_DATABASE:
+                        continue
+                    try:
+                        img = Image.open(os.path.join(root, name)).convert('RGB')
+                    except OSError as e:
+                        self.stderr.write(f"Skipping {name}: {e}")
+                        continue
+                    img.thumbnail((200, 200))
+                    per_label[label] = per_label.get(label, 0) + 1
+                    yield label, img
+
+        lut = build_lut(samples(), bits=options['bits'], min_purity=options['min_purity'])
+        if not lut.labels:
+            raise CommandError('No labelled reference images found')
+
+        write_lut(lut, options['output'])
+        voting_bins = sum(1 for value in lut.table if value)
+        for label in lut.labels:
+            self.stdout.write(f"  {label}: {per_label[label]} image(s)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['output']} ({voting_bins}/{len(lut.table)} bins vote, "
+            f"{len(lut.labels)} foods)"
+        ))
@@ -0,0 +1,205 @@
+"""
+Import a folder of existing meal photos as one user's scans.
+
+Files are hashed (SHA-256) and duplicates skipped, both within the folder and
+against photos already imported for the user, so re-running the command
+over the same archive only adds new files. New photos are checked and
+analyzed across a process pool, then stored and inserted in bulk, one
+transaction per batch, dated when the photo was taken (EXIF DateTimeOriginal,
+else the file's mtime). The user's daily logs for the imported dates are
+rebuilt once at the end.
+
+Run: python manage.py import_photos ~/Pictures/meals --user alice --workers 4
+"""
+import os
+import time
+import warnings
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.daily_logs import rebuild_daily_logs
+from api.image_probe import ALLOWED_FORMATS
+from api.ingest import analyze_upload, apply_result, catalog_food_ids, features_row, hash_file, main_food_name
+from api.models import NutritionScan, ScanFeatures
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+# EXIF tags: DateTimeOriginal lives in the Exif sub-IFD, DateTime in the main one
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+
+def inspect_photo(path: str, analysis_mode: str = '') -> dict:
+    """
+    Check and analyze one photo (runs in a pool worker).
+    Returns {'taken_at': datetime, 'result': dict}, or {'error': reason}.
+    """
+    from PIL import Image
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(path) as img:
+                if img.format not in ALLOWED_FORMATS:
+                    return {'error': f'unsupported format {img.format}'}
+                if img.width * img.height > settings.NUTRISCAN_MAX_IMAGE_PIXELS:
+                    return {'error': f'larger than {settings.NUTRISCAN_MAX_IMAGE_PIXELS} pixels'}
+                taken_at = _exif_taken_at(img)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return {'error': 'not a valid image'}
+
+    if taken_at is None:
+        taken_at = datetime.fromtimestamp(os.path.getmtime(path), tz=dt_timezone.utc)
+    return {'taken_at': taken_at, 'result': analyze_upload(os.path.basename(path), path, analysis_mode)}
+
+
+def _exif_taken_at(img):
+    """Capture time from EXIF as an aware datetime (EXIF times are local: the current time zone), or None."""
+    try:
+        exif = img.getexif()
+        value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if not value:
+            return None
+        return timezone.make_aware(datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S'))
+    except (ValueError, TypeError, KeyError, OSError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Import a directory tree of meal photos as scans for one user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Folder to import (searched recursively)')
+        parser.add_argument('--user', required=True, help='Username that owns the imported scans')
+        parser.add_argument('--workers', type=int, default=settings.NUTRISCAN_ANALYSIS_WORKERS,
+                            help='Analysis processes (0 = analyze in this process)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Scans per insert transaction')
+        parser.add_argument('--analysis-mode', default='',
+                            help="'plate' or 'coarse'; empty uses the configured default, as uploads do")
+        parser.add_argument('--dry-run', action='store_true', help='Hash and dedupe only; import nothing')
+
+    def handle(self, *args, **options):
+        root = options['directory']
+        if not os.path.isdir(root):
+            raise CommandError(f'{root} is not a directory')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['user']}")
+
+        paths = self._collect(root)
+        pool = None
+        if options['workers'] > 0:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawned children (macOS/Windows) need Django configured again
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+
+        start = time.perf_counter()
+        imported = rejected = 0
+        dates = set()
+        try:
+            hashes = self._map(pool, hash_file, paths)
+            new = self._dedupe(user, paths, hashes)
+            self.stdout.write(f"Found {len(paths)} images, {len(paths) - len(new)} already imported or duplicates")
+            if options['dry_run']:
+                return
+
+            for offset in range(0, len(new), options['batch_size']):
+                batch = new[offset:offset + options['batch_size']]
+                inspected = self._map(pool, inspect_photo, [path for path, _ in batch], options['analysis_mode'])
+                rows = []
+                for (path, sha), info in zip(batch, inspected):
+                    if 'error' in info:
+                        self.stderr.write(f"Skipped {path}: {info['error']}")
+                        rejected += 1
+                    else:
+                        rows.append((path, sha, info))
+                self._insert(user, rows)
+                imported += len(rows)
+                dates.update(info['taken_at'].astimezone(dt_timezone.utc).date() for _, _, info in rows)
+
+                done = offset + len(batch)
+                rate = done / (time.perf_counter() - start)
+                self.stdout.write(f"{done}/{len(new)} imported={imported} rejected={rejected} {rate:.1f} photos/s")
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if dates:
+            # Once for the whole import rather than per file
+            logs = rebuild_daily_logs(user_ids=[user.pk], start=min(dates), end=max(dates))
+            self.stdout.write(f"Daily logs: {logs['created']} created, {logs['updated']} updated")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} photos for {user.username} ({rejected} rejected, "
+            f"{len(paths) - imported - rejected} duplicates)"
+        ))
+
+    @staticmethod
+    def _collect(root):
+        paths = []
+        for directory, subdirs, files in os.walk(root):
+            subdirs.sort()
+            paths.extend(
+                os.path.join(directory, name) for name in sorted(files)
+                if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith('.')
+            )
+        return paths
+
+    @staticmethod
+    def _map(pool, fn, items, *args):
+        if pool is None:
+            return [fn(item, *args) for item in items]
+        return list(pool.map(fn, items, *([arg] * len(items) for arg in args), chunksize=8))
+
+    @staticmethod
+    def _dedupe(user, paths, hashes):
+        """[(path, sha256)] for files not yet imported for the user, first copy of each only."""
+        known = set()
+        unique = sorted(set(hashes))
+        for offset in range(0, len(unique), 500):
+            known.update(
+                NutritionScan.objects.filter(user=user, image_sha256__in=unique[offset:offset + 500])
+                .values_list('image_sha256', flat=True)
+            )
+        new = []
+        for path, sha in zip(paths, hashes):
+            if sha not in known:
+                known.add(sha)
+                new.append((path, sha))
+        return new
+
+    @staticmethod
+    def _insert(user, rows):
+        """Store the files, then insert their scans and features in one transaction."""
+        food_ids = catalog_food_ids()
+        scans, results = [], []
+        try:
+            for path, sha, info in rows:
+                scan = NutritionScan(user=user, created_at=info['taken_at'], image_sha256=sha)
+                apply_result(scan, info['result'])
+                scan.food_id = food_ids.get(main_food_name(info['result']).lower())
+                with open(path, 'rb') as f:
+                    scan.image.save(os.path.basename(path), File(f), save=False)
+                scans.append(scan)
+                results.append(info['result'])
+
+            with transaction.atomic():
+                NutritionScan.objects.bulk_create(scans)
+                ScanFeatures.objects.bulk_create(
+                    row for row in (features_row(scan, result) for scan, result in zip(scans, results)) if row
+                )
+        except BaseException:
+            # Don't leave stored files behind for rows that were never inserted
+            for scan in scans:
+                scan.image.delete(save=False)
+            raise
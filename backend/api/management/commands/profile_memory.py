@@ -0,0 +1,50 @@
+"""
+Profile the memory one image's analysis takes: peak and retained Python
+allocations (tracemalloc), resident set growth and the lines holding the
+most memory afterwards, with the same spans as NUTRISCAN_MEMORY_PROFILE.
+
+Repeated runs separate one-time costs (imports, LUT and caches, in the first
+run) from memory that is kept on every analysis, which is what makes a
+long-lived worker's RSS creep.
+
+Run: python manage.py profile_memory ~/Pictures/thali.jpg --mode plate --repeat 3
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ingest import analyze_stored_image
+from api.memory_profile import memory_span
+
+
+class Command(BaseCommand):
+    help = 'Profile peak and retained memory of analyzing one image.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image', help='Image file to analyze')
+        parser.add_argument('--mode', default='',
+                            help="'plate' or 'coarse'; empty uses the configured default, as uploads do")
+        parser.add_argument('--repeat', type=int, default=3, help='Analyses to profile, one after another')
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['image']):
+            raise CommandError(f"{options['image']} is not a file")
+
+        record = None
+        for run in range(1, max(options['repeat'], 1) + 1):
+            with memory_span(f'run {run}', force=True) as record:
+                analyze_stored_image(options['image'], options['mode'])
+            self._write_span(record)
+
+        self.stdout.write(f"\nTop allocation sites still held after {record['label']}")
+        for site in record['top_sites']:
+            self.stdout.write(f"  {site['size_kb']:>10.1f} KB {site['count']:>7} blocks  {site['site']}")
+
+    def _write_span(self, record, depth=0):
+        self.stdout.write(
+            f"{'  ' * depth}{record['label']:<{36 - 2 * depth}}peak {record['peak_kb']:>9.1f} KB  "
+            f"retained {record['retained_kb']:>8.1f} KB  RSS {record['rss_delta_kb']:>+9.1f} KB  "
+            f"{record['duration_ms']:>7.1f} ms"
+        )
+        for span in record['spans']:
+            self._write_span(span, depth + 1)
@@ -0,0 +1,116 @@
+"""
+Profile worker cold start: import cost per module and boot-to-first-request time.
+
+Each run starts a fresh interpreter under `python -X importtime`, builds the
+WSGI application and serves one GET request to it in-process, the same work a
+newly recycled worker does before its first response.
+
+Run: python manage.py profile_startup --path /api/health/ --repeat 5
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Heavy optional dependencies that a cold request shouldn't need to import
+LAZY_MODULES = ('PIL', 'numpy', 'scipy', 'cv2')
+
+BOOT_SCRIPT = '''
+import json, os, sys, time
+started = time.time()
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+ready = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {'PATH_INFO': sys.argv[1], 'HTTP_HOST': 'localhost', 'REQUEST_METHOD': 'GET'}
+setup_testing_defaults(environ)
+status = []
+b''.join(application(environ, lambda s, headers, exc_info=None: status.append(s)))
+done = time.perf_counter()
+print(json.dumps({
+    'interpreter_ms': (started - float(os.environ['PROFILE_SPAWNED_AT'])) * 1000,
+    'setup_ms': (ready - start) * 1000,
+    'first_request_ms': (done - ready) * 1000,
+    'status': status[0],
+    'modules': sorted(sys.modules),
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report import-time cost per module and boot-to-first-request latency for a fresh worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/health/', help='Path of the first request')
+        parser.add_argument('--repeat', type=int, default=5, help='Fresh processes to time (median is shown)')
+        parser.add_argument('--top', type=int, default=15, help='Rows in the import tables')
+        parser.add_argument('--check', action='store_true',
+                            help=f"Fail if the request loads any of: {', '.join(LAZY_MODULES)}")
+
+    def handle(self, *args, **options):
+        runs = [self._boot(options['path']) for _ in range(max(options['repeat'], 1))]
+        # The last run's imports come from warm .pyc files, like a recycled worker
+        result, imports = runs[-1]
+        timings = {
+            key: statistics.median(run[key] for run, _ in runs)
+            for key in ('interpreter_ms', 'setup_ms', 'first_request_ms', 'total_ms')
+        }
+
+        self.stdout.write(f"Boot to first request ({options['path']}, median of {len(runs)} runs)")
+        self.stdout.write(f"  {'interpreter start':<24}{timings['interpreter_ms']:>9.1f} ms")
+        self.stdout.write(f"  {'django setup + WSGI app':<24}{timings['setup_ms']:>9.1f} ms")
+        self.stdout.write(f"  {'first request':<24}{timings['first_request_ms']:>9.1f} ms  ({result['status']})")
+        self.stdout.write(f"  {'process total':<24}{timings['total_ms']:>9.1f} ms")
+
+        by_package = defaultdict(int)
+        for name, self_us, _, _ in imports:
+            by_package[name.split('.')[0]] += self_us
+        self.stdout.write('\nImport time by package (self)')
+        for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"  {package:<40}{self_us / 1000:>9.1f} ms")
+
+        self.stdout.write('\nSlowest top-level imports (cumulative)')
+        top_level = [entry for entry in imports if entry[3] == 0]
+        for name, _, cumulative_us, _ in sorted(top_level, key=lambda entry: -entry[2])[:options['top']]:
+            self.stdout.write(f"  {name:<40}{cumulative_us / 1000:>9.1f} ms")
+
+        loaded = sorted({
+            module.split('.')[0] for module in result['modules'] if module.split('.')[0] in LAZY_MODULES
+        })
+        self.stdout.write(f"\nHeavy optional modules loaded: {', '.join(loaded) or 'none'}")
+        if options['check'] and loaded:
+            raise CommandError(f"{options['path']} loaded {', '.join(loaded)} at startup")
+
+    @staticmethod
+    def _boot(path: str):
+        """Boot one fresh worker. Returns (timings, [(module, self_us, cumulative_us, depth)])."""
+        env = dict(os.environ)
+        if settings.SETTINGS_MODULE:  # None while settings are overridden; the environment has it then
+            env['DJANGO_SETTINGS_MODULE'] = settings.SETTINGS_MODULE
+        env['PROFILE_SPAWNED_AT'] = repr(time.time())
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT, path],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        total_ms = (time.perf_counter() - start) * 1000
+        if proc.returncode != 0:
+            raise CommandError(f'Worker boot failed:\n{proc.stderr[-2000:]}')
+
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result['total_ms'] = total_ms
+        imports = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+        return result, imports
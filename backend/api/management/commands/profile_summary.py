@@ -0,0 +1,78 @@
+"""
+Summarize the request profiles written by RequestProfilerMiddleware.
+
+All matching profiles are merged, so functions that are slow across many
+requests stand out over one-off outliers. Times are totals over the merged
+profiles, plus the average per request.
+
+Run: python manage.py profile_summary --endpoint process-image --last 50 --sort tottime
+"""
+import os
+import pstats
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.middleware import PROFILE_SUFFIX
+
+# <timestamp>-<endpoint>[-scan<id>]-<ms>ms.prof
+PROFILE_NAME = re.compile(r'^(?P<at>\d{8}T[\d.]+)-(?P<endpoint>.+?)(?:-scan(?P<scan>\d+))?-(?P<ms>\d+)ms$')
+SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}
+
+
+class Command(BaseCommand):
+    help = 'Summarize the top functions across collected request profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.NUTRISCAN_PROFILE_DIR, help='Profile directory')
+        parser.add_argument('--endpoint', help='Only profiles whose endpoint contains this text')
+        parser.add_argument('--last', type=int, help='Only the newest N matching profiles')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='cumulative', help='Order of the table')
+        parser.add_argument('--top', type=int, default=25, help='Functions to show')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['dir']):
+            raise CommandError(f"No profiles in {options['dir']}")
+        profiles = []
+        for name in sorted(os.listdir(options['dir'])):
+            match = PROFILE_NAME.match(name[:-len(PROFILE_SUFFIX)]) if name.endswith(PROFILE_SUFFIX) else None
+            if match and (not options['endpoint'] or options['endpoint'] in match['endpoint']):
+                profiles.append((os.path.join(options['dir'], name), match))
+        if options['last']:
+            profiles = profiles[-options['last']:]
+        if not profiles:
+            raise CommandError('No matching profiles')
+
+        self.stdout.write(f"{len(profiles)} profiles")
+        by_endpoint = {}
+        for _, match in profiles:
+            by_endpoint.setdefault(match['endpoint'], []).append(int(match['ms']))
+        for endpoint, durations in sorted(by_endpoint.items(), key=lambda item: -sum(item[1])):
+            durations.sort()
+            self.stdout.write(
+                f"  {endpoint:<44}{len(durations):>5} requests  median {durations[len(durations) // 2]:>6} ms  "
+                f"max {durations[-1]:>6} ms"
+            )
+
+        stats = pstats.Stats(profiles[0][0])
+        for path, _ in profiles[1:]:
+            stats.add(path)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][SORT_KEYS[options['sort']]], reverse=True)
+
+        self.stdout.write(f"\nTop functions by {options['sort']} (seconds; avg is per request)")
+        self.stdout.write(f"  {'calls':>10} {'tottime':>9} {'cumtime':>9} {'avg cum':>9}  function")
+        for func, (_, calls, tottime, cumtime, _) in rows[:options['top']]:
+            self.stdout.write(
+                f"  {calls:>10} {tottime:>9.3f} {cumtime:>9.3f} {cumtime / len(profiles):>9.4f}  {self._label(func)}"
+            )
+
+    @staticmethod
+    def _label(func) -> str:
+        filename, line, name = func
+        base_dir = str(settings.BASE_DIR) + os.sep
+        if filename.startswith(base_dir):
+            filename = filename[len(base_dir):]
+        elif 'site-packages' + os.sep in filename:
+            filename = filename.split('site-packages' + os.sep, 1)[1]
+        return f'{filename}:{line}({name})' if line else name
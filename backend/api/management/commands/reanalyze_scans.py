@@ -0,0 +1,211 @@
+"""
+Re-run analysis over stored scan images, e.g. after detector thresholds change.
+
+Scans are processed in primary-key order, in batches. Scans with stored
+features (ScanFeatures of the current schema version) are re-classified from
+them in this process, without touching the image; the rest are analyzed from
+their images across a process pool, and the features extracted on the way are
+stored for next time. Each batch then updates its scans, their features and
+the matching DailyNutritionLog totals in a single transaction. The last committed key is
+checkpointed after every batch, so an interrupted run resumes where it left
+off. Re-running a committed batch is harmless: unchanged results write
+nothing.
+
+Run: python manage.py reanalyze_scans --workers 4 --batch-size 200
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils.timezone import now
+
+from api.daily_logs import LOG_TOTALS
+from api.features import FEATURE_SCHEMA_VERSION, FeaturesUnavailable
+from api.ingest import (
+    analyze_features_payload, analyze_upload, apply_result, catalog_food_ids, features_row, main_food_name,
+)
+from api.models import DailyNutritionLog, NutritionScan, ScanFeatures
+from api.rolling_stats import apply_log_change
+
+RESULT_FIELDS = ('food_item', 'calories', 'protein', 'carbs', 'fat', 'portion_size', 'confidence', 'items')
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored scans with the current detector and fix the daily nutrition totals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.NUTRISCAN_ANALYSIS_WORKERS,
+                            help='Analysis processes (0 = analyze in this process)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Scans per transaction')
+        parser.add_argument('--analysis-mode', default='',
+                            help="'plate' or 'coarse'; empty uses the configured default, as uploads do")
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / 'data' / 'reanalyze_scans.json'),
+                            help='Progress file used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+        parser.add_argument('--features-only', action='store_true',
+                            help='Skip scans that would need their image decoded (no image I/O at all)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        checkpoint_path = options['checkpoint']
+        progress = self._load_checkpoint(checkpoint_path, options['analysis_mode'], options['restart'])
+        if progress['last_pk']:
+            self.stdout.write(f"Resuming after scan {progress['last_pk']} ({progress['processed']} already done)")
+
+        pending = NutritionScan.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+        total = pending.filter(pk__gt=progress['last_pk']).count()
+        pool = None
+        if options['workers'] > 0:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Spawned children (macOS/Windows) need Django configured again
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+
+        done = 0
+        start = time.perf_counter()
+        try:
+            while True:
+                batch = list(
+                    pending.filter(pk__gt=progress['last_pk'])
+                    .only('id', 'user_id', 'image', 'created_at', 'food', *RESULT_FIELDS)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                changed, skipped, without_image = self._reanalyze_batch(
+                    batch, pool, options['analysis_mode'], options['features_only']
+                )
+
+                progress['last_pk'] = batch[-1].pk
+                progress['processed'] += len(batch)
+                progress['changed'] += changed
+                progress['skipped'] += skipped
+                progress['without_image'] = progress.get('without_image', 0) + without_image
+                self._write_checkpoint(checkpoint_path, progress)
+
+                done += len(batch)
+                elapsed = time.perf_counter() - start
+                rate = done / elapsed if elapsed else 0.0
+                eta = timedelta(seconds=round((total - done) / rate)) if rate else '?'
+                self.stdout.write(
+                    f"{done}/{total} ({done * 100 // max(total, 1)}%) changed={progress['changed']} "
+                    f"skipped={progress['skipped']} without_image={progress['without_image']} "
+                    f"{rate:.1f} scans/s eta {eta}"
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-analyzed {progress['processed']} scans: {progress['changed']} changed, "
+            f"{progress['skipped']} skipped (image missing or analysis failed), "
+            f"{progress['without_image']} without decoding their image"
+        ))
+
+    def _reanalyze_batch(self, batch, pool, analysis_mode, features_only=False):
+        """Analyze one batch and commit its changes. Returns (changed, skipped, without_image)."""
+        payloads = dict(
+            ScanFeatures.objects.filter(scan__in=batch, schema_version=FEATURE_SCHEMA_VERSION)
+            .values_list('scan_id', 'payload')
+        )
+        calls = []  # (scan, call returning the result)
+        image_jobs = []
+        skipped = 0
+        for scan in batch:
+            name = os.path.basename(scan.image.name)
+            try:
+                result = analyze_features_payload(name, payloads.get(scan.pk), analysis_mode)
+            except FeaturesUnavailable:
+                pass
+            else:
+                calls.append((scan, lambda result=result: result))
+                continue
+            path = scan.image.path
+            if features_only or not os.path.exists(path):
+                skipped += 1
+                continue
+            image_jobs.append((scan, name, path))
+        without_image = len(calls)
+
+        if pool is not None and image_jobs:
+            # The pool forks on first use; don't let children inherit an open DB connection
+            connections.close_all()
+            futures = [pool.submit(analyze_upload, name, path, analysis_mode) for _, name, path in image_jobs]
+            calls.extend((scan, future.result) for (scan, _, _), future in zip(image_jobs, futures))
+        else:
+            calls.extend(
+                (scan, lambda name=name, path=path: analyze_upload(name, path, analysis_mode))
+                for scan, name, path in image_jobs
+            )
+
+        food_ids = catalog_food_ids()
+        changed_scans = []
+        feature_rows = []
+        deltas = defaultdict(lambda: defaultdict(float))  # (user_id, date) -> log total -> change
+        for scan, call in calls:
+            try:
+                result = call()
+            except Exception as e:
+                self.stderr.write(f"Scan {scan.pk}: {e}")
+                skipped += 1
+                continue
+            features = features_row(scan, result)
+            if features is not None:
+                feature_rows.append(features)
+            before = {field: getattr(scan, field) for field in RESULT_FIELDS + ('food_id',)}
+            apply_result(scan, result)
+            scan.food_id = food_ids.get(main_food_name(result).lower())
+            if all(getattr(scan, field) == before[field] for field in before):
+                continue
+            scan.updated_at = now()
+            changed_scans.append(scan)
+            if scan.user_id is not None:
+                # Logs are keyed by the (UTC) day the scan was made, as in _update_daily_log
+                day = deltas[(scan.user_id, scan.created_at.date())]
+                for field, total in LOG_TOTALS.items():
+                    day[total] += getattr(scan, field) - before[field]
+
+        with transaction.atomic():
+            NutritionScan.objects.bulk_update(changed_scans, RESULT_FIELDS + ('food', 'updated_at'))
+            ScanFeatures.objects.bulk_create(
+                feature_rows, update_conflicts=True, unique_fields=['scan'], update_fields=['schema_version', 'payload']
+            )
+            for (user_id, date), totals in deltas.items():
+                if DailyNutritionLog.objects.filter(user_id=user_id, date=date).update(
+                    **{total: F(total) + change for total, change in totals.items()}
+                ):
+                    apply_log_change(user_id, date, totals)
+        return len(changed_scans), skipped, without_image
+
+    @staticmethod
+    def _load_checkpoint(path, analysis_mode, restart):
+        fresh = {'analysis_mode': analysis_mode, 'last_pk': 0, 'processed': 0, 'changed': 0, 'skipped': 0,
+                 'without_image': 0}
+        if restart or not os.path.exists(path):
+            return fresh
+        with open(path) as f:
+            progress = json.load(f)
+        if progress.get('analysis_mode') != analysis_mode:
+            raise CommandError(
+                f"Checkpoint {path} is for --analysis-mode '{progress.get('analysis_mode')}'; "
+                f"use the same mode or pass --restart"
+            )
+        return progress
+
+    @staticmethod
+    def _write_checkpoint(path, progress):
+        """Atomically replace the checkpoint, so a crash never leaves half a file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,41 @@
+"""
+Recompute DailyNutritionLog totals from the scans and fix the ones that drifted.
+
+Totals come from one grouped query over the scans; only logs whose stored
+totals differ are written (one bulk upsert). Safe to run at any time.
+
+Run: python manage.py rebuild_daily_logs [--user alice] [--days 30] [--dry-run]
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from api.daily_logs import rebuild_daily_logs
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily nutrition totals from the scans and fix the logs that differ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Username to rebuild (repeatable; default all)')
+        parser.add_argument('--days', type=int, help='Only the last N days (default all)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            users = dict(User.objects.filter(username__in=options['user']).values_list('username', 'pk'))
+            unknown = sorted(set(options['user']) - set(users))
+            if unknown:
+                raise CommandError(f"Unknown user(s): {', '.join(unknown)}")
+            user_ids = list(users.values())
+        start = now().date() - timedelta(days=options['days']) if options['days'] is not None else None
+
+        counts = rebuild_daily_logs(user_ids=user_ids, start=start, dry_run=options['dry_run'])
+        verb = 'Would fix' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {counts['created'] + counts['updated']} daily logs: {counts['created']} created, "
+            f"{counts['updated']} updated, {counts['unchanged']} already correct"
+        ))
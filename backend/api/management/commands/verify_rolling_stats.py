@@ -0,0 +1,49 @@
+"""
+Check the rolling stats sums (api/rolling_stats.py) against a full
+recomputation from the daily logs, and optionally fix the rows that differ.
+
+Each row is compared as of the day it was last moved to, so rows that
+haven't been read today are checked too. Exits with status 1 when a
+mismatch is found and --fix isn't given, for use from cron or CI.
+
+Run: python manage.py verify_rolling_stats [--user alice] [--fix]
+"""
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.rolling_stats import verify_rolling_stats
+
+
+class Command(BaseCommand):
+    help = 'Compare the rolling stats sums with a recomputation from the daily logs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Username to check (repeatable; default all)')
+        parser.add_argument('--fix', action='store_true', help='Overwrite rows that differ with the recomputed sums')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            users = dict(User.objects.filter(username__in=options['user']).values_list('username', 'pk'))
+            unknown = sorted(set(options['user']) - set(users))
+            if unknown:
+                raise CommandError(f"Unknown user(s): {', '.join(unknown)}")
+            user_ids = list(users.values())
+
+        report = verify_rolling_stats(user_ids=user_ids, fix=options['fix'])
+        for mismatch in report['mismatches']:
+            fields = ', '.join(
+                f'{field} {stored:g} != {expected:g}' for field, (stored, expected) in mismatch['fields'].items()
+            )
+            self.stdout.write(f"  user {mismatch['user_id']}, {mismatch['window_days']} days: {fields}")
+
+        count = len(report['mismatches'])
+        if not count:
+            self.stdout.write(self.style.SUCCESS(f"All {report['checked']} rolling stats rows match"))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {count} of {report['checked']} rolling stats rows"))
+        else:
+            self.stdout.write(self.style.ERROR(f"{count} of {report['checked']} rolling stats rows differ"))
+            sys.exit(1)
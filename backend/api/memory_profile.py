@@ -0,0 +1,150 @@
+"""
+Opt-in memory profiling of the upload and analysis path.
+
+With NUTRISCAN_MEMORY_PROFILE on, `memory_span(label)` blocks (the upload
+request, analyze_stored_image and the detector's entry points) record:
+- peak: the most Python memory the block had allocated at once (tracemalloc)
+- retained: what it allocated and still held when it finished
+- rss_delta: the change in the process's resident set, which also covers
+  PIL's native pixel buffers that tracemalloc can't see
+The outermost span also lists its top allocation sites by retained size,
+with the spans opened inside it nested under `spans`. The latest profiles
+are kept for GET /api/metrics/memory/ (admin only); `manage.py
+profile_memory IMAGE` profiles one image from the command line.
+
+tracemalloc is process-wide, so one request is profiled at a time: a
+request that starts while another is being profiled isn't profiled (and
+counts as memory_profile.skipped) rather than waiting. Tracing runs only
+while a profiled request is open.
+"""
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from .metrics import metrics
+
+_IGNORED_FILES = (
+    tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+    '<unknown>',
+)
+
+_owner = threading.Lock()  # Held by the thread whose request is being profiled
+_local = threading.local()
+_recent = deque()
+_recent_lock = threading.Lock()
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process (0 where /proc isn't available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def recent_profiles() -> list:
+    """The kept profiles, newest first."""
+    with _recent_lock:
+        return list(reversed(_recent))
+
+
+def clear_profiles() -> None:
+    with _recent_lock:
+        _recent.clear()
+
+
+@contextmanager
+def memory_span(label: str, force: bool = False):
+    """
+    Profile the block (also usable as a decorator). Yields the span's record,
+    filled in when the block exits, or None when it isn't profiled.
+
+    Blocks are profiled with NUTRISCAN_MEMORY_PROFILE or `force`, and always
+    when they run inside a profiled block on the same thread.
+    """
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        if not (force or settings.NUTRISCAN_MEMORY_PROFILE):
+            yield None
+            return
+        if not _owner.acquire(blocking=False):
+            metrics.incr('memory_profile.skipped')
+            yield None
+            return
+        stack = _local.stack = []
+
+    outermost = not stack
+    started_tracing = outermost and not tracemalloc.is_tracing()
+    baseline = None
+    if started_tracing:
+        tracemalloc.start()
+    elif outermost:
+        baseline = tracemalloc.take_snapshot()  # Someone else is tracing: report only what's new
+    if stack:
+        # reset_peak is global; keep the peak the enclosing span has seen so far
+        stack[-1]['_peak'] = max(stack[-1]['_peak'], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+
+    traced_start = tracemalloc.get_traced_memory()[0]
+    record = {'label': label, '_peak': traced_start, 'spans': []}
+    rss_start = rss_bytes()
+    start = time.perf_counter()
+    stack.append(record)
+    try:
+        yield record
+    finally:
+        stack.pop()
+        traced, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, record.pop('_peak'))
+        record.update(
+            duration_ms=round((time.perf_counter() - start) * 1000, 1),
+            peak_kb=round((peak - traced_start) / 1024, 1),
+            retained_kb=round((traced - traced_start) / 1024, 1),
+            rss_delta_kb=round((rss_bytes() - rss_start) / 1024, 1),
+        )
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+            stack[-1]['spans'].append(record)
+        else:
+            try:
+                record['top_sites'] = _top_sites(baseline)
+                record['at'] = now().isoformat()
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+                _local.stack = None
+                _owner.release()
+            with _recent_lock:
+                _recent.append(record)
+                while len(_recent) > settings.NUTRISCAN_MEMORY_PROFILE_KEEP:
+                    _recent.popleft()
+
+
+def _top_sites(baseline) -> list:
+    """Lines holding the most memory allocated during the span, largest first."""
+    filters = [tracemalloc.Filter(False, pattern) for pattern in _IGNORED_FILES]
+    snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+    if baseline is None:
+        stats = snapshot.statistics('lineno')
+    else:
+        stats = [stat for stat in snapshot.compare_to(baseline.filter_traces(filters), 'lineno') if stat.size_diff > 0]
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+
+    base_dir = str(settings.BASE_DIR) + os.sep
+    sites = []
+    for stat in stats[:settings.NUTRISCAN_MEMORY_PROFILE_TOP]:
+        frame = stat.traceback[0]
+        filename = frame.filename[len(base_dir):] if frame.filename.startswith(base_dir) else frame.filename
+        sites.append({
+            'site': f'{filename}:{frame.lineno}',
+            'size_kb': round(getattr(stat, 'size_diff', stat.size) / 1024, 1),
+            'count': getattr(stat, 'count_diff', stat.count),
+        })
+    return sites
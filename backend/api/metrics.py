@@ -0,0 +1,70 @@
+"""
+In-process counters and timings for the analysis pipeline.
+Values are per worker process and reset on restart; see GET /api/metrics/.
+"""
+import threading
+
+
+class Metrics:
+    """Thread-safe registry of counters and observed values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._observations = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a value (e.g. a wait time); keeps count, sum and max."""
+        with self._lock:
+            stats = self._observations.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['sum'] += value
+            stats['max'] = max(stats['max'], value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'observations': {name: dict(stats) for name, stats in self._observations.items()},
+            }
+
+    def drain(self) -> dict:
+        """Snapshot and reset in one step, e.g. to ship a worker process's values to its parent."""
+        with self._lock:
+            snapshot = {'counters': self._counters, 'observations': self._observations}
+            self._counters, self._observations = {}, {}
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the values of another registry's snapshot (see drain)."""
+        with self._lock:
+            for name, value in snapshot.get('counters', {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, other in snapshot.get('observations', {}).items():
+                stats = self._observations.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+                stats['count'] += other['count']
+                stats['sum'] += other['sum']
+                stats['max'] = max(stats['max'], other['max'])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._observations.clear()
+
+
+metrics = Metrics()
+
+
+def cascade_exit_rates(snapshot: dict) -> dict:
+    """Share of cascade analyses that exited at each stage."""
+    exits = {
+        name[len('cascade.exit.'):]: count
+        for name, count in snapshot['counters'].items()
+        if name.startswith('cascade.exit.')
+    }
+    total = sum(exits.values())
+    return {stage: round(count / total, 4) for stage, count in exits.items()} if total else {}
@@ -0,0 +1,136 @@
+"""
+Opt-in CPU profiling of individual requests.
+
+A request is profiled with cProfile when it carries `X-Profile: <token>`
+matching NUTRISCAN_PROFILE_TOKEN, or at random with probability
+NUTRISCAN_PROFILE_SAMPLE_RATE. The profile is written to
+NUTRISCAN_PROFILE_DIR as a pstats file named after the time, the endpoint
+(URL name), the scan it concerns and how long it took, e.g.
+`20261019T161502.123456-nutrition-scan-process-image-scan42-153ms.prof`.
+Only the newest NUTRISCAN_PROFILE_KEEP files are kept. Summarize them with
+`manage.py profile_summary`, or open one with any pstats viewer (snakeviz).
+
+Only the request's own thread is profiled: analysis running in an executor
+thread or isolated worker shows up as time waiting for it. Under ASGI that
+thread is the event loop's, so a profile also holds whatever other requests
+ran on the loop meanwhile, and one request is profiled at a time.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.timezone import now
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_SUFFIX = '.prof'
+
+
+class RequestProfilerMiddleware:
+    """Profile selected requests with cProfile (see module docstring)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._async = iscoroutinefunction(get_response)
+        if self._async:
+            markcoroutinefunction(self)
+        self._profiling = False  # Under ASGI: a request on the event loop is being profiled
+
+    def __call__(self, request):
+        if self._async:
+            return self.__acall__(request)
+        requested = self._requested(request)
+        if not requested and not self._sampled():
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._save(request, response, profiler, elapsed_ms, requested)
+        return response
+
+    async def __acall__(self, request):
+        requested = self._requested(request)
+        if self._profiling or (not requested and not self._sampled()):
+            # cProfile profiles a whole thread, so requests sharing the loop can't have one each
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        self._profiling = True
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            self._profiling = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        await sync_to_async(self._save)(request, response, profiler, elapsed_ms, requested)
+        return response
+
+    @staticmethod
+    def _save(request, response, profiler, elapsed_ms: float, requested: bool) -> None:
+        """Write the request's profile, and name it in the response if the client asked for it."""
+        name = profile_name(request, response, elapsed_ms)
+        os.makedirs(settings.NUTRISCAN_PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(settings.NUTRISCAN_PROFILE_DIR, name))
+        rotate_profiles(settings.NUTRISCAN_PROFILE_DIR, settings.NUTRISCAN_PROFILE_KEEP)
+        if requested:
+            response['X-Profile-File'] = name
+
+    @staticmethod
+    def _requested(request) -> bool:
+        token = settings.NUTRISCAN_PROFILE_TOKEN
+        value = request.META.get(PROFILE_HEADER)
+        return bool(token and value) and hmac.compare_digest(value.encode(), token.encode())
+
+    @staticmethod
+    def _sampled() -> bool:
+        rate = settings.NUTRISCAN_PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+
+def profile_name(request, response, elapsed_ms: float) -> str:
+    """File name for a request's profile: time, endpoint, scan id (if any) and duration."""
+    match = getattr(request, 'resolver_match', None)
+    endpoint = match.url_name if match is not None and match.url_name else 'unresolved'
+    parts = [now().strftime('%Y%m%dT%H%M%S.%f'), re.sub(r'[^A-Za-z0-9_-]+', '-', endpoint)]
+    scan_id = _scan_id(match, response)
+    if scan_id is not None:
+        parts.append(f'scan{scan_id}')
+    parts.append(f'{elapsed_ms:.0f}ms')
+    return '-'.join(parts) + PROFILE_SUFFIX
+
+
+def _scan_id(match, response):
+    """The scan a request was about: the pk of a /scans/{id}/ route, or the id of a scan it created."""
+    if match is not None and match.url_name and match.url_name.startswith('nutrition-scan'):
+        pk = match.kwargs.get('pk')
+        if pk is not None and str(pk).isdigit():
+            return int(pk)
+    data = getattr(response, 'data', None)
+    if response.status_code == 201 and isinstance(data, dict) and 'food_item' in data:
+        return data.get('id')
+    return None
+
+
+def rotate_profiles(directory: str, keep: int) -> None:
+    """Delete all but the newest `keep` profiles (names sort by time)."""
+    names = sorted(name for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIX))
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # Another worker rotated it first
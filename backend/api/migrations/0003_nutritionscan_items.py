@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-19 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_fooditem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nutritionscan',
+            name='items',
+            field=models.JSONField(blank=True, default=list, help_text='Per-item breakdown for multi-item plates'),
+        ),
+    ]
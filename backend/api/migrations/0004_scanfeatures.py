@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-19 15:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_nutritionscan_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanFeatures',
+            fields=[
+                ('scan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='api.nutritionscan')),
+                ('schema_version', models.PositiveSmallIntegerField(help_text='FEATURE_SCHEMA_VERSION the payload was encoded with')),
+                ('payload', models.BinaryField(help_text='zlib-compressed feature record')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
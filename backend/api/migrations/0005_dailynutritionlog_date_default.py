@@ -0,0 +1,19 @@
+# Generated by Django 4.2.8 on 2026-10-19 16:02
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_scanfeatures'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailynutritionlog',
+            name='date',
+            field=models.DateField(default=api.models.utc_today, unique_for_date='user'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-19 16:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_dailynutritionlog_date_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nutritionscan',
+            name='food',
+            field=models.ForeignKey(blank=True, help_text='Catalog entry for the main food item (the largest item on a plate)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scans', to='api.fooditem'),
+        ),
+        migrations.AddIndex(
+            model_name='nutritionscan',
+            index=models.Index(fields=['user', 'food', 'created_at'], name='api_nutriti_user_id_4d94b6_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+"""
+Point existing scans at their FoodItem.
+
+Seeds catalog entries for the detector's known foods that are missing (as
+seed_food_items.py does, without touching existing rows), then resolves each
+scan's main food name case-insensitively, in primary-key batches with one
+UPDATE per food per batch. Scans whose name isn't in the catalog (e.g. a
+user's own text) keep a NULL food.
+"""
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+# The detector's FOOD_DATABASE when this migration was written, frozen so that
+# later catalog changes don't change (or break) what it does:
+# (name, calories, protein, carbs, fat, portion, description)
+CATALOG_FOODS = [
+    ('biryani', 430, 18, 52, 16, '1 cup cooked', 'Indian spiced rice with meat'),
+    ('rice', 206, 4.3, 45, 0.3, '1 cup cooked', 'Plain cooked rice'),
+    ('chicken', 165, 31, 0, 3.6, '100g', 'Cooked chicken'),
+    ('tandoori chicken', 195, 35, 2, 4.5, '100g', 'Tandoori spiced chicken'),
+    ('idli', 58, 2, 12, 0.4, '1 idli', 'Steamed rice and lentil cake (South Indian idli)'),
+    ('naan', 262, 8, 42, 5.3, '1 piece', 'Indian flatbread'),
+    ('samosa', 262, 4, 32, 13, '1 piece', 'Indian pastry'),
+    ('paneer', 265, 25, 5, 17, '100g', 'Indian cottage cheese'),
+    ('pizza', 285, 12, 36, 10, '1 slice', 'Pizza slice'),
+    ('burger', 540, 28, 41, 28, '1 burger', 'Hamburger'),
+    ('salad', 150, 8, 15, 6, '1 bowl', 'Green salad'),
+    ('pasta', 131, 5, 25, 1.1, '1 cup cooked', 'Cooked pasta'),
+    ('bread', 265, 9, 49, 3.3, '1 slice', 'Slice of bread'),
+    ('apple', 95, 0.5, 25, 0.3, '1 medium', 'Apple fruit'),
+    ('banana', 105, 1.3, 27, 0.3, '1 medium', 'Banana fruit'),
+    ('egg', 155, 13, 1.1, 11, '1 large', 'Cooked egg'),
+    ('fish', 208, 26, 0, 13, '100g', 'Cooked fish'),
+    ('sushi', 140, 6, 28, 1, '6 pieces', 'Sushi rolls'),
+    ('sandwich', 350, 15, 42, 14, '1 sandwich', 'Sandwich'),
+]
+
+
+def _main_food_name(food_item, items):
+    # Plates store their items largest first; food_item is then a joined list
+    if items:
+        food_item = items[0].get('food_item', '')
+    return (food_item or '').strip().lower()
+
+
+def resolve_scan_foods(apps, schema_editor):
+    FoodItem = apps.get_model('api', 'FoodItem')
+    NutritionScan = apps.get_model('api', 'NutritionScan')
+
+    existing = {name.lower() for name in FoodItem.objects.values_list('name', flat=True)}
+    FoodItem.objects.bulk_create([
+        FoodItem(name=name.title(), calories=calories, protein=protein, carbs=carbs, fat=fat, portion=portion,
+                 description=description)
+        for name, calories, protein, carbs, fat, portion, description in CATALOG_FOODS
+        if name not in existing
+    ])
+    food_ids = {name.lower(): pk for pk, name in FoodItem.objects.values_list('pk', 'name')}
+
+    last_pk = 0
+    while True:
+        batch = list(
+            NutritionScan.objects.filter(pk__gt=last_pk, food__isnull=True)
+            .order_by('pk').values_list('pk', 'food_item', 'items')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        pks_by_food = {}
+        for pk, food_item, items in batch:
+            food_id = food_ids.get(_main_food_name(food_item, items))
+            if food_id is not None:
+                pks_by_food.setdefault(food_id, []).append(pk)
+        for food_id, pks in pks_by_food.items():
+            NutritionScan.objects.filter(pk__in=pks).update(food_id=food_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_nutritionscan_food'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_scan_foods, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-19 16:07
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_resolve_scan_foods'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nutritionscan',
+            name='image_sha256',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the image file, set for imported photos', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='nutritionscan',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='nutritionscan',
+            index=models.Index(fields=['user', 'image_sha256'], name='api_nutriti_user_id_cc7f91_idx'),
+        ),
+    ]
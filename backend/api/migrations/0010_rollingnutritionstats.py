@@ -0,0 +1,36 @@
+# Generated by Django 4.2.8 on 2026-10-19 16:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0009_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollingNutritionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_days', models.PositiveSmallIntegerField()),
+                ('as_of', models.DateField()),
+                ('start', models.DateField()),
+                ('total_calories', models.FloatField(default=0)),
+                ('total_protein', models.FloatField(default=0)),
+                ('total_carbs', models.FloatField(default=0)),
+                ('total_fat', models.FloatField(default=0)),
+                ('scan_count', models.IntegerField(default=0)),
+                ('log_days', models.IntegerField(default=0, help_text='Daily logs in the window')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'window_days')},
+            },
+        ),
+    ]
@@ -1,5 +1,13 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+def utc_today():
+    """Today's date in UTC, the date scans are logged under."""
+    return timezone.now().date()
 
 
 class NutritionScan(models.Model):
@@ -20,26 +28,50 @@ class NutritionScan(models.Model):
     
     # Additional metadata
     food_item = models.CharField(max_length=255, blank=True, help_text="Identified food item")
+    food = models.ForeignKey(
+        'FoodItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='scans',
+        help_text="Catalog entry for the main food item (the largest item on a plate)"
+    )
     portion_size = models.CharField(max_length=100, blank=True, default="1 plate", help_text="Estimated portion size")
     confidence = models.FloatField(default=0.0, help_text="AI confidence level (0-100)")
+    items = models.JSONField(default=list, blank=True, help_text="Per-item breakdown for multi-item plates")
     
     # System fields
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add so imported photos can keep the time they were taken
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     is_favourite = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
+    image_sha256 = models.CharField(max_length=64, blank=True, default='',
+                                    help_text="SHA-256 of the image file, set for imported photos")
     
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
             models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['user', 'food', 'created_at']),
+            models.Index(fields=['user', 'image_sha256']),
         ]
     
     def __str__(self):
         return f"{self.food_item or 'Unknown'} - {self.calories} kcal ({self.created_at.strftime('%Y-%m-%d')})"
 
 
+class ScanFeatures(models.Model):
+    """
+    Detector features extracted from a scan's image at ingest (see api/features.py),
+    so the scan can be re-classified without decoding the image again.
+    """
+    scan = models.OneToOneField(NutritionScan, on_delete=models.CASCADE, primary_key=True, related_name='features')
+    schema_version = models.PositiveSmallIntegerField(help_text="FEATURE_SCHEMA_VERSION the payload was encoded with")
+    payload = models.BinaryField(help_text="zlib-compressed feature record")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Features v{self.schema_version} for scan {self.scan_id} ({len(self.payload)} bytes)"
+
+
 class FoodItem(models.Model):
     """
     Canonical food items with nutrition values stored in the database.
@@ -68,7 +100,7 @@ class DailyNutritionLog(models.Model):
     Model to track daily nutrition totals.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True, unique_for_date='user')
+    date = models.DateField(default=utc_today, unique_for_date='user')
     
     total_calories = models.FloatField(default=0)
     total_protein = models.FloatField(default=0)
@@ -86,3 +118,54 @@ class DailyNutritionLog(models.Model):
     
     def __str__(self):
         return f"{self.user.username} - {self.date} ({self.total_calories} kcal)"
+
+
+class RollingNutritionStats(models.Model):
+    """
+    Sums of a user's daily logs over one standard stats window (see
+    api/rolling_stats.py): every log dated `start` or later, where start is
+    `window_days` days before `as_of`. Kept up to date as logs change.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    window_days = models.PositiveSmallIntegerField()
+    as_of = models.DateField()
+    start = models.DateField()
+
+    total_calories = models.FloatField(default=0)
+    total_protein = models.FloatField(default=0)
+    total_carbs = models.FloatField(default=0)
+    total_fat = models.FloatField(default=0)
+
+    scan_count = models.IntegerField(default=0)
+    log_days = models.IntegerField(default=0, help_text="Daily logs in the window")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'window_days']
+
+    def __str__(self):
+        return f"{self.user_id} - {self.window_days} days to {self.as_of}"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable image upload (see api/resumable.py). The bytes received so far
+    are kept in a temporary file until the upload is finalized into a scan.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField(help_text="Total bytes the client will send")
+    offset = models.PositiveBigIntegerField(default=0, help_text="Bytes received so far")
+    original_filename = models.CharField(max_length=255, blank=True, default='')
+    analysis_mode = models.CharField(max_length=20, blank=True, default='')
+    scan = models.OneToOneField(NutritionScan, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='upload_session', help_text="Set once finalized")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes)"
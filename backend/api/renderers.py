@@ -0,0 +1,26 @@
+"""
+Faster JSON rendering for large list responses.
+Uses orjson when it is installed and falls back to DRF's JSONRenderer otherwise.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional speed-up, see requirements.txt
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer with the same output, rendered by orjson where possible."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # Like DRF's encoder, UTC datetimes end in 'Z' rather than '+00:00'
+            ret = orjson.dumps(data, option=orjson.OPT_UTC_Z)
+        except TypeError:
+            # Types only DRF's encoder knows (lazy strings, Decimals, ...)
+            return super().render(data, accepted_media_type, renderer_context)
+        # Match JSONRenderer: escape line separators that are invalid in JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
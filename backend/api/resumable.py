@@ -0,0 +1,136 @@
+"""
+Resumable image uploads.
+
+Protocol (all under /api/uploads/):
+    POST   /                  create a session: {filename, size, content_type, ...}
+    PUT    /{id}/             append bytes; header `Content-Range: bytes start-end/size`
+    GET    /{id}/             current offset, to resume after a dropped connection
+    POST   /{id}/finalize/    analyze the completed file like process_image
+    DELETE /{id}/             abandon the upload
+
+Bytes are written straight from the request stream to a temporary file under
+NUTRISCAN_UPLOAD_TMP_DIR, so a chunk is never parsed as multipart or held in
+memory. Bytes that arrive before a connection drops are kept: the offset
+reports them and the client resumes from there. A chunk that starts before
+the offset (a retry) has its already-stored prefix skipped; one that starts
+after it is refused with the offset to resume from. The offset only moves
+through a conditional UPDATE, so concurrent PUTs to one session can't both
+advance it.
+"""
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils.timezone import now
+
+from .models import UploadSession
+
+COPY_CHUNK = 64 * 1024
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ChunkRejected(Exception):
+    """A chunk can't be accepted; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OffsetMismatch(Exception):
+    """The chunk doesn't continue the upload; the client should resume from `offset`."""
+
+    def __init__(self, offset: int):
+        super().__init__(f'Upload continues at byte {offset}')
+        self.offset = offset
+
+
+def part_path(session) -> str:
+    return os.path.join(settings.NUTRISCAN_UPLOAD_TMP_DIR, f'{session.pk}.part')
+
+
+def parse_content_range(header: str, size: int, content_length: int) -> int:
+    """Start offset of a chunk from its Content-Range header, checked against the session and body."""
+    match = CONTENT_RANGE.match((header or '').strip())
+    if not match:
+        raise ChunkRejected('Content-Range must be "bytes start-end/size"')
+    start, end, total = (int(group) for group in match.groups())
+    if total != size:
+        raise ChunkRejected(f'Upload size is {size} bytes, not {total}')
+    if end < start or end >= size:
+        raise ChunkRejected(f'Range {start}-{end} is outside 0-{size - 1}', status_code=416)
+    if end - start + 1 != content_length:
+        raise ChunkRejected('Content-Range does not match Content-Length')
+    if content_length > settings.NUTRISCAN_UPLOAD_MAX_CHUNK_BYTES:
+        raise ChunkRejected(
+            f'Chunks are limited to {settings.NUTRISCAN_UPLOAD_MAX_CHUNK_BYTES} bytes', status_code=413
+        )
+    return start
+
+
+def write_chunk(session, start: int, stream, length: int) -> int:
+    """
+    Append `length` bytes read from `stream` (which begin at byte `start`)
+    to the session's file. Returns the new offset.
+
+    Raises OffsetMismatch when `start` is past the offset, or when another
+    request moved the offset meanwhile.
+    """
+    offset = session.offset
+    if start > offset:
+        raise OffsetMismatch(offset)
+    if start + length <= offset:
+        return offset  # A retry of bytes already stored
+
+    os.makedirs(settings.NUTRISCAN_UPLOAD_TMP_DIR, exist_ok=True)
+    fd = os.open(part_path(session), os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o600)
+    written = 0
+    with os.fdopen(fd, 'wb') as part:
+        part.seek(offset)
+        remaining = offset - start
+        while remaining:  # Skip the prefix a retried chunk repeats
+            data = stream.read(min(remaining, COPY_CHUNK))
+            if not data:
+                return offset
+            remaining -= len(data)
+        remaining = start + length - offset
+        while remaining:
+            data = stream.read(min(remaining, COPY_CHUNK))
+            if not data:
+                break  # Connection dropped; keep what arrived
+            part.write(data)
+            written += len(data)
+            remaining -= len(data)
+
+    if written and not UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+        offset=offset + written, updated_at=now()
+    ):
+        raise OffsetMismatch(UploadSession.objects.values_list('offset', flat=True).get(pk=session.pk))
+    session.offset = offset + written
+    return session.offset
+
+
+def completed_file(session) -> File:
+    """The finished upload as a Django File (caller closes it)."""
+    return File(open(part_path(session), 'rb'), name=os.path.basename(session.filename))
+
+
+def discard(session) -> None:
+    """Remove the session's temporary file, if any."""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def purge_expired() -> int:
+    """Delete sessions idle for longer than NUTRISCAN_UPLOAD_SESSION_TTL_HOURS, with their files."""
+    cutoff = now() - timedelta(hours=settings.NUTRISCAN_UPLOAD_SESSION_TTL_HOURS)
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in expired:
+        discard(session)
+    if expired:
+        UploadSession.objects.filter(pk__in=[session.pk for session in expired]).delete()
+    return len(expired)
@@ -0,0 +1,145 @@
+"""
+Rolling daily-log sums for the standard stats windows.
+
+GET /api/daily-logs/stats/?days=N, for N in NUTRISCAN_STATS_WINDOWS, reads
+one RollingNutritionStats row instead of summing the window's logs. A row
+holds the sums of every log dated on or after its `start`, so:
+- a change to a log is added to the user's rows whose window holds the
+  log's date, with one UPDATE (`apply_log_change`);
+- when the day moves on, only the days that left the window are read and
+  subtracted, the next time the row is used;
+- a user without rows gets all of them from one aggregate, on first read
+  or first log change.
+
+Rows are created with an INSERT that ignores conflicts, so creating them
+twice is harmless and needs no lock. Changes are neither lost nor counted
+twice because of the order of writes. A log change is applied to the rows
+*before* the log itself is written. When its UPDATE finds no rows, it
+creates them first, from logs that don't hold the change yet. A creator's
+aggregate therefore never includes a change that is also applied to its rows.
+
+Logs rewritten wholesale (rebuild_daily_logs) drop the user's rows, which
+are then built again from the logs. `manage.py verify_rolling_stats`
+compares every row with a full recomputation.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils.timezone import now
+
+from .models import DailyNutritionLog, RollingNutritionStats
+
+# DailyNutritionLog columns summed over a window; rows also count the logs (log_days)
+SUM_FIELDS = ('total_calories', 'total_protein', 'total_carbs', 'total_fat', 'scan_count')
+STATS_FIELDS = SUM_FIELDS + ('log_days',)
+
+
+def apply_log_change(user_id, date, changes: dict) -> None:
+    """
+    Add `changes` ({STATS_FIELDS name: difference}) to the user's rows whose
+    window holds `date`. Call it before writing the change to the log (see
+    module docstring); a user without rows gets them first.
+    """
+    changes = {field: change for field, change in changes.items() if change}
+    if user_id is None or not changes:
+        return
+    rows = RollingNutritionStats.objects.filter(user_id=user_id, start__lte=date)
+    updates = {field: F(field) + change for field, change in changes.items()}
+    if rows.update(updated_at=now(), **updates):
+        return
+    # No rows, or none holding `date`; they may also have been created since the UPDATE
+    if not RollingNutritionStats.objects.filter(user_id=user_id).exists():
+        _create_rows(user_id, now().date())
+    rows.update(updated_at=now(), **updates)
+
+
+def reset_rolling_stats(user_ids) -> None:
+    """Drop the users' rows; the next read builds them again from the logs."""
+    RollingNutritionStats.objects.filter(user_id__in=user_ids).delete()
+
+
+def window_stats(user_id, days: int) -> dict:
+    """STATS_FIELDS sums of the user's logs dated `days` days ago or later."""
+    today = now().date()
+    if days not in settings.NUTRISCAN_STATS_WINDOWS:
+        return _sums(DailyNutritionLog.objects.filter(user_id=user_id, date__gte=today - timedelta(days=days)))
+
+    row = RollingNutritionStats.objects.filter(user_id=user_id, window_days=days).first()
+    if row is None:
+        return _create_rows(user_id, today)[days]
+    if row.as_of < today:
+        start = today - timedelta(days=days)
+        left = _sums(DailyNutritionLog.objects.filter(user_id=user_id, date__gte=row.start, date__lt=start))
+        # Only if nobody moved the row on (or dropped it) since we read it
+        moved = RollingNutritionStats.objects.filter(pk=row.pk, as_of=row.as_of).update(
+            as_of=today, start=start, updated_at=now(),
+            **{field: F(field) - left[field] for field in STATS_FIELDS if left[field]}
+        )
+        if not moved:
+            return window_stats(user_id, days)
+        return {field: getattr(row, field) - left[field] for field in STATS_FIELDS}
+    return {field: getattr(row, field) for field in STATS_FIELDS}
+
+
+def verify_rolling_stats(user_ids=None, fix: bool = False) -> dict:
+    """
+    Compare each stored row with its sums recomputed from all its logs.
+    Returns the number of rows checked and the ones that differ, as
+    {user_id, window_days, fields: {field: (stored, expected)}}; with `fix` those are
+    overwritten with the expected sums.
+    """
+    rows = RollingNutritionStats.objects.order_by('user_id', 'window_days')
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    mismatches = []
+    checked = 0
+    for row in rows:
+        checked += 1
+        expected = _sums(DailyNutritionLog.objects.filter(user_id=row.user_id, date__gte=row.start))
+        differences = {
+            field: (getattr(row, field), expected[field])
+            for field in STATS_FIELDS
+            # Sums of floats depend on the order they were added in
+            if not math.isclose(getattr(row, field), expected[field], rel_tol=1e-9, abs_tol=1e-6)
+        }
+        if not differences:
+            continue
+        mismatches.append({'user_id': row.user_id, 'window_days': row.window_days, 'fields': differences})
+        if fix:
+            RollingNutritionStats.objects.filter(pk=row.pk).update(updated_at=now(), **expected)
+    return {'checked': checked, 'mismatches': mismatches}
+
+
+def _create_rows(user_id, today) -> dict:
+    """Rows for every standard window from one aggregate; returns {days: sums}."""
+    aggregates = {}
+    for days in settings.NUTRISCAN_STATS_WINDOWS:
+        in_window = Q(date__gte=today - timedelta(days=days))
+        aggregates.update({f'{field}_{days}': Sum(field, filter=in_window) for field in SUM_FIELDS})
+        aggregates[f'log_days_{days}'] = Count('id', filter=in_window)
+    totals = DailyNutritionLog.objects.filter(
+        user_id=user_id, date__gte=today - timedelta(days=max(settings.NUTRISCAN_STATS_WINDOWS))
+    ).aggregate(**aggregates)
+
+    windows = {
+        days: {field: totals[f'{field}_{days}'] or 0 for field in STATS_FIELDS}
+        for days in settings.NUTRISCAN_STATS_WINDOWS
+    }
+    # Another first read or log change may have created them already; its rows are as good as ours
+    RollingNutritionStats.objects.bulk_create(
+        [
+            RollingNutritionStats(
+                user_id=user_id, window_days=days, as_of=today, start=today - timedelta(days=days), **sums
+            )
+            for days, sums in windows.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return windows
+
+
+def _sums(logs) -> dict:
+    totals = logs.aggregate(log_days=Count('id'), **{field: Sum(field) for field in SUM_FIELDS})
+    return {field: totals[field] or 0 for field in STATS_FIELDS}
@@ -1,5 +1,7 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import NutritionScan, DailyNutritionLog
+from .models import NutritionScan, DailyNutritionLog, UploadSession
 
 
 class NutritionScanSerializer(serializers.ModelSerializer):
@@ -7,11 +9,39 @@ class NutritionScanSerializer(serializers.ModelSerializer):
         model = NutritionScan
         fields = [
             'id', 'image', 'food_item', 'calories', 'protein', 'carbs', 'fat',
-            'portion_size', 'confidence', 'is_favourite', 'notes',
+            'portion_size', 'confidence', 'items', 'is_favourite', 'notes',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def update(self, instance, validated_data):
+        # Write only the edited columns (plus any the view passes to save(), e.g. food_id)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+class ScanBulkSerializer(serializers.Serializer):
+    """Ids of the scans a bulk action applies to."""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.NUTRISCAN_BULK_MAX_IDS:
+            raise serializers.ValidationError(f'At most {settings.NUTRISCAN_BULK_MAX_IDS} ids per request')
+        return list(dict.fromkeys(value))
+
+
+class ScanBulkUpdateSerializer(ScanBulkSerializer):
+    """Bulk edit: the new is_favourite and/or notes for every listed scan."""
+    is_favourite = serializers.BooleanField(required=False)
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+    def validate(self, attrs):
+        if 'is_favourite' not in attrs and 'notes' not in attrs:
+            raise serializers.ValidationError('Give is_favourite and/or notes')
+        return attrs
+
 
 class NutritionScanDetailSerializer(serializers.ModelSerializer):
     class Meta:
@@ -25,3 +55,86 @@ class DailyNutritionLogSerializer(serializers.ModelSerializer):
         model = DailyNutritionLog
         fields = ['id', 'date', 'total_calories', 'total_protein', 'total_carbs', 'total_fat', 'scan_count']
         read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'content_type', 'size', 'offset', 'original_filename', 'analysis_mode',
+            'scan', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'offset', 'scan', 'created_at', 'updated_at']
+
+    def validate_content_type(self, value):
+        if not value.startswith('image/'):
+            raise serializers.ValidationError('File must be an image')
+        return value
+
+    def validate_size(self, value):
+        if value < 1:
+            raise serializers.ValidationError('Size must be at least 1 byte')
+        return value
+
+
+class FastScanRowSerializer:
+    """
+    Read-only fast path for scan listings.
+
+    Produces exactly what NutritionScanSerializer would for the same rows, but
+    from `.values()` dicts through a per-field converter table built once per
+    request, so no model instances are created and no DRF field machinery runs
+    per row.
+    """
+    fields = NutritionScanSerializer.Meta.fields
+
+    def __init__(self, context=None):
+        request = (context or {}).get('request')
+        self._converters = [
+            (name, self._converter(NutritionScan._meta.get_field(name), request))
+            for name in self.fields
+        ]
+
+    @staticmethod
+    def _converter(model_field, request):
+        """Python callable matching the DRF field's to_representation, or None for pass-through."""
+        internal_type = model_field.get_internal_type()
+        if internal_type == 'FloatField':
+            return float
+        if internal_type == 'BooleanField':
+            return bool
+        if internal_type in ('CharField', 'TextField'):
+            return str
+        if internal_type == 'DateTimeField':
+            field_timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+            def to_iso(value):
+                if field_timezone is not None and timezone.is_aware(value):
+                    value = value.astimezone(field_timezone)
+                value = value.isoformat()
+                if value.endswith('+00:00'):
+                    value = value[:-6] + 'Z'
+                return value
+            return to_iso
+        if internal_type in ('FileField', 'ImageField'):
+            storage = model_field.storage
+            build_uri = request.build_absolute_uri if request is not None else None
+
+            def to_url(name):
+                if not name:
+                    return None
+                url = storage.url(name)
+                return build_uri(url) if build_uri else url
+            return to_url
+        return None
+
+    def to_representation(self, row: dict) -> dict:
+        data = {}
+        for name, convert in self._converters:
+            value = row[name]
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def many(self, rows) -> list:
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
@@ -4,6 +4,8 @@ No external APIs, no compiler, pure-Python heuristic-based matching.
 """
 import random
 from typing import Dict, Any
+from django.conf import settings
+from .features import ImageFeatures
 from .local_food_detector import LocalFoodDetector
 
 
@@ -15,7 +17,13 @@ class NutritionAnalysisService:
     
     def __init__(self):
         """Initialize the local food detector."""
-        self.detector = LocalFoodDetector()
+        self.detector = LocalFoodDetector(
+            mode=settings.NUTRISCAN_DETECTOR_MODE,
+            lut_path=settings.NUTRISCAN_COLOR_LUT_PATH,
+            cascade=settings.NUTRISCAN_CASCADE,
+            coarse_size=settings.NUTRISCAN_CASCADE_COARSE_SIZE,
+            cascade_margin=settings.NUTRISCAN_CASCADE_MARGIN,
+        )
     
     def analyze_image(self, image_path: str) -> Dict[str, Any]:
         """
@@ -29,22 +37,101 @@ class NutritionAnalysisService:
         """
         try:
             # Use local detector to identify food
-            food_item, confidence, nutrition = self.detector.analyze_image(image_path)
-            
-            return {
-                'food_item': food_item,
-                'calories': nutrition['calories'],
-                'protein': nutrition['protein'],
-                'carbs': nutrition['carbs'],
-                'fat': nutrition['fat'],
-                'portion_size': nutrition['portion'],
-                'confidence': round(confidence, 1),
-            }
+            return self._result(*self.detector.analyze_image(image_path))
         except Exception as e:
             # Fallback to mock if local detection fails
             print(f"Local detection error: {str(e)}, using mock analysis")
             return self.get_mock_analysis()
     
+    def analyze_image_coarse(self, image_path: str) -> Dict[str, Any]:
+        """
+        Cheap analysis from a tiny decode only (the first cascade stage).
+        Used instead of analyze_image when the analysis queue is full.
+        """
+        return self._result(*self.detector.analyze_image_coarse(image_path))
+    
+    def analyze_plate(self, image_path: str) -> Dict[str, Any]:
+        """
+        Analyze a mixed plate as several food items.
+        
+        Each item's nutrition is weighted by its share of the food area, and
+        the scan totals are the sum over items; a plate of one food gives a
+        one-item breakdown. Images with no food regions (or whose plate budget
+        runs out) are analyzed as a single item, with an empty 'items' list.
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            Dictionary with nutrition totals and an 'items' breakdown
+        """
+        regions = self.detector.analyze_plate(
+            image_path,
+            grid=settings.NUTRISCAN_PLATE_GRID,
+            budget_ms=settings.NUTRISCAN_PLATE_BUDGET_MS,
+        )
+        if not regions:
+            result = self.analyze_image(image_path)
+            result['items'] = []
+            return result
+        return self._plate_result(regions)
+    
+    def analyze_features(self, features: ImageFeatures, analysis: str = 'full') -> Dict[str, Any]:
+        """
+        Same result as analyze_image ('full'), analyze_image_coarse ('coarse')
+        or analyze_plate ('plate'), from stored features instead of the image.
+        
+        Raises FeaturesUnavailable when the features can't reproduce the
+        analysis with the current detector settings.
+        """
+        if analysis != 'plate':
+            return self._result(*self.detector.classify_features(features, analysis))
+        regions = self.detector.classify_features(features, 'plate', grid=settings.NUTRISCAN_PLATE_GRID)
+        if not regions:
+            result = self._result(*self.detector.classify_features(features, 'full'))
+            result['items'] = []
+            return result
+        return self._plate_result(regions)
+    
+    @staticmethod
+    def _result(food_item: str, confidence: float, nutrition: dict) -> Dict[str, Any]:
+        return {
+            'food_item': food_item,
+            'calories': nutrition['calories'],
+            'protein': nutrition['protein'],
+            'carbs': nutrition['carbs'],
+            'fat': nutrition['fat'],
+            'portion_size': nutrition['portion'],
+            'confidence': round(confidence, 1),
+        }
+    
+    @staticmethod
+    def _plate_result(regions: list) -> Dict[str, Any]:
+        """Scan result for detector plate regions: area-weighted items and their totals."""
+        items = []
+        for food_name, confidence, area, nutrition in regions:
+            items.append({
+                'food_item': food_name.title(),
+                'area': round(area, 3),
+                'calories': round(nutrition['calories'] * area, 1),
+                'protein': round(nutrition['protein'] * area, 1),
+                'carbs': round(nutrition['carbs'] * area, 1),
+                'fat': round(nutrition['fat'] * area, 1),
+                'portion_size': nutrition['portion'],
+                'confidence': round(confidence, 1),
+            })
+        
+        return {
+            'food_item': ', '.join(item['food_item'] for item in items),
+            'calories': round(sum(item['calories'] for item in items), 1),
+            'protein': round(sum(item['protein'] for item in items), 1),
+            'carbs': round(sum(item['carbs'] for item in items), 1),
+            'fat': round(sum(item['fat'] for item in items), 1),
+            'portion_size': '1 plate',
+            'confidence': round(sum(item['confidence'] * item['area'] for item in items), 1),
+            'items': items,
+        }
+    
     def get_mock_analysis(self) -> Dict[str, Any]:
         """Return mock analysis data without processing an actual image."""
         foods = list(LocalFoodDetector.FOOD_DATABASE.items())
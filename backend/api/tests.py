@@ -2,9 +2,98 @@
 Test migration file to verify database setup.
 """
 
-from django.test import TestCase
-from api.models import NutritionScan, DailyNutritionLog
+import base64
+import importlib
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
+from PIL import Image, ImageDraw
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api import ingest
+from api.admission import AdmissionController, AnalysisOverloaded
+from api.cache import CACHE_ALIAS, CacheNamespace, cache_stats
+from api.color_lut import build_lut, load_lut, write_lut
+from api.daily_logs import rebuild_daily_logs
+from api.features import FEATURE_SCHEMA_VERSION, FeaturesUnavailable, decode_features, encode_features
+from api.ingest import analyze_upload, food_id_for
+from api.isolation import AnalysisAborted, IsolatedPool, shutdown_isolated_pool
+from api.local_food_detector import LocalFoodDetector, match_food_from_filename
+from api.log_pipeline import KeyValueFormatter, QueueLogHandler, SamplingFilter, kv
+from api.memory_profile import clear_profiles, memory_span, recent_profiles
+from api.metrics import cascade_exit_rates, metrics
+from api.middleware import RequestProfilerMiddleware
+from api.models import (
+    DailyNutritionLog, FoodItem, NutritionScan, RollingNutritionStats, ScanFeatures, UploadSession,
+)
+from api.renderers import FastJSONRenderer
+from api.resumable import write_chunk
+from api.rolling_stats import _create_rows, verify_rolling_stats
+from api.serializers import NutritionScanSerializer
+from api.services import NutritionAnalysisService
+from api.views import NutritionScanViewSet
+from api.warmup import warm_up
+
+
+# The shared cache outlives each test's rolled-back database, so tests run
+# with it off unless they set their own (SharedCacheTests)
+_NO_SHARED_CACHE = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+})
+
+
+def setUpModule():
+    _NO_SHARED_CACHE.enable()
+
+
+def tearDownModule():
+    _NO_SHARED_CACHE.disable()
+
+
+class TempDirTestCase(TestCase):
+    """
+    A fresh temporary directory per test (self.tmp_dir), removed afterwards.
+    MEDIA_ROOT points into it, so stored uploads go with it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = tmp.name
+        self.media_root = os.path.join(tmp.name, 'media')
+        self.use_settings(MEDIA_ROOT=self.media_root)
+
+    def use_settings(self, **values):
+        """Override settings until the end of the test."""
+        overrides = override_settings(**values)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
 
 
 class NutritionScanTests(TestCase):
@@ -58,3 +147,1749 @@ class DailyNutritionLogTests(TestCase):
         )
         self.assertEqual(log.total_calories, 2000)
         self.assertEqual(log.scan_count, 3)
+
+
+class FilenameMatchTests(TestCase):
+    """Test food name matching from upload filenames."""
+
+    def test_match_food_from_filename(self):
+        """Longer names win and tandoori variants are recognised."""
+        self.assertEqual(match_food_from_filename('my_Biryani_rice.jpg'), 'biryani')
+        self.assertEqual(match_food_from_filename('chicken_tandoori.jpg'), 'tandoori chicken')
+        self.assertEqual(match_food_from_filename('grilled_chicken.jpg'), 'chicken')
+        self.assertIsNone(match_food_from_filename('IMG_0001.jpg'))
+
+
+class ColorLUTTests(TestCase):
+    """Test the quantized colour LUT and the 'lut' detector mode."""
+
+    @staticmethod
+    def _plate(color, size=(80, 80)):
+        """A food-coloured disc on a white plate."""
+        img = Image.new('RGB', size, (250, 250, 250))
+        ImageDraw.Draw(img).ellipse((20, 20, size[0] - 20, size[1] - 20), fill=color)
+        return img
+
+    def test_build_and_vote(self):
+        """Food colours vote for their label; the shared plate colour casts no vote."""
+        lut = build_lut([
+            ('salad', self._plate((100, 180, 80))),
+            ('pizza', self._plate((200, 100, 50))),
+        ])
+        self.assertEqual(lut.labels, ['pizza', 'salad'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lut.bin')
+            write_lut(lut, path)
+            loaded = load_lut(path)
+            votes = loaded.vote(self._plate((103, 183, 82)))
+            self.assertEqual(set(votes), {'salad'})
+
+    def test_detector_lut_mode(self):
+        """The detector classifies by votes and falls back when the LUT is missing."""
+        lut = build_lut([
+            ('salad', self._plate((100, 180, 80))),
+            ('pizza', self._plate((200, 100, 50))),
+        ])
+        with tempfile.TemporaryDirectory() as tmp:
+            lut_path = os.path.join(tmp, 'lut.bin')
+            write_lut(lut, lut_path)
+            image_path = os.path.join(tmp, 'meal.png')
+            # Mostly plate: the average colour is near-white, but the food pixels are pizza
+            self._plate((200, 100, 50), size=(120, 120)).save(image_path)
+
+            food, confidence, nutrition = LocalFoodDetector('lut', lut_path).analyze_image(image_path)
+            self.assertEqual(food, 'pizza')
+            self.assertEqual(nutrition['calories'], 285)
+
+            missing = os.path.join(tmp, 'missing.bin')
+            food, _, _ = LocalFoodDetector('lut', missing).analyze_image(image_path)
+            self.assertNotEqual(food, 'pizza')
+
+    def test_load_lut_follows_the_file(self):
+        """A LUT built or rebuilt after the first load is picked up; an unchanged one is reused."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lut.bin')
+            self.assertIsNone(load_lut(path))
+
+            write_lut(build_lut([('salad', self._plate((100, 180, 80)))]), path)
+            lut = load_lut(path)
+            self.assertEqual(lut.labels, ['salad'])
+            self.assertIs(load_lut(path), lut)
+
+            write_lut(build_lut([('pizza', self._plate((200, 100, 50)))]), path)
+            # Rebuilt within the filesystem's timestamp resolution: move its mtime on explicitly
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+            self.assertEqual(load_lut(path).labels, ['pizza'])
+
+
+class PlateAnalysisTests(TempDirTestCase):
+    """Test tile-based multi-item plate analysis."""
+
+    def _save(self, name, halves):
+        """Save a 200x200 image whose left/right halves have the given colours."""
+        path = os.path.join(self.tmp_dir, name)
+        img = Image.new('RGB', (200, 200), halves[0])
+        ImageDraw.Draw(img).rectangle((100, 0, 199, 199), fill=halves[1])
+        img.save(path)
+        return path
+
+    def test_two_items_area_weighted(self):
+        """Each half becomes an item with half of its food's nutrition."""
+        path = self._save('thali.png', [(100, 180, 80), (235, 212, 156)])
+        result = NutritionAnalysisService().analyze_plate(path)
+
+        foods = {item['food_item']: item for item in result['items']}
+        self.assertEqual(set(foods), {'Salad', 'Biryani'})
+        self.assertEqual(foods['Salad']['area'], 0.5)
+        self.assertEqual(foods['Biryani']['calories'], 215)
+        self.assertEqual(result['calories'], 75 + 215)
+
+    def test_single_food_falls_back(self):
+        """An empty plate does not split into regions and is analyzed as one item."""
+        path = self._save('plate.png', [(250, 250, 250), (250, 250, 250)])
+        result = NutritionAnalysisService().analyze_plate(path)
+        self.assertEqual(result['items'], [])
+        self.assertTrue(result['food_item'])
+
+    def test_budget_exceeded(self):
+        """A spent CPU budget abandons tile analysis."""
+        path = self._save('thali.png', [(100, 180, 80), (235, 212, 156)])
+        self.assertIsNone(LocalFoodDetector().analyze_plate(path, budget_ms=0))
+
+
+class CascadeTests(TempDirTestCase):
+    """Test the coarse-to-fine detector cascade."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def _save(self, name, color):
+        path = os.path.join(self.tmp_dir, name)
+        Image.new('RGB', (400, 300), color).save(path)
+        return path
+
+    def test_clear_cut_exits_early(self):
+        """A solid green image is decided at the coarse stage."""
+        food, _, _ = LocalFoodDetector(cascade=True).analyze_image(self._save('green.png', (100, 180, 80)))
+        self.assertEqual(food, 'salad')
+        self.assertEqual(cascade_exit_rates(metrics.snapshot()), {'coarse': 1.0})
+
+    def test_ambiguous_escalates(self):
+        """A colour on a rule boundary escalates and matches the non-cascade result."""
+        path = self._save('edge.png', (221, 205, 145))
+        food, _, _ = LocalFoodDetector(cascade=True).analyze_image(path)
+        self.assertEqual(food, LocalFoodDetector().analyze_image(path)[0])
+        self.assertEqual(metrics.snapshot()['counters'], {'cascade.exit.full': 1})
+
+    def test_metrics_endpoint(self):
+        """GET /api/metrics/ reports the cascade exit rates, to staff only."""
+        metrics.incr('cascade.exit.coarse', 3)
+        metrics.incr('cascade.exit.full')
+        self.client.force_login(User.objects.create_user(username='member'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True))
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cascade_exit_rates'], {'coarse': 0.75, 'full': 0.25})
+
+
+class UploadGuardTests(TempDirTestCase):
+    """Test header probing and size budgets on process_image."""
+
+    URL = '/api/scans/process_image/'
+
+    @staticmethod
+    def _upload(name='meal.jpg', size=(400, 300), fmt='JPEG', content_type='image/jpeg'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (100, 180, 80)).save(buffer, format=fmt)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type=content_type)
+
+    def test_accepts_image_within_budget(self):
+        response = self.client.post(self.URL, {'image': self._upload()})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(NutritionScan.objects.count(), 1)
+
+    def test_rejects_non_image_before_insert(self):
+        fake = SimpleUploadedFile('meal.jpg', b'not really a jpeg', content_type='image/jpeg')
+        response = self.client.post(self.URL, {'image': fake})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(NutritionScan.objects.count(), 0)
+
+    def test_rejects_too_many_bytes(self):
+        with override_settings(NUTRISCAN_MAX_UPLOAD_BYTES=100):
+            response = self.client.post(self.URL, {'image': self._upload()})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(NutritionScan.objects.count(), 0)
+
+    def test_downscales_oversized_jpeg(self):
+        with override_settings(NUTRISCAN_MAX_IMAGE_PIXELS=10_000, NUTRISCAN_STORAGE_MAX_DIMENSION=100):
+            response = self.client.post(self.URL, {'image': self._upload()})
+        self.assertEqual(response.status_code, 201)
+        scan = NutritionScan.objects.get()
+        with Image.open(scan.image.path) as stored:
+            self.assertEqual(stored.size, (100, 75))
+
+    def test_rejects_oversized_png(self):
+        upload = self._upload('meal.png', fmt='PNG', content_type='image/png')
+        with override_settings(NUTRISCAN_MAX_IMAGE_PIXELS=10_000):
+            response = self.client.post(self.URL, {'image': upload})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(NutritionScan.objects.count(), 0)
+
+
+class AsyncUploadTests(TempDirTestCase):
+    """Test the native async upload path."""
+
+    URL = '/api/scans/process_image_async/'
+
+    async def test_process_image_async(self):
+        """Filename matching and the response shape match the sync view."""
+        upload = UploadGuardTests._upload('paneer_curry.jpg')
+        response = await self.async_client.post(self.URL, {'image': upload})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['food_item'], 'Paneer')
+        self.assertEqual(await NutritionScan.objects.acount(), 1)
+
+    async def test_process_image_async_analyzes_image(self):
+        upload = UploadGuardTests._upload('IMG_0001.jpg')
+        response = await self.async_client.post(self.URL, {'image': upload})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['food_item'], 'salad')
+
+    async def test_process_image_async_rejects(self):
+        response = await self.async_client.post(self.URL, {})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(self.URL)
+        self.assertEqual(response.status_code, 405)
+
+
+    async def test_process_image_async_authenticates_like_drf(self):
+        """Session logins need a CSRF token, and basic auth works, as on the sync endpoint."""
+        user = await sync_to_async(User.objects.create_user)(username='async-uploader', password='pw')
+        client = AsyncClient(enforce_csrf_checks=True)
+        await sync_to_async(client.force_login)(user)
+        for url in ('/api/scans/process_image/', self.URL):
+            response = await client.post(url, {'image': UploadGuardTests._upload('paneer_curry.jpg')})
+            self.assertEqual(response.status_code, 403)
+            self.assertIn('CSRF Failed', response.json()['detail'])
+        self.assertEqual(await NutritionScan.objects.acount(), 0)
+
+        credentials = base64.b64encode(b'async-uploader:pw').decode()
+        response = await self.async_client.post(
+            self.URL, {'image': UploadGuardTests._upload('paneer_curry.jpg')},
+            headers={'Authorization': f'Basic {credentials}'},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await NutritionScan.objects.filter(user=user).acount(), 1)
+
+
+class AdmissionControlTests(TempDirTestCase):
+    """Test the bounded analysis queue and its 429 / degrade handling."""
+
+    URL = '/api/scans/process_image/'
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_queue_bounds(self):
+        """Waiters beyond max_queue are rejected at once; queued ones time out."""
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        with controller.slot():
+            waiter_errors = []
+
+            def wait_in_queue():
+                try:
+                    with controller.slot():
+                        pass
+                except AnalysisOverloaded as e:
+                    waiter_errors.append(e)
+
+            waiter = threading.Thread(target=wait_in_queue)
+            waiter.start()
+            while controller.state()['queue_depth'] == 0:
+                pass
+            with self.assertRaises(AnalysisOverloaded) as ctx:
+                with controller.slot():
+                    pass
+            self.assertGreaterEqual(ctx.exception.retry_after, 1)
+            waiter.join()
+
+        self.assertEqual(len(waiter_errors), 1)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['admission.rejected'], 1)
+        self.assertEqual(counters['admission.timed_out'], 1)
+        self.assertEqual(controller.state()['active'], 0)
+
+    def test_overloaded_returns_429(self):
+        """A full queue answers 429 with Retry-After and stores nothing."""
+        full = AdmissionController(max_concurrent=0, max_queue=0, queue_timeout=0)
+        with mock.patch('api.views.get_admission', return_value=full):
+            response = self.client.post(self.URL, {'image': UploadGuardTests._upload('IMG_1.jpg')})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(NutritionScan.objects.count(), 0)
+
+    def test_filename_match_skips_admission(self):
+        """Filename-matched uploads never touch the detector, so they aren't throttled."""
+        full = AdmissionController(max_concurrent=0, max_queue=0, queue_timeout=0)
+        with mock.patch('api.views.get_admission', return_value=full):
+            response = self.client.post(self.URL, {'image': UploadGuardTests._upload('biryani.jpg')})
+        self.assertEqual(response.status_code, 201)
+
+    def test_overloaded_degrades_to_coarse(self):
+        full = AdmissionController(max_concurrent=0, max_queue=0, queue_timeout=0)
+        with mock.patch('api.views.get_admission', return_value=full), \
+                override_settings(NUTRISCAN_OVERLOAD_DEGRADE=True):
+            response = self.client.post(self.URL, {'image': UploadGuardTests._upload('IMG_1.jpg')})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['X-Analysis-Degraded'], 'coarse')
+        self.assertEqual(response.json()['food_item'], 'salad')
+
+    async def test_async_slot_waits_then_times_out(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.02)
+        async with controller.aslot():
+            with self.assertRaises(AnalysisOverloaded):
+                async with controller.aslot():
+                    pass
+        async with controller.aslot() as wait:
+            self.assertLess(wait, 0.02)
+        self.assertEqual(controller.state(), {'active': 0, 'queue_depth': 0, 'max_concurrent': 1, 'max_queue': 1})
+
+
+class FastReadPathTests(TestCase):
+    """The fast list/history/demo_data path must match NutritionScanSerializer exactly."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='12345')
+        NutritionScan.objects.create(
+            user=self.user, image='scans/2025/12/09/biryani.jpg', food_item='Biryani',
+            calories=430, protein=18, carbs=52, fat=16, confidence=98.0, notes='lunch',
+            items=[{'food_item': 'Biryani', 'area': 1.0}],
+        )
+        NutritionScan.objects.create(user=self.user, food_item='Salad ü', calories=150, is_favourite=True)
+
+    def _expected(self, response, queryset):
+        serializer = NutritionScanSerializer(queryset, many=True, context={'request': response.wsgi_request})
+        return json.loads(json.dumps(serializer.data))
+
+    def test_list_matches_serializer(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/scans/')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(body['results'], self._expected(response, NutritionScan.objects.all()))
+        self.assertTrue(body['results'][1]['image'].startswith('http://testserver/media/'))
+
+    def test_history_and_demo_data_match_serializer(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/scans/history/?days=1')
+        self.assertEqual(response.json(), self._expected(response, NutritionScan.objects.all()))
+
+        response = self.client.get('/api/scans/demo_data/')
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(body['demo_images'], self._expected(response, NutritionScan.objects.all()))
+
+    def test_renderer_matches_drf(self):
+        data = {'a': [1, 2.5, None, True], 'text': 'line\u2028sep ü'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_renderer_matches_drf_for_dates(self):
+        """Aware UTC datetimes end in Z like DRF's, whatever their precision; other offsets are kept."""
+        at = datetime(2026, 10, 19, 16, 43, 33, 660027, tzinfo=timezone.utc)
+        data = {
+            'created_at': at,
+            'whole_second': at.replace(microsecond=0),
+            'offset': at.astimezone(timezone(timedelta(hours=5, minutes=30))),
+            'naive': at.replace(tzinfo=None),
+            'date': at.date(),
+            'now': now(),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertIn(b'"created_at":"2026-10-19T16:43:33.660027Z"', FastJSONRenderer().render(data))
+
+
+class QueryBudgetTests(TempDirTestCase):
+    """
+    Exact query counts for every API action, at several data sizes.
+
+    A budget that only holds at one size hides N+1 queries, so each action is
+    run against 1, 10 and 50 rows per table and must issue the same number of
+    queries every time. Counts are taken inside the test transaction, so
+    get_or_create's SAVEPOINT/RELEASE pair is included.
+    """
+
+    SIZES = (1, 10, 50)
+
+    def _seed(self, rows):
+        """A user with `rows` scans and `rows` past daily logs, and an authenticated client."""
+        user = User.objects.create_user(username=f'budget-{rows}')
+        NutritionScan.objects.bulk_create(
+            NutritionScan(user=user, image=f'scans/meal_{n}.jpg', food_item='Biryani', calories=430,
+                          items=[{'food_item': 'Biryani', 'area': 1.0}])
+            for n in range(rows)
+        )
+        DailyNutritionLog.objects.bulk_create(
+            DailyNutritionLog(user=user, date=now().date() - timedelta(days=days_ago), total_calories=430, scan_count=1)
+            for days_ago in range(1, rows + 1)
+        )
+
+        client = APIClient()
+        # No session or user lookups, so only the view's own queries are counted
+        client.force_authenticate(user)
+        return client, user
+
+    def _assert_budget(self, queries, request, status_code=200):
+        for rows in self.SIZES:
+            with self.subTest(rows=rows):
+                client, user = self._seed(rows)
+                scan = NutritionScan.objects.filter(user=user).first()
+                log = DailyNutritionLog.objects.filter(user=user).first()
+                with self.assertNumQueries(queries):
+                    response = request(client, scan, log)
+                self.assertEqual(response.status_code, status_code)
+
+    def test_scan_list(self):
+        # COUNT for pagination + one page
+        self._assert_budget(2, lambda client, scan, log: client.get('/api/scans/'))
+
+    def test_scan_retrieve(self):
+        self._assert_budget(1, lambda client, scan, log: client.get(f'/api/scans/{scan.pk}/'))
+
+    def test_scan_create(self):
+        self._assert_budget(
+            1, lambda client, scan, log: client.post('/api/scans/', {'food_item': 'Dosa'}), status_code=201
+        )
+
+    def test_scan_update(self):
+        # Fetch, look up the renamed food in the catalog, UPDATE
+        self._assert_budget(3, lambda client, scan, log: client.put(f'/api/scans/{scan.pk}/', {'food_item': 'Dosa'}))
+
+    def test_scan_partial_update(self):
+        self._assert_budget(2, lambda client, scan, log: client.patch(f'/api/scans/{scan.pk}/', {'notes': 'dinner'}))
+
+    def test_scan_nutrition_update(self):
+        # Fetch, UPDATE the scan, UPDATE its daily log by the difference. The rolling sums first:
+        # the user has none yet, so an UPDATE, their existence check, one aggregate for every
+        # window, INSERT of the rows and the UPDATE again
+        self._assert_budget(9, lambda client, scan, log: client.patch(f'/api/scans/{scan.pk}/', {'calories': 500}))
+
+    def test_scan_destroy(self):
+        # Fetch, UPDATE of its daily log (after creating the rolling sums, as above), then the
+        # deletion collector's fast DELETEs of ScanFeatures and UploadSession and the scan's DELETE
+        self._assert_budget(11, lambda client, scan, log: client.delete(f'/api/scans/{scan.pk}/'), status_code=204)
+
+    def test_scan_demo_data(self):
+        self._assert_budget(1, lambda client, scan, log: client.get('/api/scans/demo_data/'))
+
+    def test_scan_history(self):
+        self._assert_budget(1, lambda client, scan, log: client.get('/api/scans/history/?days=30'))
+
+    def test_scan_top_foods(self):
+        # One grouped query joined to FoodItem for the names
+        self._assert_budget(1, lambda client, scan, log: client.get('/api/scans/top_foods/?days=30'))
+
+    def test_scan_toggle_favourite(self):
+        self._assert_budget(2, lambda client, scan, log: client.post(f'/api/scans/{scan.pk}/toggle_favourite/'))
+
+    def test_scan_bulk_update(self):
+        self._assert_budget(
+            1,
+            lambda client, scan, log: client.post(
+                '/api/scans/bulk_update/', {'ids': [scan.pk], 'is_favourite': True, 'notes': 'lunch'}, format='json'
+            ),
+        )
+
+    def test_scan_bulk_delete(self):
+        for rows in self.SIZES:
+            with self.subTest(rows=rows):
+                client, user = self._seed(rows)
+                ids = list(NutritionScan.objects.filter(user=user).values_list('pk', flat=True))
+                DailyNutritionLog.objects.create(user=user, total_calories=430 * rows, scan_count=rows)
+                # SELECT of the listed scans, the deletion collector's SELECT, fast DELETEs of
+                # ScanFeatures and UploadSession, DELETE of the scans, then the logs' rebuild
+                # (aggregate, stored logs, upsert, DELETE of the user's rolling sums).
+                # File cleanup runs on commit.
+                with self.assertNumQueries(9):
+                    response = client.post('/api/scans/bulk_delete/', {'ids': ids}, format='json')
+                self.assertEqual(response.json(), {'deleted': rows})
+
+    def test_process_image_creates_daily_log(self):
+        # INSERT scan, FoodItem lookup, UPDATE with results, then _update_daily_log: SELECT,
+        # SAVEPOINT, counting the new log in the rolling sums (none yet: UPDATE, existence
+        # check, aggregate, INSERT, UPDATE again), INSERT, RELEASE, UPDATE of the rolling
+        # sums and UPDATE of the log
+        self._assert_budget(
+            14,
+            lambda client, scan, log: client.post(
+                '/api/scans/process_image/', {'image': UploadGuardTests._upload('biryani.jpg')}
+            ),
+            status_code=201,
+        )
+
+    def test_process_image_updates_daily_log(self):
+        def upload_twice(client, scan, log):
+            client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('biryani.jpg')})
+            # INSERT, FoodItem lookup, UPDATE, then SELECT of today's log, UPDATE of the
+            # rolling sums and UPDATE of the log
+            with self.assertNumQueries(6):
+                return client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('meal.jpg')})
+
+        self._assert_budget(20, upload_twice, status_code=201)
+
+    def test_update_daily_log(self):
+        for rows in self.SIZES:
+            with self.subTest(rows=rows):
+                client, user = self._seed(rows)
+                scan = NutritionScan.objects.filter(user=user).first()
+                # The first change also creates the log and the rolling sums
+                with self.assertNumQueries(11):
+                    NutritionScanViewSet._update_daily_log(user, scan)
+                with self.assertNumQueries(3):
+                    NutritionScanViewSet._update_daily_log(user, scan)
+
+    def test_daily_log_list(self):
+        self._assert_budget(2, lambda client, scan, log: client.get('/api/daily-logs/'))
+
+    def test_daily_log_retrieve(self):
+        self._assert_budget(1, lambda client, scan, log: client.get(f'/api/daily-logs/{log.pk}/'))
+
+    def test_daily_log_today(self):
+        # SELECT, then on first call of the day SAVEPOINT, counting the new log in the rolling
+        # sums (none yet: UPDATE, existence check, aggregate, INSERT, UPDATE again), INSERT, RELEASE
+        self._assert_budget(9, lambda client, scan, log: client.get('/api/daily-logs/today/'))
+
+    def test_daily_log_rebuild(self):
+        # One grouped aggregate over the scans, the stored logs, one bulk upsert, and
+        # dropping the user's rolling sums
+        self._assert_budget(4, lambda client, scan, log: client.post('/api/daily-logs/rebuild/'))
+
+    def test_daily_log_stats(self):
+        def stats_twice(client, scan, log):
+            client.get('/api/daily-logs/stats/?days=30')
+            return client.get('/api/daily-logs/stats/?days=90')
+
+        # First read: SELECT of the missing rolling row, one aggregate for every standard window
+        # and INSERT of their rows. Later reads: SELECT of the row.
+        self._assert_budget(4, stats_twice)
+
+    def test_daily_log_stats_other_window(self):
+        # Windows without rolling sums are summed in one aggregate
+        self._assert_budget(1, lambda client, scan, log: client.get('/api/daily-logs/stats/?days=14'))
+
+    def test_health_check(self):
+        self._assert_budget(0, lambda client, scan, log: client.get('/api/health/'))
+
+
+class LogPipelineTests(TestCase):
+    """Test the queue handler, sampling filter and key=value formatter."""
+
+    def _record(self, msg='upload.filename_match', level=20, args=(), **fields):
+        logger = logging.getLogger('api.ingest')
+        return logger.makeRecord(logger.name, level, __file__, 0, msg, args, None, extra=kv(**fields))
+
+    def test_key_value_format(self):
+        record = self._record(basename='my biryani.jpg', matched='biryani', score=0.5, hit=True, miss=None)
+        line = KeyValueFormatter().format(record)
+        self.assertRegex(line, r'^ts=\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3} level=INFO logger=api.ingest pid=\d+ ')
+        self.assertTrue(line.endswith(
+            'msg=upload.filename_match basename="my biryani.jpg" matched=biryani score=0.5 hit=true miss=null'
+        ))
+
+    def test_sampling_keeps_one_in_n_per_template(self):
+        sampler = SamplingFilter(rate=4)
+        kept = [sampler.filter(self._record()) for _ in range(8)]
+        self.assertEqual(kept, [True, False, False, False] * 2)
+        # Templates are counted separately, and warnings are never dropped
+        self.assertTrue(sampler.filter(self._record('upload.image_analysis')))
+        self.assertTrue(all(sampler.filter(self._record(level=30)) for _ in range(4)))
+
+        record = self._record()
+        SamplingFilter(rate=4).filter(record)
+        self.assertIn('sample_rate=4', KeyValueFormatter().format(record))
+
+    def test_queue_handler_formats_on_listener_thread(self):
+        class Value:
+            formatted_on = None
+
+            def __str__(self):
+                Value.formatted_on = threading.current_thread()
+                return 'value'
+
+        written = []
+        sink = logging.getLogger('nutriscan.test_sink')
+        sink_handler = logging.Handler()
+        sink_handler.emit = lambda record: written.append(sink_handler.format(record))
+        sink.addHandler(sink_handler)
+        self.addCleanup(sink.removeHandler, sink_handler)
+
+        handler = QueueLogHandler(sink='nutriscan.test_sink', maxsize=10)
+        handler.handle(self._record('matched %s', args=(Value(),)))
+        handler.flush()
+        handler.close()
+
+        self.assertEqual(written, ['matched value'])
+        self.assertIsNotNone(Value.formatted_on)
+        self.assertIsNot(Value.formatted_on, threading.current_thread())
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        metrics.reset()
+        handler = QueueLogHandler(sink='nutriscan.test_sink', maxsize=1)
+        handler._pid = os.getpid()  # As if the listener were running, but nothing drains the queue
+
+        for _ in range(3):
+            handler.handle(self._record())
+        self.assertEqual(metrics.snapshot()['counters']['logging.dropped'], 2)
+
+
+class StartupProfileTests(TestCase):
+    """A fresh worker must answer a health check without importing the image stack."""
+
+    def test_health_check_boots_without_pil(self):
+        out = io.StringIO()
+        call_command('profile_startup', '--repeat', '1', '--check', stdout=out)
+        self.assertIn('first request', out.getvalue())
+        self.assertIn('Heavy optional modules loaded: none', out.getvalue())
+
+
+class WarmupTests(TestCase):
+    """Test the pre-fork warm-up hook."""
+
+    def test_warm_up_runs_every_step_and_leaves_no_metrics(self):
+        metrics.incr('before.warm_up')
+        timings = warm_up()
+        self.assertEqual(set(timings), {'urls', 'catalog', 'image_stack', 'synthetic_analysis'})
+        self.assertEqual(metrics.snapshot()['counters'], {})
+
+    def test_ready_hook_is_opt_in(self):
+        config = apps.get_app_config('api')
+        with mock.patch('api.warmup.warm_up') as warm_up:
+            config.ready()
+            warm_up.assert_not_called()
+            with override_settings(NUTRISCAN_WARMUP=True):
+                config.ready()
+            warm_up.assert_called_once_with()
+
+
+class ReanalyzeScansTests(TempDirTestCase):
+    """Test the resumable re-analysis backfill command."""
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint = os.path.join(self.tmp_dir, 'reanalyze.json')
+
+        self.user = User.objects.create_user(username='backfill')
+        self.stale = NutritionScan.objects.create(
+            user=self.user, image=UploadGuardTests._upload('meal.jpg'), food_item='stale', calories=1,
+        )
+        self.matched = NutritionScan.objects.create(
+            user=self.user, image=UploadGuardTests._upload('biryani.jpg'), food_item='Biryani',
+            food=FoodItem.objects.get(name='Biryani'),
+            calories=430, protein=18, carbs=52, fat=16, portion_size='1 cup cooked', confidence=98.0,
+        )
+        self.missing = NutritionScan.objects.create(user=self.user, image='scans/gone.jpg', calories=5)
+        DailyNutritionLog.objects.create(user=self.user, date=now().date(), total_calories=436, scan_count=3)
+
+    def _run(self, *args):
+        out = io.StringIO()
+        call_command('reanalyze_scans', '--checkpoint', self.checkpoint, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_updates_stale_scans_and_daily_totals(self):
+        expected = analyze_upload('meal.jpg', self.stale.image.path)
+        out = self._run('--workers', '0', '--batch-size', '1')
+
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.food_item, expected['food_item'])
+        self.assertEqual(self.stale.calories, expected['calories'])
+        log = DailyNutritionLog.objects.get(user=self.user)
+        self.assertAlmostEqual(log.total_calories, 436 - 1 + expected['calories'])
+        self.assertAlmostEqual(log.total_protein, expected['protein'])
+        self.assertEqual(log.scan_count, 3)
+        self.assertIn('3 scans: 1 changed, 1 skipped', out)
+        self.assertIn('scans/s eta', out)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumes_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'analysis_mode': '', 'last_pk': self.stale.pk, 'processed': 1,
+                       'changed': 0, 'skipped': 0}, f)
+        out = self._run('--workers', '0')
+
+        self.assertIn(f'Resuming after scan {self.stale.pk}', out)
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.food_item, 'stale')
+        self.assertEqual(DailyNutritionLog.objects.get(user=self.user).total_calories, 436)
+
+    def test_reclassifies_from_stored_features(self):
+        """The first run stores features; later runs need no image at all."""
+        expected = analyze_upload('meal.jpg', self.stale.image.path)
+        self._run('--workers', '0')
+        self.assertEqual(list(ScanFeatures.objects.values_list('scan_id', flat=True)), [self.stale.pk])
+
+        os.remove(self.stale.image.path)
+        NutritionScan.objects.filter(pk=self.stale.pk).update(food_item='stale', calories=1)
+        out = self._run('--workers', '0', '--features-only')
+
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.food_item, expected['food_item'])
+        self.assertEqual(self.stale.calories, expected['calories'])
+        self.assertIn('1 skipped (image missing or analysis failed), 2 without decoding their image', out)
+
+    def test_process_pool_matches_in_process(self):
+        self._run('--workers', '2')
+        self.stale.refresh_from_db()
+        pooled = self.stale.food_item
+        self.assertNotEqual(pooled, 'stale')
+
+        NutritionScan.objects.filter(pk=self.stale.pk).update(food_item='stale')
+        self._run('--workers', '0')
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.food_item, pooled)
+
+
+class FeatureStoreTests(TempDirTestCase):
+    """Test stored per-scan features and classification from them."""
+
+    def _images(self):
+        """Solid, two-item, plated and noisy test images, saved as JPEG and PNG."""
+        rng = random.Random(38)
+        images = {
+            'green': Image.new('RGB', (400, 300), (100, 180, 80)),
+            'edge': Image.new('RGB', (400, 300), (221, 205, 145)),
+            'pizza_plate': ColorLUTTests._plate((200, 100, 50), size=(240, 240)),
+            'noise': Image.new('RGB', (300, 200)),
+        }
+        images['noise'].putdata([
+            (rng.randrange(120, 256), rng.randrange(60, 200), rng.randrange(0, 120)) for _ in range(300 * 200)
+        ])
+        thali = Image.new('RGB', (400, 400), (100, 180, 80))
+        ImageDraw.Draw(thali).rectangle((200, 0, 399, 399), fill=(235, 212, 156))
+        images['thali'] = thali
+
+        paths = []
+        for name, img in images.items():
+            for ext in ('jpg', 'png'):
+                path = os.path.join(self.tmp_dir, f'{name}.{ext}')
+                img.save(path)
+                paths.append(path)
+        return paths
+
+    def _lut_path(self, bits=5):
+        path = os.path.join(self.tmp_dir, f'lut{bits}.bin')
+        write_lut(build_lut([
+            ('salad', ColorLUTTests._plate((100, 180, 80))),
+            ('pizza', ColorLUTTests._plate((200, 100, 50))),
+        ], bits=bits), path)
+        return path
+
+    def test_round_trip(self):
+        """Encoded features decode to the same values; other schema versions are refused."""
+        features = LocalFoodDetector().extract_features(self._images()[0])
+        payload = encode_features(features)
+        self.assertEqual(decode_features(payload), features)
+        self.assertLess(len(payload), 4096)
+
+        data = bytearray(zlib.decompress(payload))
+        data[4] += 1  # schema version
+        with self.assertRaises(FeaturesUnavailable):
+            decode_features(zlib.compress(bytes(data)))
+        with self.assertRaises(FeaturesUnavailable):
+            decode_features(b'not a payload')
+
+    def test_matches_image_analysis(self):
+        """Every analysis from features equals the same analysis of the image."""
+        detectors = {
+            'colour': LocalFoodDetector(),
+            'cascade': LocalFoodDetector(cascade=True),
+            'lut': LocalFoodDetector('lut', self._lut_path()),
+            'lut_cascade': LocalFoodDetector('lut', self._lut_path(bits=4), cascade=True),
+        }
+        for path in self._images():
+            for name, detector in detectors.items():
+                with self.subTest(image=path, detector=name):
+                    features = decode_features(encode_features(detector.extract_features(path)))
+                    self.assertEqual(detector.classify_features(features), detector.analyze_image(path))
+                    self.assertEqual(
+                        detector.classify_features(features, 'coarse'), detector.analyze_image_coarse(path)
+                    )
+                    expected = detector.analyze_plate(path, budget_ms=10000)
+                    if detector.mode == 'lut':
+                        try:
+                            self.assertEqual(detector.classify_features(features, 'plate'), expected)
+                        except FeaturesUnavailable:
+                            pass  # tiles with food need the image's colours in 'lut' mode
+                    else:
+                        self.assertEqual(detector.classify_features(features, 'plate'), expected)
+
+    def test_mismatched_settings_need_the_image(self):
+        """Features taken with another coarse size, grid or a finer LUT are not used."""
+        path = self._images()[0]
+        features = LocalFoodDetector().extract_features(path)
+        with self.assertRaises(FeaturesUnavailable):
+            LocalFoodDetector(cascade=True, coarse_size=48).classify_features(features)
+        with self.assertRaises(FeaturesUnavailable):
+            LocalFoodDetector().classify_features(features, 'plate', grid=4)
+        with self.assertRaises(FeaturesUnavailable):
+            LocalFoodDetector('lut', self._lut_path(bits=6)).classify_features(features)
+
+    def test_uploads_store_features_after_responding(self):
+        """Extraction runs in the executor once the upload commits; busy analyzers leave it to the backfill."""
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda fn, *args: fn(*args)
+        with mock.patch('api.ingest.get_analysis_executor', return_value=executor):
+            with self.captureOnCommitCallbacks() as callbacks, \
+                    mock.patch.object(LocalFoodDetector, 'extract_features') as extract:
+                analyzed = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('meal.jpg')})
+                matched = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('biryani.jpg')})
+            extract.assert_not_called()
+            self.assertEqual((analyzed.status_code, matched.status_code), (201, 201))
+            self.assertNotIn('features', analyzed.json())
+            self.assertEqual(len(callbacks), 1)  # Not for the filename match
+            callbacks[0]()
+        stored = ScanFeatures.objects.get()
+        self.assertEqual(stored.scan_id, analyzed.json()['id'])
+        self.assertEqual(stored.schema_version, FEATURE_SCHEMA_VERSION)
+
+        stored.delete()
+        scan = NutritionScan.objects.get(pk=analyzed.json()['id'])
+        with mock.patch('api.ingest.get_admission', return_value=AdmissionController(0, 16, 5)):
+            ingest.store_scan_features(scan.pk, scan.image.path)
+        self.assertFalse(ScanFeatures.objects.exists())
+        self.assertEqual(metrics.snapshot()['counters']['features.deferred'], 1)
+
+        checkpoint = os.path.join(self.tmp_dir, 'reanalyze.json')
+        with override_settings(NUTRISCAN_FEATURE_STORE=False):
+            call_command('reanalyze_scans', '--workers', '0', '--checkpoint', checkpoint, stdout=io.StringIO())
+        self.assertFalse(ScanFeatures.objects.exists())
+        call_command('reanalyze_scans', '--workers', '0', '--checkpoint', checkpoint, stdout=io.StringIO())
+        self.assertEqual(ScanFeatures.objects.get().scan_id, scan.pk)
+
+
+class DailyLogRebuildTests(TestCase):
+    """Test keeping daily logs in sync with scans and rebuilding them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rebuild')
+        self.today = now().date()
+        self.yesterday = self.today - timedelta(days=1)
+        self.lunch = NutritionScan.objects.create(user=self.user, calories=400, protein=20)
+        self.dinner = NutritionScan.objects.create(user=self.user, calories=600, fat=10)
+        self.old = NutritionScan.objects.create(user=self.user, calories=300)
+        NutritionScan.objects.filter(pk=self.old.pk).update(created_at=now() - timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _log(self, date):
+        return DailyNutritionLog.objects.get(user=self.user, date=date)
+
+    def test_edit_and_delete_adjust_totals(self):
+        """PATCH and DELETE move only the scan's difference into its log."""
+        DailyNutritionLog.objects.create(user=self.user, date=self.today, total_calories=1000, total_protein=20,
+                                         total_fat=10, scan_count=2)
+
+        self.client.patch(f'/api/scans/{self.lunch.pk}/', {'calories': 450, 'notes': 'bigger'})
+        log = self._log(self.today)
+        self.assertEqual((log.total_calories, log.scan_count), (1050, 2))
+
+        self.client.delete(f'/api/scans/{self.dinner.pk}/')
+        log = self._log(self.today)
+        self.assertEqual((log.total_calories, log.total_fat, log.scan_count), (450, 0, 1))
+
+    def test_rebuild_fixes_drift(self):
+        """Wrong, missing and orphaned logs are fixed; correct logs are not written."""
+        DailyNutritionLog.objects.create(user=self.user, date=self.today, total_calories=5, scan_count=9)
+        DailyNutritionLog.objects.create(user=self.user, date=self.today - timedelta(days=7), total_calories=80,
+                                         scan_count=1)
+
+        self.assertEqual(rebuild_daily_logs(), {'created': 1, 'updated': 2, 'unchanged': 0})
+        today = self._log(self.today)
+        self.assertEqual((today.total_calories, today.total_protein, today.scan_count), (1000, 20, 2))
+        self.assertEqual(self._log(self.yesterday).total_calories, 300)
+        self.assertEqual(self._log(self.today - timedelta(days=7)).scan_count, 0)
+        self.assertEqual(rebuild_daily_logs(), {'created': 0, 'updated': 0, 'unchanged': 3})
+
+    def test_endpoint_and_command_scope(self):
+        """The endpoint rebuilds only the caller's logs; --dry-run writes nothing."""
+        other = User.objects.create_user(username='other')
+        NutritionScan.objects.create(user=other, calories=100)
+
+        response = self.client.post('/api/daily-logs/rebuild/?days=0')
+        self.assertEqual(response.json(), {'created': 1, 'updated': 0, 'unchanged': 0})
+        self.assertFalse(DailyNutritionLog.objects.filter(user=other).exists())
+        self.assertEqual(self.client.post('/api/daily-logs/rebuild/?days=x').status_code, 400)
+
+        out = io.StringIO()
+        call_command('rebuild_daily_logs', '--dry-run', stdout=out)
+        self.assertIn('Would fix 2 daily logs: 2 created, 0 updated, 1 already correct', out.getvalue())
+        self.assertFalse(DailyNutritionLog.objects.filter(user=other).exists())
+
+
+class FoodLinkTests(TempDirTestCase):
+    """Test linking scans to the FoodItem catalog and the most-logged foods."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='foodie')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_catalog_seeded_by_migration(self):
+        """Every detector food has a catalog entry."""
+        names = set(FoodItem.objects.values_list('name', flat=True))
+        self.assertTrue({name.title() for name in LocalFoodDetector.FOOD_DATABASE} <= names)
+
+    def test_upload_and_rename_link_food(self):
+        """Uploads resolve their food; renaming a scan re-resolves it."""
+        response = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('biryani.jpg')})
+        scan = NutritionScan.objects.get(pk=response.json()['id'])
+        self.assertEqual(scan.food.name, 'Biryani')
+        self.assertEqual(response.json()['food'], scan.food_id)
+
+        self.client.patch(f'/api/scans/{scan.pk}/', {'food_item': 'salad'})
+        scan.refresh_from_db()
+        self.assertEqual(scan.food.name, 'Salad')
+        self.client.patch(f'/api/scans/{scan.pk}/', {'food_item': "Grandma's stew"})
+        scan.refresh_from_db()
+        self.assertIsNone(scan.food_id)
+
+    def test_migration_resolves_existing_scans(self):
+        """Names match in any case, plates use their largest item, unknown names stay unlinked."""
+        plate = NutritionScan.objects.create(food_item='Salad, Biryani', items=[
+            {'food_item': 'Salad', 'area': 0.6}, {'food_item': 'Biryani', 'area': 0.4},
+        ])
+        lower = NutritionScan.objects.create(food_item=' idli ')
+        unknown = NutritionScan.objects.create(food_item='Mystery')
+
+        migration = importlib.import_module('api.migrations.0007_resolve_scan_foods')
+        migration.resolve_scan_foods(apps, None)
+        self.assertEqual(NutritionScan.objects.get(pk=plate.pk).food.name, 'Salad')
+        self.assertEqual(NutritionScan.objects.get(pk=lower.pk).food.name, 'Idli')
+        self.assertIsNone(NutritionScan.objects.get(pk=unknown.pk).food_id)
+
+    def test_top_foods(self):
+        """Foods are ranked by scan count within the window, for the current user only."""
+        salad, idli = FoodItem.objects.get(name='Salad'), FoodItem.objects.get(name='Idli')
+        for food, calories in ((salad, 75), (salad, 80), (idli, 170)):
+            NutritionScan.objects.create(user=self.user, food=food, food_item=food.name, calories=calories)
+        old = NutritionScan.objects.create(user=self.user, food=idli, calories=170)
+        NutritionScan.objects.filter(pk=old.pk).update(created_at=now() - timedelta(days=60))
+        other = User.objects.create_user(username='other')
+        NutritionScan.objects.bulk_create(NutritionScan(user=other, food=idli) for _ in range(5))
+
+        rows = self.client.get('/api/scans/top_foods/?days=30').json()
+        self.assertEqual([(row['name'], row['scan_count'], row['total_calories']) for row in rows],
+                         [('Salad', 2, 155.0), ('Idli', 1, 170.0)])
+        latest_salad = NutritionScan.objects.filter(food=salad).latest('created_at')
+        self.assertEqual(rows[0]['last_logged'], NutritionScanSerializer(latest_salad).data['created_at'])
+        self.assertTrue(rows[0]['last_logged'].endswith('Z'))
+        self.assertEqual(len(self.client.get('/api/scans/top_foods/?limit=1').json()), 1)
+        self.assertEqual(self.client.get('/api/scans/top_foods/?days=x').status_code, 400)
+
+
+class ImportPhotosTests(TempDirTestCase):
+    """Test the bulk photo archive import command."""
+
+    def setUp(self):
+        super().setUp()
+        self.archive = os.path.join(self.tmp_dir, 'archive')
+        os.makedirs(os.path.join(self.archive, '2023', 'march'))
+        self.user = User.objects.create_user(username='archivist')
+
+    def _photo(self, relpath, color=(100, 180, 80), exif_time=None, mtime=None):
+        path = os.path.join(self.archive, relpath)
+        img = Image.new('RGB', (120, 90), color)
+        if exif_time:
+            exif = Image.Exif()
+            exif.get_ifd(0x8769)[36867] = exif_time
+            img.save(path, exif=exif)
+        else:
+            img.save(path)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _run(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_photos', self.archive, '--user', 'archivist', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_dedupes_and_backdates(self):
+        """Duplicates and non-images are skipped; scans are dated from EXIF or mtime; logs are rebuilt."""
+        self._photo('2023/march/lunch.jpg', exif_time='2023:03:14 13:05:00')
+        self._photo('2023/march/copy of lunch.jpg', exif_time='2023:03:14 13:05:00')
+        mtime = datetime(2023, 3, 15, 20, 0, tzinfo=timezone.utc).timestamp()
+        self._photo('2023/biryani.png', color=(235, 212, 156), mtime=mtime)
+        with open(os.path.join(self.archive, 'notes.jpg'), 'w') as f:
+            f.write('not a photo')
+
+        out, err = self._run('--workers', '0', '--batch-size', '2')
+
+        self.assertIn('Imported 2 photos for archivist (1 rejected, 1 duplicates)', out)
+        self.assertIn('notes.jpg: not a valid image', err)
+        scans = {scan.created_at.date(): scan for scan in NutritionScan.objects.filter(user=self.user)}
+        self.assertEqual(set(scans), {date(2023, 3, 14), date(2023, 3, 15)})
+        self.assertEqual(scans[date(2023, 3, 14)].created_at.hour, 13)
+        self.assertEqual(scans[date(2023, 3, 15)].food.name, 'Biryani')
+        self.assertTrue(os.path.exists(scans[date(2023, 3, 14)].image.path))
+        self.assertEqual(ScanFeatures.objects.count(), 1)  # the filename match needs none
+
+        log = DailyNutritionLog.objects.get(user=self.user, date=date(2023, 3, 15))
+        self.assertEqual((log.total_calories, log.scan_count), (430, 1))
+
+    def test_rerun_imports_only_new_files(self):
+        """Photos already imported for the user are recognized by content hash."""
+        self._photo('2023/march/lunch.jpg')
+        self._run('--workers', '0')
+        self._photo('2023/march/dinner.jpg', color=(200, 100, 50))
+
+        out, _ = self._run('--workers', '2')
+        self.assertIn('Found 2 images, 1 already imported or duplicates', out)
+        self.assertEqual(NutritionScan.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(DailyNutritionLog.objects.get(user=self.user).scan_count, 2)
+
+
+class ResumableUploadTests(TempDirTestCase):
+    """Test the chunked, resumable upload protocol."""
+
+    def setUp(self):
+        super().setUp()
+        self.parts_dir = os.path.join(self.tmp_dir, 'parts')
+        self.use_settings(NUTRISCAN_UPLOAD_TMP_DIR=self.parts_dir)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), (100, 180, 80)).save(buffer, format='PNG')
+        self.data = buffer.getvalue()
+        self.user = User.objects.create_user(username='mobile')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _start(self, data=None, **fields):
+        body = dict({'filename': 'IMG_0001.png', 'size': len(data or self.data), 'content_type': 'image/png'}, **fields)
+        return self.client.post('/api/uploads/', body, format='json')
+
+    def _put(self, session_id, start, end, data=None, total=None):
+        data = data if data is not None else self.data
+        return self.client.put(
+            f'/api/uploads/{session_id}/', data[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{total or len(data)}',
+        )
+
+    def test_chunked_upload_with_retry_and_resume(self):
+        """Chunks, a repeated chunk and an overlapping retry assemble the file; finalize analyzes it once."""
+        session_id = self._start(original_filename='salad.png').json()['id']
+        third = len(self.data) // 3
+
+        self.assertEqual(self._put(session_id, 0, third - 1).json()['offset'], third)
+        self.assertEqual(self._put(session_id, 0, third - 1).json()['offset'], third)  # Repeated
+        response = self.client.get(f'/api/uploads/{session_id}/')
+        self.assertEqual((response.json()['offset'], response['Upload-Offset']), (third, str(third)))
+
+        self._put(session_id, third, 2 * third - 1)
+        final = self._put(session_id, third + 10, len(self.data) - 1).json()  # Overlaps what's stored
+        self.assertEqual(final, {'offset': len(self.data), 'size': len(self.data), 'complete': True})
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        scan = NutritionScan.objects.get(pk=response.json()['id'])
+        self.assertEqual(scan.food_item, 'Salad')  # Matched from original_filename
+        with scan.image.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(DailyNutritionLog.objects.get(user=self.user).scan_count, 1)
+        self.assertEqual(os.listdir(self.parts_dir), [])
+
+        again = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual((again.status_code, again.json()['id']), (200, scan.pk))
+        self.assertEqual(self._put(session_id, 0, 9).status_code, 409)
+
+    def test_rejected_chunks(self):
+        """Gaps, wrong totals, oversized chunks and uploads are refused."""
+        session_id = self._start().json()['id']
+        gap = self._put(session_id, 100, 199)
+        self.assertEqual((gap.status_code, gap.json()['offset'], gap['Upload-Offset']), (409, 0, '0'))
+        self.assertEqual(self._put(session_id, 0, 99, total=len(self.data) + 1).status_code, 400)
+        with override_settings(NUTRISCAN_UPLOAD_MAX_CHUNK_BYTES=50):
+            self.assertEqual(self._put(session_id, 0, 99).status_code, 413)
+        with override_settings(NUTRISCAN_MAX_UPLOAD_BYTES=10):
+            self.assertEqual(self._start().status_code, 413)
+        self.assertEqual(self._start(content_type='text/plain').status_code, 400)
+
+        incomplete = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual((incomplete.status_code, incomplete.json()['offset']), (409, 0))
+
+    def test_dropped_connection_keeps_received_bytes(self):
+        """Bytes read before the stream ends count toward the offset."""
+        session = UploadSession.objects.create(filename='a.png', content_type='image/png', size=len(self.data))
+        offset = write_chunk(session, 0, io.BytesIO(self.data[:700]), 1000)
+        self.assertEqual(offset, 700)
+        self.assertEqual(UploadSession.objects.get(pk=session.pk).offset, 700)
+
+    def test_invalid_image_and_other_users(self):
+        """A finished upload that isn't an image is discarded; sessions are private to their user."""
+        junk = b'not an image at all' * 10
+        session_id = self._start(data=junk).json()['id']
+        self._put(session_id, 0, len(junk) - 1, data=junk)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other'))
+        self.assertEqual(other.get(f'/api/uploads/{session_id}/').status_code, 404)
+
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').status_code, 404)
+        self.assertFalse(NutritionScan.objects.exists())
+
+    def test_expired_sessions_are_purged(self):
+        """Starting an upload removes sessions idle past the TTL, with their files."""
+        stale_id = self._start().json()['id']
+        self._put(stale_id, 0, 99)
+        UploadSession.objects.filter(pk=stale_id).update(updated_at=now() - timedelta(days=2))
+
+        self._start()
+        self.assertFalse(UploadSession.objects.filter(pk=stale_id).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.parts_dir, f'{stale_id}.part')))
+
+
+class BulkScanActionTests(TempDirTestCase):
+    """Test bulk favourite/notes updates and bulk deletes."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='bulk')
+        self.scans = []
+        for n, calories in enumerate((400, 600, 300)):
+            scan = NutritionScan(user=self.user, calories=calories, protein=10)
+            scan.image.save(f'meal_{n}.jpg', ContentFile(b'jpeg bytes'), save=False)
+            scan.save()
+            self.scans.append(scan)
+        self.other = NutritionScan.objects.create(user=User.objects.create_user(username='other'), calories=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _post(self, action, body):
+        return self.client.post(f'/api/scans/{action}/', body, format='json')
+
+    def test_bulk_update(self):
+        """Only the user's listed scans change, and only the given fields."""
+        ids = [self.scans[0].pk, self.scans[1].pk, self.other.pk]
+        response = self._post('bulk_update', {'ids': ids, 'is_favourite': True})
+        self.assertEqual(response.json(), {'updated': 2})
+        self.assertEqual(
+            list(NutritionScan.objects.filter(is_favourite=True).order_by('pk').values_list('pk', flat=True)),
+            ids[:2],
+        )
+
+        self._post('bulk_update', {'ids': ids, 'notes': 'team lunch'})
+        self.scans[0].refresh_from_db()
+        self.assertEqual((self.scans[0].notes, self.scans[0].is_favourite), ('team lunch', True))
+        self.assertIsNone(NutritionScan.objects.get(pk=self.other.pk).notes)
+
+    def test_bulk_validation(self):
+        """Missing changes, empty or oversized id lists are refused."""
+        self.assertEqual(self._post('bulk_update', {'ids': [self.scans[0].pk]}).status_code, 400)
+        self.assertEqual(self._post('bulk_delete', {'ids': []}).status_code, 400)
+        self.assertEqual(self._post('bulk_delete', {'ids': ['x']}).status_code, 400)
+        with override_settings(NUTRISCAN_BULK_MAX_IDS=2):
+            self.assertEqual(self._post('bulk_delete', {'ids': [1, 2, 3]}).status_code, 400)
+        self.assertEqual(NutritionScan.objects.count(), 4)
+
+    def test_bulk_delete_cleans_up_logs_and_files(self):
+        """Deleted scans leave the daily log and their files, except files another scan still uses."""
+        rebuild_daily_logs()
+        storage = self.scans[0].image.storage
+        shared = NutritionScan.objects.create(user=self.user, image=self.scans[1].image.name, calories=50)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post('bulk_delete', {'ids': [self.scans[0].pk, self.scans[1].pk, self.other.pk]})
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertTrue(NutritionScan.objects.filter(pk=self.other.pk).exists())
+        self.assertFalse(storage.exists(self.scans[0].image.name))
+        self.assertTrue(storage.exists(shared.image.name))
+
+        log = DailyNutritionLog.objects.get(user=self.user)
+        self.assertEqual((log.total_calories, log.total_protein, log.scan_count), (350, 10, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/scans/{self.scans[2].pk}/')
+        self.assertFalse(storage.exists(self.scans[2].image.name))
+
+    def test_bulk_actions_need_a_user(self):
+        """Anonymous callers can't change or delete anyone's scans, and other users' ids are left alone."""
+        anonymous = APIClient()
+        for action, body in (('bulk_update', {'ids': [self.other.pk], 'notes': 'mine now'}),
+                             ('bulk_delete', {'ids': [self.other.pk, self.scans[0].pk]})):
+            response = anonymous.post(f'/api/scans/{action}/', body, format='json')
+            self.assertIn(response.status_code, (401, 403))
+        self.assertEqual(NutritionScan.objects.count(), 4)
+        self.assertIsNone(NutritionScan.objects.get(pk=self.other.pk).notes)
+
+        self.assertEqual(self._post('bulk_delete', {'ids': [self.other.pk]}).json(), {'deleted': 0})
+        self.assertTrue(NutritionScan.objects.filter(pk=self.other.pk).exists())
+
+    def test_toggle_favourite_writes_only_its_field(self):
+        """toggle_favourite doesn't overwrite columns changed since the scan was loaded."""
+        scan = self.scans[0]
+        stale = NutritionScan.objects.get(pk=scan.pk)
+        NutritionScan.objects.filter(pk=scan.pk).update(notes='edited elsewhere')
+        with mock.patch('api.views.NutritionScanViewSet.get_object', return_value=stale):
+            self.client.post(f'/api/scans/{scan.pk}/toggle_favourite/')
+        scan.refresh_from_db()
+        self.assertEqual((scan.is_favourite, scan.notes), (True, 'edited elsewhere'))
+
+
+class IsolatedAnalysisTests(TempDirTestCase):
+    """Test analysis in killable worker processes."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(shutdown_isolated_pool)
+
+    def test_timeouts_and_crashes_replace_the_worker(self):
+        """A hung or dead worker is replaced; task exceptions are re-raised and keep the worker."""
+        pool = IsolatedPool(size=1, timeout=0.5)
+        self.addCleanup(pool.shutdown)
+        self.assertEqual(pool.run(pow, 2, 10), 1024)
+
+        start = time.monotonic()
+        with self.assertRaises(AnalysisAborted):
+            pool.run(time.sleep, 30)
+        self.assertLess(time.monotonic() - start, 5)
+        with self.assertRaises(AnalysisAborted):
+            pool.run(os._exit, 1)
+        with self.assertRaises(ZeroDivisionError):
+            pool.run(divmod, 1, 0)
+        self.assertEqual(pool.run(pow, 3, 2), 9)
+
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(
+            (counters['isolation.timeouts'], counters['isolation.crashes'], counters['isolation.workers_started']),
+            (1, 1, 3),
+        )
+        self.assertEqual(pool.state(), {'workers': 1, 'idle': 1, 'size': 1})
+
+    def test_spare_tasks_never_wait(self):
+        """Spare tasks get their own workers and are refused, not queued, once those are busy."""
+        pool = IsolatedPool(size=1, timeout=10, spare=1)
+        self.addCleanup(pool.shutdown)
+        busy = threading.Thread(target=pool.run, args=(time.sleep, 1), kwargs={'spare': True})
+        busy.start()
+        self.addCleanup(busy.join)
+        while pool.state()['workers'] < 1:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        with self.assertRaises(AnalysisOverloaded):
+            pool.run(pow, 2, 2, spare=True)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(pool.run(pow, 2, 3), 8)
+        busy.join()
+        self.assertEqual(pool.run(pow, 2, 4, spare=True), 16)
+        self.assertEqual(metrics.snapshot()['counters']['isolation.spare_exhausted'], 1)
+
+    def test_memory_limit(self):
+        """An allocation past the worker's memory limit fails instead of succeeding."""
+        if not os.path.exists('/proc/self/statm'):
+            raise unittest.SkipTest('Needs RLIMIT_AS and /proc')
+        pool = IsolatedPool(size=1, timeout=10, memory_limit_mb=64)
+        self.addCleanup(pool.shutdown)
+        with self.assertRaises(MemoryError):
+            pool.run(bytearray, 512 * 1024 * 1024)
+        self.assertEqual(pool.run(pow, 2, 2), 4)
+
+    def test_upload_analyzed_in_worker(self):
+        """Uploads are analyzed in the pool, with the worker's metrics merged; aborted ones leave nothing."""
+        with override_settings(NUTRISCAN_ANALYSIS_ISOLATION=True, NUTRISCAN_CASCADE=True):
+            response = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+            self.assertEqual(response.status_code, 201)
+            self.assertTrue(response.json()['food_item'])
+            counters = metrics.snapshot()['counters']
+            self.assertEqual(counters['isolation.workers_started'], 1)
+            self.assertEqual(counters.get('cascade.exit.coarse', 0) + counters.get('cascade.exit.full', 0), 1)
+
+            def stored_files():
+                return sorted(name for _, _, names in os.walk(self.media_root) for name in names)
+
+            stored = stored_files()
+            self.assertEqual(len(stored), 1)
+            with mock.patch.object(IsolatedPool, 'run', side_effect=AnalysisAborted('Image analysis did not finish')):
+                response = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+            self.assertEqual((response.status_code, response.json()['error']), (422, 'Image analysis did not finish'))
+            self.assertEqual(NutritionScan.objects.count(), 1)
+            self.assertEqual(stored_files(), stored)
+
+
+class MemoryProfileTests(TempDirTestCase):
+    """Test the opt-in tracemalloc profiling of uploads and analyses."""
+
+    def setUp(self):
+        super().setUp()
+        self.use_settings(NUTRISCAN_MEMORY_PROFILE=True)
+        metrics.reset()
+        clear_profiles()
+        self.addCleanup(clear_profiles)
+
+    def test_nested_spans(self):
+        """Peaks include nested spans' temporaries; retained memory and its sites are reported."""
+        with memory_span('outer') as outer:
+            kept = [0] * 100_000  # ~800 KB, still held at the end
+            with memory_span('inner') as inner:
+                bytearray(2 * 1024 * 1024)  # Freed at once
+        self.assertGreaterEqual(inner['peak_kb'], 2048)
+        self.assertLess(inner['retained_kb'], 100)
+        self.assertGreaterEqual(outer['peak_kb'], inner['peak_kb'])
+        self.assertGreaterEqual(outer['retained_kb'], 780)
+        self.assertEqual(outer['spans'], [inner])
+        self.assertTrue(outer['top_sites'][0]['site'].startswith('api/tests.py:'))
+        self.assertEqual(recent_profiles(), [outer])
+        del kept
+
+        # Another thread's request isn't profiled while this one is
+        entered, release = threading.Event(), threading.Event()
+
+        def hold():
+            with memory_span('held'):
+                entered.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        entered.wait(5)
+        with memory_span('concurrent') as skipped:
+            pass
+        release.set()
+        holder.join()
+        self.assertIsNone(skipped)
+        self.assertEqual(metrics.snapshot()['counters']['memory_profile.skipped'], 1)
+
+    def test_upload_profile_endpoint_is_admin_only(self):
+        """Uploads are profiled with their analysis spans; only staff can read the profiles."""
+        self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='member'))
+        self.assertEqual(client.get('/api/metrics/memory/').status_code, 403)
+        client.force_authenticate(User.objects.create_user(username='admin', is_staff=True))
+        body = client.get('/api/metrics/memory/').json()
+        self.assertEqual((body['enabled'], body['skipped'], len(body['profiles'])), (True, 0, 1))
+        upload = body['profiles'][0]
+        self.assertEqual(upload['label'], 'upload')
+        self.assertEqual([span['label'] for span in upload['spans']], ['analysis'])
+        self.assertEqual(upload['spans'][0]['spans'][0]['label'], 'detector.analyze_image')
+
+        with override_settings(NUTRISCAN_MEMORY_PROFILE=False):
+            self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+        self.assertEqual(len(client.get('/api/metrics/memory/').json()['profiles']), 1)
+
+    def test_command(self):
+        path = os.path.join(self.tmp_dir, 'meal.jpg')
+        Image.new('RGB', (800, 600), (200, 140, 60)).save(path)
+        out = io.StringIO()
+        call_command('profile_memory', path, '--repeat', '2', stdout=out)
+        output = out.getvalue()
+        self.assertIn('run 2', output)
+        self.assertIn('detector.analyze_image', output)
+        self.assertIn('Top allocation sites still held after run 2', output)
+
+
+class RequestProfilerTests(TempDirTestCase):
+    """Test per-request cProfile profiles and their summary command."""
+
+    def setUp(self):
+        super().setUp()
+        self.profile_dir = os.path.join(self.tmp_dir, 'profiles')
+        self.use_settings(
+            NUTRISCAN_PROFILE_DIR=self.profile_dir, NUTRISCAN_PROFILE_TOKEN='s3cret', NUTRISCAN_PROFILE_KEEP=3,
+        )
+
+    def _profiles(self):
+        return sorted(os.listdir(self.profile_dir)) if os.path.isdir(self.profile_dir) else []
+
+    def test_header_profiles_request(self):
+        """Only the right token profiles a request; files are tagged with endpoint and scan."""
+        scan = NutritionScan.objects.create(food_item='Idli', calories=120)
+
+        response = self.client.get(f'/api/scans/{scan.pk}/', HTTP_X_PROFILE='wrong')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(self._profiles(), [])
+
+        response = self.client.get(f'/api/scans/{scan.pk}/', HTTP_X_PROFILE='s3cret')
+        self.assertRegex(
+            response['X-Profile-File'], rf'^\d{{8}}T[\d.]+-nutrition-scan-detail-scan{scan.pk}-\d+ms\.prof$'
+        )
+        self.assertEqual(self._profiles(), [response['X-Profile-File']])
+
+        response = self.client.post(
+            '/api/scans/process_image/', {'image': UploadGuardTests._upload('idli.jpg')}, HTTP_X_PROFILE='s3cret'
+        )
+        self.assertIn(f"-nutrition-scan-process-image-scan{response.json()['id']}-", response['X-Profile-File'])
+
+    async def test_async_requests_profiled(self):
+        """Under ASGI the middleware runs as a coroutine and still profiles requested requests."""
+        async def get_response(request):
+            return HttpResponse('ok')
+
+        middleware = RequestProfilerMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/api/health/', HTTP_X_PROFILE='s3cret'))
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(self._profiles(), [response['X-Profile-File']])
+
+        response = await self.async_client.get('/api/health/', headers={'X-Profile': 's3cret'})
+        self.assertIn('-health-check-', response['X-Profile-File'])
+
+    def test_sampling_rotation_and_summary(self):
+        """Sampled profiles rotate to the newest KEEP files and are summarized together."""
+        with override_settings(NUTRISCAN_PROFILE_SAMPLE_RATE=1.0):
+            for _ in range(5):
+                response = self.client.get('/api/health/')
+                self.assertNotIn('X-Profile-File', response)  # Only requested profiles are named
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 3)
+        self.assertTrue(all('-health-check-' in name for name in profiles))
+
+        out = io.StringIO()
+        call_command('profile_summary', '--endpoint', 'health', '--sort', 'tottime', '--top', '5', stdout=out)
+        output = out.getvalue()
+        self.assertIn('3 profiles', output)
+        self.assertIn('health-check', output)
+        self.assertIn('Top functions by tottime', output)
+        with self.assertRaises(CommandError):
+            call_command('profile_summary', '--endpoint', 'daily-log', stdout=io.StringIO())
+
+
+class SharedCacheTests(TempDirTestCase):
+    """Test the shared cache tier: versioned namespaces, single-flight misses and the cached lookups."""
+
+    def setUp(self):
+        super().setUp()
+        self.use_settings(
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': os.path.join(self.tmp_dir, 'cache'),
+                },
+            },
+            NUTRISCAN_CACHE_LOCK_TIMEOUT=5,
+        )
+        metrics.reset()
+
+    def test_versioned_namespace(self):
+        """Values are kept until the namespace is bumped; uncacheable values are recomputed."""
+        namespace = CacheNamespace('test', 'NUTRISCAN_CATALOG_CACHE_TTL')
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(namespace.get_or_compute('k', compute), 1)
+        self.assertEqual(namespace.get_or_compute('k', compute), 1)
+        namespace.bump()
+        self.assertEqual(namespace.get_or_compute('k', compute), 2)
+        self.assertEqual(namespace.get_or_compute('odd', compute, cacheable=lambda value: value % 2), 3)
+        self.assertEqual(namespace.get_or_compute('even', compute, cacheable=lambda value: value % 2), 4)
+        self.assertEqual(namespace.get_or_compute('even', compute, cacheable=lambda value: value % 2), 5)
+
+        stats = cache_stats(metrics.snapshot())['test']
+        self.assertEqual((stats['hit'], stats['miss']), (1, 5))
+        self.assertEqual(stats['hit_rate'], round(1 / 6, 4))
+
+    def test_single_flight(self):
+        """Concurrent misses compute once; a key locked by another process is waited for, not recomputed."""
+        namespace = CacheNamespace('test', 'NUTRISCAN_CATALOG_CACHE_TTL')
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        threads = [
+            threading.Thread(target=lambda: results.append(namespace.get_or_compute('slow', compute)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 4)
+
+        # Another worker owns the lock and stores the value while we wait
+        cache, key = caches[CACHE_ALIAS], namespace._key('other')
+        cache.add(key + ':lock', 'elsewhere', 5)
+        timer = threading.Timer(0.2, lambda: cache.set(key, 'theirs'))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(namespace.get_or_compute('other', compute), 'theirs')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(metrics.snapshot()['counters']['cache.test.wait'], 1)
+
+    def test_cache_errors_fall_back_to_compute(self):
+        namespace = CacheNamespace('test', 'NUTRISCAN_CATALOG_CACHE_TTL')
+        with mock.patch.object(FileBasedCache, 'get', side_effect=OSError('cache down')), \
+                self.assertLogs('api.cache', 'WARNING'):
+            self.assertEqual(namespace.get_or_compute('k', lambda: 'computed'), 'computed')
+        self.assertEqual(metrics.snapshot()['counters']['cache.test.errors'], 1)
+
+    def test_catalog_lookups_cached_and_invalidated(self):
+        """Food lookups share one cached catalog, refreshed when a FoodItem changes."""
+        biryani = FoodItem.objects.get(name__iexact='biryani')
+        self.assertEqual(food_id_for(' Biryani '), biryani.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(food_id_for('BIRYANI'), biryani.pk)
+            self.assertIsNone(food_id_for('Dosa'))
+
+        dosa = FoodItem.objects.create(name='Dosa', calories=170)
+        self.assertEqual(food_id_for('dosa'), dosa.pk)
+        dosa.delete()
+        self.assertIsNone(food_id_for('dosa'))
+
+    def test_repeated_image_analyzed_once(self):
+        """The same image uploaded twice is analyzed once; other settings get their own entry."""
+        with mock.patch('api.ingest.analyze_stored_image', wraps=ingest.analyze_stored_image) as analyze:
+            first = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+            second = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload()})
+            self.assertEqual(analyze.call_count, 1)
+            with override_settings(NUTRISCAN_PLATE_GRID=4):
+                self.client.post(
+                    '/api/scans/process_image/', {'image': UploadGuardTests._upload(), 'analysis_mode': 'plate'}
+                )
+            self.assertEqual(analyze.call_count, 2)
+
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(first.json()['id'], second.json()['id'])
+        for field in ('food_item', 'calories', 'confidence', 'food'):
+            self.assertEqual(first.json()[field], second.json()[field])
+        self.client.force_login(User.objects.create_user(username='admin', is_staff=True))
+        stats = self.client.get('/api/metrics/').json()['cache']['analysis']
+        self.assertEqual((stats['hit'], stats['miss']), (1, 2))
+
+
+class RollingStatsTests(TempDirTestCase):
+    """Test the incrementally maintained stats windows against full recomputation."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='rolling')
+        self.today = now().date()
+        DailyNutritionLog.objects.bulk_create(
+            DailyNutritionLog(user=self.user, date=self.today - timedelta(days=days_ago),
+                              total_calories=100 * days_ago, total_protein=days_ago, scan_count=1)
+            for days_ago in (1, 3, 7, 8, 20, 30, 31, 60, 90, 91)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _expected(self, days, today=None):
+        """The stats response computed from all the window's logs."""
+        logs = DailyNutritionLog.objects.filter(user=self.user, date__gte=(today or self.today) - timedelta(days=days))
+        count = max(len(logs), 1)
+        return {
+            'period_days': days,
+            'total_scans': sum(log.scan_count for log in logs),
+            'avg_daily_calories': sum(log.total_calories for log in logs) / count,
+            'avg_daily_protein': sum(log.total_protein for log in logs) / count,
+            'avg_daily_carbs': sum(log.total_carbs for log in logs) / count,
+            'avg_daily_fat': sum(log.total_fat for log in logs) / count,
+        }
+
+    def _assert_stats(self, today=None):
+        for days in (7, 30, 90, 14):
+            response = self.client.get(f'/api/daily-logs/stats/?days={days}').json()
+            expected = self._expected(days, today)
+            self.assertEqual(response.keys(), expected.keys())
+            for key, value in expected.items():
+                self.assertAlmostEqual(response[key], value, places=6, msg=f'{days} days: {key}')
+        self.assertEqual(verify_rolling_stats()['mismatches'], [])
+
+    def test_follows_scan_changes(self):
+        """Uploads, edits, deletes, new logs and rebuilds keep every window exact."""
+        self._assert_stats()
+        self.assertEqual(RollingNutritionStats.objects.filter(user=self.user).count(), 3)
+
+        self.client.get('/api/daily-logs/today/')  # An empty log still counts as a day
+        self._assert_stats()
+        response = self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('biryani.jpg')})
+        self.client.post('/api/scans/process_image/', {'image': UploadGuardTests._upload('idli.jpg')})
+        self._assert_stats()
+
+        scan_id = response.json()['id']
+        self.client.patch(f'/api/scans/{scan_id}/', {'calories': 999, 'protein': 5})
+        self._assert_stats()
+        self.client.delete(f'/api/scans/{scan_id}/')
+        self._assert_stats()
+
+        # A scan from 20 days ago is in the 30 and 90 day windows only
+        old = NutritionScan.objects.create(user=self.user, calories=250)
+        NutritionScan.objects.filter(pk=old.pk).update(created_at=old.created_at - timedelta(days=20))
+        self.client.post('/api/daily-logs/rebuild/')
+        self._assert_stats()
+        self.client.delete(f'/api/scans/{old.pk}/')
+        self._assert_stats()
+
+    def test_days_leaving_the_window(self):
+        """Reads on later days subtract only the days that left the window."""
+        self._assert_stats()
+        for days_later in (1, 5, 40):
+            later = now() + timedelta(days=days_later)
+            with mock.patch('api.rolling_stats.now', return_value=later), \
+                    mock.patch('api.views.now', return_value=later):
+                self._assert_stats(today=later.date())
+
+    def test_interleaved_first_writes(self):
+        """A second first write landing while the first creates the rows is counted once, like the first."""
+        first, second = (NutritionScan.objects.create(user=self.user, calories=calories) for calories in (300, 500))
+        # Today's log exists, so both writes go straight to the rolling sums, which don't yet
+        DailyNutritionLog.objects.create(user=self.user, date=self.today)
+
+        def create_rows(user_id, today):
+            # The second upload runs from start to finish after the first one's UPDATE found no rows
+            if not creates:
+                creates.append(user_id)
+                NutritionScanViewSet._update_daily_log(self.user, second)
+            return _create_rows(user_id, today)
+
+        creates = []
+        with mock.patch('api.rolling_stats._create_rows', side_effect=create_rows):
+            NutritionScanViewSet._update_daily_log(self.user, first)
+
+        log = DailyNutritionLog.objects.get(user=self.user, date=self.today)
+        self.assertEqual((log.total_calories, log.scan_count), (800, 2))
+        self.assertEqual(RollingNutritionStats.objects.filter(user=self.user).count(), 3)
+        self._assert_stats()
+
+    def test_verify_command(self):
+        """Drift is reported (exit status 1) and fixed with --fix."""
+        self.client.get('/api/daily-logs/stats/')
+        RollingNutritionStats.objects.filter(user=self.user, window_days=30).update(total_calories=1, scan_count=99)
+
+        out = io.StringIO()
+        with self.assertRaises(SystemExit) as exit:
+            call_command('verify_rolling_stats', '--user', 'rolling', stdout=out)
+        self.assertEqual(exit.exception.code, 1)
+        self.assertIn('30 days: total_calories 1 != 6900, scan_count 99 != 6', out.getvalue())
+        self.assertIn('1 of 3 rolling stats rows differ', out.getvalue())
+
+        out = io.StringIO()
+        call_command('verify_rolling_stats', '--fix', stdout=out)
+        self.assertIn('Fixed 1 of 3', out.getvalue())
+        self._assert_stats()
+
+
+class ArchiveUploadTests(TempDirTestCase):
+    """Test streaming ZIP archive uploads (POST /api/scans/process_archive/)."""
+
+    URL = '/api/scans/process_archive/'
+
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), (100, 180, 80)).save(buffer, format='PNG')
+        self.png = buffer.getvalue()
+        self.user = User.objects.create_user(username='archiver')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def _zip(entries, method=None, streamed=False):
+        """ZIP bytes of [(name, data)]; `streamed` writes it as a non-seekable stream (data descriptors)."""
+        class Unseekable(io.RawIOBase):
+            def __init__(self):
+                self.parts = []
+
+            def writable(self):
+                return True
+
+            def write(self, data):
+                self.parts.append(bytes(data))
+                return len(data)
+
+        out = Unseekable() if streamed else io.BytesIO()
+        with zipfile.ZipFile(out, 'w', compression=method or zipfile.ZIP_DEFLATED) as archive:
+            for name, data in entries:
+                archive.writestr(name, data)
+        return b''.join(out.parts) if streamed else out.getvalue()
+
+    def _post(self, body, content_type='application/zip', **params):
+        response = self.client.generic('POST', self.URL, body, content_type=content_type, QUERY_STRING='&'.join(
+            f'{key}={value}' for key, value in params.items()
+        ))
+        if not response.streaming:
+            return response, None
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line) for line in lines]
+
+    def test_streams_one_line_per_image(self):
+        """Matched and analyzed images are logged; bad entries get their own line; metadata is skipped."""
+        for streamed in (False, True):
+            with self.subTest(streamed=streamed):
+                NutritionScan.objects.all().delete()
+                body = self._zip([
+                    ('meals/', b''),
+                    ('meals/salad.png', self.png),
+                    ('meals/IMG_0002.png', self.png),
+                    ('meals/notes.txt', b'not an image'),
+                    ('__MACOSX/meals/._salad.png', b'resource fork'),
+                ], streamed=streamed)
+                response, lines = self._post(body)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([(line.get('entry'), line.get('status')) for line in lines[:3]], [
+                    ('meals/salad.png', 201), ('meals/IMG_0002.png', 201), ('meals/notes.txt', 400),
+                ])
+                self.assertEqual(lines[0]['scan']['food_item'], 'Salad')  # Matched from the entry's name
+                self.assertTrue(lines[1]['scan']['food_item'])
+                self.assertEqual(lines[3], {'done': True, 'entries': 3, 'created': 2, 'failed': 1})
+                self.assertEqual(NutritionScan.objects.filter(user=self.user).count(), 2)
+
+        # Both archives were logged, each scan once
+        self.assertEqual(DailyNutritionLog.objects.get(user=self.user).scan_count, 4)
+
+    def test_size_and_entry_limits(self):
+        """An oversized image fails alone; exceeding the archive's limits ends it with an error summary."""
+        entries = [('big.png', self.png), ('salad.png', self.png)]
+        with override_settings(NUTRISCAN_MAX_UPLOAD_BYTES=len(self.png) - 1):
+            body = self._zip([('big.png', self.png), ('small.png', b'x' * 10)], method=zipfile.ZIP_STORED)
+            _, lines = self._post(body)
+        self.assertEqual((lines[0]['entry'], lines[0]['status']), ('big.png', 413))
+        self.assertEqual(lines[1]['status'], 400)  # Small enough, but not an image
+        self.assertNotIn('error', lines[-1])
+
+        with override_settings(NUTRISCAN_ARCHIVE_MAX_ENTRIES=1):
+            _, lines = self._post(self._zip(entries))
+        self.assertEqual([line.get('status') for line in lines], [201, 413])
+        self.assertEqual((lines[-1]['entries'], lines[-1]['created']), (1, 1))
+        self.assertIn('more than 1 entries', lines[-1]['error'])
+
+        with override_settings(NUTRISCAN_ARCHIVE_MAX_BYTES=100):
+            response, _ = self._post(self._zip(entries))
+        self.assertEqual(response.status_code, 413)
+
+    async def test_streams_under_asgi(self):
+        """Under ASGI the lines come from an async iterator instead of a list built in a thread."""
+        body = self._zip([('meals/biryani.jpg', self.png), ('meals/salad.png', self.png)])
+        response = await self.async_client.generic('POST', self.URL, body, content_type='application/zip')
+        self.assertTrue(response.is_async)
+        lines = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual([line.get('status') for line in lines], [201, 201, None])
+        self.assertEqual(lines[-1], {'done': True, 'entries': 2, 'created': 2, 'failed': 0})
+
+    def test_rejects_requests_that_are_not_archives(self):
+        response, _ = self._post(self._zip([('salad.png', self.png)]), content_type='image/png')
+        self.assertEqual(response.status_code, 415)
+
+        response, _ = self._post(b'')
+        self.assertEqual(response.status_code, 400)
+
+        _, lines = self._post(self.png)
+        self.assertEqual(lines, [{'done': True, 'entries': 0, 'created': 0, 'failed': 0, 'status': 400,
+                                  'error': 'Not a ZIP archive'}])
+        self.assertFalse(NutritionScan.objects.exists())
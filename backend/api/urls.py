@@ -1,12 +1,21 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NutritionScanViewSet, DailyNutritionLogViewSet, HealthCheckView
+from .async_views import process_image_async
+from .views import (
+    NutritionScanViewSet, DailyNutritionLogViewSet, UploadSessionViewSet, HealthCheckView, MetricsView,
+    MemoryProfileView,
+)
 
 router = DefaultRouter()
 router.register(r'scans', NutritionScanViewSet, basename='nutrition-scan')
 router.register(r'daily-logs', DailyNutritionLogViewSet, basename='daily-log')
+router.register(r'uploads', UploadSessionViewSet, basename='upload-session')
 
 urlpatterns = [
+    # Before the router, whose scans/<pk>/ route would otherwise match it
+    path('scans/process_image_async/', process_image_async, name='process-image-async'),
     path('', include(router.urls)),
     path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('metrics/memory/', MemoryProfileView.as_view(), name='memory-profile'),
 ]
@@ -1,19 +1,52 @@
-from rest_framework import viewsets, status, generics
+from rest_framework import viewsets, status, generics, permissions, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.http import StreamingHttpResponse
 from django.utils.timezone import now
+from asgiref.sync import sync_to_async
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from .models import NutritionScan, DailyNutritionLog
-from .serializers import NutritionScanSerializer, NutritionScanDetailSerializer, DailyNutritionLogSerializer
-from .services import NutritionAnalysisService
-from .local_food_detector import LocalFoodDetector
+from .models import NutritionScan, DailyNutritionLog, UploadSession
+from .serializers import (
+    NutritionScanSerializer, NutritionScanDetailSerializer, DailyNutritionLogSerializer, FastScanRowSerializer,
+    UploadSessionSerializer, ScanBulkSerializer, ScanBulkUpdateSerializer,
+)
+from .renderers import FastJSONRenderer
+from .metrics import metrics, cascade_exit_rates
+from .cache import cache_stats
+from .image_probe import ImageRejected, guard_upload
+from .ingest import (
+    resolve_basename, match_filename, analyze_image_cached, apply_result, food_id_for,
+    main_food_name, analyze_admitted, queue_feature_extraction,
+)
+from .admission import AnalysisOverloaded, get_admission
+from .isolation import AnalysisAborted
+from .executor import get_analysis_executor
+from .zip_stream import ArchiveError, iter_zip_entries
+from .memory_profile import memory_span, recent_profiles
+from .daily_logs import (
+    apply_scan_change, get_or_create_log, rebuild_daily_logs, record_scan_added, scan_values,
+)
+from .rolling_stats import window_stats
+from . import resumable
+import json
 import logging
-import tempfile
 import os
+import tempfile
 
 logger = logging.getLogger(__name__)
 
+ARCHIVE_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+
 
 class NutritionScanViewSet(viewsets.ModelViewSet):
     """
@@ -24,22 +57,61 @@ class NutritionScanViewSet(viewsets.ModelViewSet):
     GET /api/scans/{id}/ - Get scan details
     PUT /api/scans/{id}/ - Update scan
     DELETE /api/scans/{id}/ - Delete scan
+    GET /api/scans/top_foods/ - Most-logged foods
+    POST /api/scans/bulk_update/ - Set is_favourite/notes on many scans (JSON)
+    POST /api/scans/bulk_delete/ - Delete many scans (JSON)
     """
     queryset = NutritionScan.objects.all()
     serializer_class = NutritionScanSerializer
     parser_classes = (MultiPartParser, FormParser)
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return NutritionScanDetailSerializer
         return NutritionScanSerializer
     
+    def list(self, request, *args, **kwargs):
+        """List scans through the fast read path (same output as NutritionScanSerializer)."""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.values(*FastScanRowSerializer.fields))
+        if page is not None:
+            return self.get_paginated_response(self._fast_serializer().many(page))
+        return Response(self._fast_rows(queryset))
+    
+    def _fast_serializer(self):
+        return FastScanRowSerializer(context=self.get_serializer_context())
+    
+    def _fast_rows(self, queryset):
+        """Serialize a scan queryset from only the listed columns, without model instances."""
+        return self._fast_serializer().many(queryset.values(*FastScanRowSerializer.fields))
+    
     def get_queryset(self):
         queryset = NutritionScan.objects.all()
         if self.request.user.is_authenticated:
             queryset = queryset.filter(user=self.request.user)
         return queryset
     
+    def perform_update(self, serializer):
+        """Save an edited scan and move its nutrition difference into its daily log."""
+        before = scan_values(serializer.instance)
+        extra = {}
+        food_item = serializer.validated_data.get('food_item')
+        if food_item is not None and food_item != serializer.instance.food_item:
+            # A renamed scan is about a different food (or none in the catalog)
+            extra['food_id'] = food_id_for(food_item)
+        # One transaction without a savepoint, like Django's own deletion collector
+        with transaction.atomic(savepoint=False):
+            scan = serializer.save(**extra)
+            apply_scan_change(scan, before, scan_values(scan))
+    
+    def perform_destroy(self, instance):
+        """Delete a scan, take it out of its daily log and remove its image file."""
+        with transaction.atomic(savepoint=False):
+            apply_scan_change(instance, before=scan_values(instance))
+            instance.delete()
+            transaction.on_commit(lambda: delete_unused_images([instance.image.name]))
+    
     @action(detail=False, methods=['post'], parser_classes=(MultiPartParser, FormParser), url_path='process_image')
     def process_image(self, request):
         """
@@ -47,6 +119,8 @@ class NutritionScanViewSet(viewsets.ModelViewSet):
         
         Expected form data:
         - image: ImageField
+        - original_filename (optional): name used for filename matching
+        - analysis_mode (optional): 'plate' to split mixed plates into several items
         """
         try:
             image_file = request.FILES.get('image')
@@ -63,115 +137,68 @@ class NutritionScanViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Create scan record
-            scan = NutritionScan.objects.create(
-                image=image_file,
-                user=request.user if request.user.is_authenticated else None
+            return ingest_image(
+                request.user,
+                image_file,
+                request.POST.get('original_filename', '').strip(),
+                request.POST.get('analysis_mode', ''),
             )
-
-            # Try to extract food name from filename and match to demo nutrition.
-            # This allows uploads like "biryani.jpg", "my_rice_photo.jpg", "paneer_curry.jpg" etc.
-            # to return the corresponding demo nutrition without requiring exact demo filenames.
-            
-            # First, check if original filename was sent as form field (from updated frontend)
-            original_filename = request.POST.get('original_filename', '').strip()
-            if original_filename:
-                basename = original_filename
-                logger.info(f"Using original filename from form field: '{original_filename}'")
-            else:
-                # Fallback to Django's auto-renamed filename
-                basename = os.path.basename(scan.image.name)
-                logger.info(f"Using Django-saved filename: '{basename}'")
-            
-            filename_lower = basename.lower()
-            # Also replace underscores with spaces for better matching (e.g., "tandoori_chicken" -> "tandoori chicken")
-            filename_normalized = filename_lower.replace('_', ' ')
-            
-            # List of food names we recognize (from LocalFoodDetector.FOOD_DATABASE)
-            # Order by length (longest first) to prioritize "tandoori chicken" over "chicken"
-            known_foods = [
-                'tandoori chicken', 'biryani', 'samosa', 'sandwich',
-                'paneer', 'salad', 'pizza', 'pasta', 'naan', 'bread',
-                'sushi', 'apple', 'banana', 'burger', 'chicken',
-                'rice', 'idli', 'dal', 'egg', 'fish'
-            ]
-            
-            # Try to match any known food in the uploaded filename
-            matched_food = None
-            for food in known_foods:
-                if food == 'tandoori chicken':
-                    # For "tandoori chicken", check if both words appear OR just "tandoori"
-                    # This handles "tandoori_grilled.jpg", "chicken_tandoori.jpg", "tandoori_chicken.jpg"
-                    if 'tandoori' in filename_normalized and ('chicken' in filename_normalized or 'grilled' in filename_normalized):
-                        matched_food = 'tandoori chicken'
-                        break
-                elif food in filename_normalized:
-                    matched_food = food.lower()
-                    break  # Use first match (longest food names prioritized)
-            
-            detector_db = LocalFoodDetector().FOOD_DATABASE
-            result = None
-            
-            logger.info(f"Upload received - Original basename: '{basename}', Normalized: '{filename_normalized}'")
-            logger.info(f"Matched food: {matched_food}")
-            
-            # If a food name was detected in the filename, use demo nutrition
-            if matched_food and matched_food in detector_db:
-                data = detector_db[matched_food]
-                result = {
-                    'food_item': matched_food.title(),
-                    'calories': data.get('calories', 0),
-                    'protein': data.get('protein', 0),
-                    'carbs': data.get('carbs', 0),
-                    'fat': data.get('fat', 0),
-                    'portion_size': data.get('portion', '1 plate'),
-                    'confidence': 98.0  # High confidence for filename-matched foods
-                }
-                logger.info(f"[SUCCESS] Matched food '{matched_food}' from filename: {basename}")
-            else:
-                # No food name in filename; use the detector to analyze the actual image
-                logger.warning(f"[FALLBACK] No food matched in filename, using image analysis")
-                analysis_service = NutritionAnalysisService()
-                try:
-                    result = analysis_service.analyze_image(scan.image.path)
-                except Exception as analyze_error:
-                    logger.warning(f"Could not analyze image at path: {str(analyze_error)}, using mock analysis")
-                    result = analysis_service.get_mock_analysis()
-            
-            # Update scan with results
-            scan.food_item = result.get('food_item', 'Unknown Food')
-            scan.calories = result.get('calories', 0)
-            scan.protein = result.get('protein', 0)
-            scan.carbs = result.get('carbs', 0)
-            scan.fat = result.get('fat', 0)
-            scan.portion_size = result.get('portion_size', '1 plate')
-            scan.confidence = result.get('confidence', 0)
-            scan.save()
-            
-            # Update daily log if user is authenticated
-            if request.user.is_authenticated:
-                self._update_daily_log(request.user, scan)
-            
-            serializer = NutritionScanDetailSerializer(scan)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
             
         except Exception as e:
-            logger.error(f"Error processing image: {str(e)}")
+            logger.exception('Error processing image: %s', e)
             return Response(
                 {'error': f'Failed to process image: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['post'], parser_classes=(), url_path='process_archive')
+    def process_archive(self, request):
+        """
+        Log every image in a ZIP archive, sent as the raw request body
+        (Content-Type: application/zip). Responds with NDJSON while the archive
+        is still being read: one line per image, in archive order, with its
+        scan or error, then a summary line. See ingest_archive.
+
+        Only WSGI servers pass the body on as it arrives; Django's ASGI handler
+        reads all of it first, so there the lines come once it's uploaded.
+
+        Query params:
+        - analysis_mode (optional): 'plate' to split mixed plates into several items
+        """
+        content_type = request.content_type.split(';')[0].strip().lower()
+        if content_type not in ARCHIVE_CONTENT_TYPES:
+            return Response(
+                {'error': 'Request body must be a ZIP archive (Content-Type: application/zip)'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if not length:
+            return Response({'error': 'No archive provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.NUTRISCAN_ARCHIVE_MAX_BYTES:
+            return Response(
+                {'error': f'Archive exceeds {settings.NUTRISCAN_ARCHIVE_MAX_BYTES} bytes'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        lines = ingest_archive(request.user, request.stream, request.query_params.get('analysis_mode', ''))
+        if isinstance(request._request, ASGIRequest):
+            # Under ASGI a sync iterator would be read to the end before anything is sent
+            lines = iterate_in_thread(lines)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
     @action(detail=False, methods=['get'])
     def demo_data(self, request):
         """Get all 10 demo food images with nutrition data for manager presentation."""
         try:
             # Get all scans (demo images)
             scans = NutritionScan.objects.all().order_by('-created_at')[:10]
-            serializer = self.get_serializer(scans, many=True)
+            rows = self._fast_rows(scans)
             return Response({
-                'count': scans.count(),
-                'demo_images': serializer.data,
+                'count': len(rows),
+                'demo_images': rows,
                 'message': '10 pre-classified food images with complete nutrition data'
             })
         except Exception as e:
@@ -192,8 +219,7 @@ class NutritionScanViewSet(viewsets.ModelViewSet):
             else:
                 scans = NutritionScan.objects.none()
             
-            serializer = self.get_serializer(scans, many=True)
-            return Response(serializer.data)
+            return Response(self._fast_rows(scans))
         except Exception as e:
             logger.error(f"Error fetching history: {str(e)}")
             return Response(
@@ -201,32 +227,408 @@ class NutritionScanViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['get'])
+    def top_foods(self, request):
+        """
+        Most-logged foods: scans per catalog food, most first.
+        Query params: days (default 30), limit (default 10).
+        """
+        try:
+            days = int(request.query_params.get('days', 30))
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            return Response({'error': 'days and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Grouped on the scan's food_id (user, food, created_at index), joined only for the name
+        rows = (
+            self.get_queryset()
+            .filter(food__isnull=False, created_at__gte=now() - timedelta(days=days))
+            .order_by()
+            .values('food_id', 'food__name')
+            .annotate(scan_count=Count('id'), total_calories=Sum('calories'), last_logged=Max('created_at'))
+            .order_by('-scan_count', 'food__name')[:limit]
+        )
+        # Formatted like the serializers' timestamps, whichever renderer runs
+        timestamp = serializers.DateTimeField()
+        return Response([
+            {
+                'food_id': row['food_id'],
+                'name': row['food__name'],
+                'scan_count': row['scan_count'],
+                'total_calories': round(row['total_calories'], 1),
+                'last_logged': timestamp.to_representation(row['last_logged']),
+            }
+            for row in rows
+        ])
+    
     @action(detail=True, methods=['post'])
     def toggle_favourite(self, request, pk=None):
         """Toggle favourite status of a scan."""
         try:
             scan = self.get_object()
             scan.is_favourite = not scan.is_favourite
-            scan.save()
+            scan.save(update_fields=['is_favourite', 'updated_at'])
             serializer = self.get_serializer(scan)
             return Response(serializer.data)
         except NutritionScan.DoesNotExist:
             return Response({'error': 'Scan not found'}, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=False, methods=['post'], parser_classes=(JSONParser,),
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_update(self, request):
+        """
+        Set is_favourite and/or notes on the listed scans with one UPDATE.
+        Body: {"ids": [1, 2], "is_favourite": true, "notes": "..."}; ids that
+        aren't the user's are ignored.
+        """
+        serializer = ScanBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = dict(serializer.validated_data)
+        ids = changes.pop('ids')
+        # Neither field feeds the daily log totals, so no log changes
+        updated = self.get_queryset().filter(pk__in=ids).update(updated_at=now(), **changes)
+        return Response({'updated': updated})
+    
+    @action(detail=False, methods=['post'], parser_classes=(JSONParser,),
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_delete(self, request):
+        """
+        Delete the listed scans: {"ids": [1, 2]}. Their daily logs are
+        recomputed and their image files removed once the delete commits;
+        ids that aren't the user's are ignored.
+        """
+        serializer = ScanBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        scans = self.get_queryset().filter(pk__in=serializer.validated_data['ids'])
+        rows = list(scans.values_list('pk', 'user_id', 'created_at', 'image'))
+        if not rows:
+            return Response({'deleted': 0})
+        
+        with transaction.atomic(savepoint=False):
+            NutritionScan.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).delete()
+            user_ids = {user_id for _, user_id, _, _ in rows if user_id is not None}
+            if user_ids:
+                # One grouped recompute for every affected day rather than an UPDATE per scan
+                days = [created_at.date() for _, user_id, created_at, _ in rows if user_id is not None]
+                rebuild_daily_logs(user_ids=user_ids, start=min(days), end=max(days))
+            images = [image for _, _, _, image in rows]
+            transaction.on_commit(lambda: delete_unused_images(images))
+        return Response({'deleted': len(rows)})
+    
     @staticmethod
     def _update_daily_log(user, scan):
         """Update or create daily nutrition log."""
         today = now().date()
-        log, created = DailyNutritionLog.objects.get_or_create(
-            user=user,
-            date=today
+        # The rolling sums change in the log's transaction, first (see api/rolling_stats.py)
+        with transaction.atomic(savepoint=False):
+            log, _ = get_or_create_log(user, today)
+            record_scan_added(scan, today)
+            # F() so a concurrent upload's addition isn't overwritten
+            DailyNutritionLog.objects.filter(pk=log.pk).update(
+                total_calories=F('total_calories') + scan.calories,
+                total_protein=F('total_protein') + scan.protein,
+                total_carbs=F('total_carbs') + scan.carbs,
+                total_fat=F('total_fat') + scan.fat,
+                scan_count=F('scan_count') + 1,
+                updated_at=now(),
+            )
+
+
+def delete_unused_images(names):
+    """Delete stored image files that no remaining scan points at."""
+    names = {name for name in names if name}
+    if not names:
+        return
+    # Demo and seeded scans can share one file
+    names -= set(NutritionScan.objects.filter(image__in=names).values_list('image', flat=True))
+    storage = NutritionScan._meta.get_field('image').storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete image %s', name, exc_info=True)
+
+
+@memory_span('upload')
+def ingest_image(user, image_file, original_filename='', analysis_mode=''):
+    """
+    Store, analyze and log one uploaded image; the shared core of process_image
+    and finalized resumable uploads. Returns the Response to send.
+    """
+    # Check the header against the size budgets before storing or decoding anything
+    try:
+        image_file = guard_upload(image_file)
+    except ImageRejected as e:
+        return Response({'error': str(e)}, status=e.status_code)
+
+    user = user if user is not None and user.is_authenticated else None
+    basename = resolve_basename(original_filename, image_file.name)
+    degraded = False
+
+    result = match_filename(basename)
+    analyzed = result is None
+    if result is not None:
+        # Create scan record
+        scan = NutritionScan.objects.create(image=image_file, user=user)
+    else:
+        scan = None
+        try:
+            # Image analysis needs a detector slot; claim it before storing anything
+            try:
+                with get_admission().slot():
+                    scan = NutritionScan.objects.create(image=image_file, user=user)
+                    result = analyze_image_cached(scan.image.path, analysis_mode)
+            except AnalysisOverloaded as e:
+                if not settings.NUTRISCAN_OVERLOAD_DEGRADE:
+                    return Response(
+                        {'error': str(e)},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={'Retry-After': str(e.retry_after)}
+                    )
+                # Shed load with the cheap coarse stage instead of queueing
+                metrics.incr('admission.degraded')
+                degraded = True
+                scan = NutritionScan.objects.create(image=image_file, user=user)
+                result = analyze_image_cached(scan.image.path, 'coarse', degraded=True)
+        except (AnalysisOverloaded, AnalysisAborted) as e:
+            # The image hung or crashed its analysis worker, or no spare worker
+            # could take the degraded analysis; don't keep it
+            scan.image.delete(save=False)
+            scan.delete()
+            if isinstance(e, AnalysisAborted):
+                return Response({'error': str(e)}, status=e.status_code)
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+
+    _finish_scan(user, scan, result, analyzed=analyzed and not degraded)
+
+    serializer = NutritionScanDetailSerializer(scan)
+    headers = {'X-Analysis-Degraded': 'coarse'} if degraded else None
+    return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+def _finish_scan(user, scan, result, analyzed=False):
+    """
+    Save an analysis result on its new scan and add the scan to the user's
+    daily log. An `analyzed` image (not filename-matched or degraded) gets its
+    features extracted once the request is done.
+    """
+    apply_result(scan, result)
+    scan.food_id = food_id_for(main_food_name(result))
+    scan.save()
+    if analyzed:
+        queue_feature_extraction(scan)
+
+    # Update daily log if user is authenticated
+    if user is not None:
+        NutritionScanViewSet._update_daily_log(user, scan)
+
+
+async def iterate_in_thread(lines):
+    """Async iterator over a sync generator, each step run where sync views run."""
+    step = sync_to_async(next)
+    try:
+        while (line := await step(lines, None)) is not None:
+            yield line
+    finally:
+        await sync_to_async(lines.close)()
+
+
+def ingest_archive(user, stream, analysis_mode=''):
+    """
+    Yield one NDJSON line per image in the ZIP archive read from `stream`,
+    then a summary line; the core of process_archive.
+
+    Entries are read as their bytes arrive (api/zip_stream.py). Each is
+    guarded and filename-matched like process_image; otherwise it is stored
+    and its analysis handed to the analysis executor, and reading goes on
+    while it runs. Lines come in archive order, each as soon as its entry
+    and the ones before it are done. At most NUTRISCAN_ANALYSIS_WORKERS
+    analyses are in flight, which also bounds the memory held.
+    """
+    user = user if user is not None and user.is_authenticated else None
+    executor = get_analysis_executor()
+    # (entry name, scan, future of (result, degraded), analyzed), or (name, None, future of its line, False)
+    pending = deque()
+    counts = {'entries': 0, 'created': 0, 'failed': 0}
+
+    def line(data):
+        if 'entry' in data:
+            counts['entries'] += 1
+            counts['created' if data['status'] == status.HTTP_201_CREATED else 'failed'] += 1
+        return json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+    def done(data):
+        future = Future()
+        future.set_result(data)
+        return future
+
+    def finish(name, scan, future, analyzed):
+        if scan is None:
+            return future.result()
+        try:
+            result, degraded = future.result()
+        except (AnalysisOverloaded, AnalysisAborted) as e:
+            scan.image.delete(save=False)
+            scan.delete()
+            code = e.status_code if isinstance(e, AnalysisAborted) else status.HTTP_429_TOO_MANY_REQUESTS
+            return {'entry': name, 'status': code, 'error': str(e)}
+        except Exception as e:
+            logger.exception('Error processing archive entry %s: %s', name, e)
+            scan.image.delete(save=False)
+            scan.delete()
+            return {'entry': name, 'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    'error': f'Failed to process image: {str(e)}'}
+        _finish_scan(user, scan, result, analyzed=analyzed and not degraded)
+        data = {'entry': name, 'status': status.HTTP_201_CREATED, 'scan': NutritionScanDetailSerializer(scan).data}
+        if degraded:
+            data['degraded'] = 'coarse'
+        return data
+
+    error = None
+    entries = iter_zip_entries(
+        stream,
+        max_archive_bytes=settings.NUTRISCAN_ARCHIVE_MAX_BYTES,
+        max_entry_bytes=settings.NUTRISCAN_MAX_UPLOAD_BYTES,
+        max_total_bytes=settings.NUTRISCAN_ARCHIVE_MAX_TOTAL_BYTES,
+        max_entries=settings.NUTRISCAN_ARCHIVE_MAX_ENTRIES,
+    )
+    try:
+        try:
+            for entry in entries:
+                basename = os.path.basename(entry.name)
+                try:
+                    if entry.error:
+                        raise ImageRejected(entry.error, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+                    image_file = guard_upload(ContentFile(entry.data, name=basename))
+                except ImageRejected as e:
+                    pending.append((entry.name, None, done(
+                        {'entry': entry.name, 'status': e.status_code, 'error': str(e)}
+                    ), False))
+                else:
+                    scan = NutritionScan.objects.create(image=image_file, user=user)
+                    result = match_filename(basename)
+                    if result is not None:
+                        future = done((result, False))
+                    else:
+                        future = executor.submit(analyze_admitted, scan.image.path, analysis_mode)
+                    pending.append((entry.name, scan, future, result is None))
+
+                while pending and (pending[0][2].done() or len(pending) > settings.NUTRISCAN_ANALYSIS_WORKERS):
+                    yield line(finish(*pending.popleft()))
+        except ArchiveError as e:
+            error = e
+        while pending:
+            yield line(finish(*pending.popleft()))
+    finally:
+        # The client went away: still record the analyses already running
+        while pending:
+            finish(*pending.popleft())
+
+    summary = dict(counts, done=True)
+    if error is not None:
+        summary.update(status=error.status_code, error=str(error))
+    yield line(summary)
+
+
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Resumable image uploads (protocol in api/resumable.py).
+    
+    POST /api/uploads/ - Start an upload: {filename, size, content_type, original_filename, analysis_mode}
+    GET /api/uploads/{id}/ - Bytes received so far (offset)
+    PUT /api/uploads/{id}/ - Send bytes with a Content-Range header
+    POST /api/uploads/{id}/finalize/ - Analyze the completed image; returns the scan
+    DELETE /api/uploads/{id}/ - Abandon the upload
+    """
+    serializer_class = UploadSessionSerializer
+    
+    def get_queryset(self):
+        # Anonymous sessions are only reachable through their unguessable id
+        if self.request.user.is_authenticated:
+            return UploadSession.objects.filter(user=self.request.user)
+        return UploadSession.objects.filter(user__isnull=True)
+    
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['size'] > settings.NUTRISCAN_MAX_UPLOAD_BYTES:
+            return Response(
+                {'error': f'Image exceeds {settings.NUTRISCAN_MAX_UPLOAD_BYTES} bytes'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        resumable.purge_expired()
+        user = request.user if request.user.is_authenticated else None
+        session = serializer.save(user=user)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None):
+        session = self.get_object()
+        return Response(self.get_serializer(session).data, headers={'Upload-Offset': str(session.offset)})
+    
+    def update(self, request, pk=None):
+        """Write the request body (raw bytes) at the range given by Content-Range."""
+        session = self.get_object()
+        if session.scan_id is not None:
+            return Response({'error': 'Upload is already finalized'}, status=status.HTTP_409_CONFLICT)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            start = resumable.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), session.size, length)
+            offset = resumable.write_chunk(session, start, request.stream, length)
+        except resumable.ChunkRejected as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        except resumable.OffsetMismatch as e:
+            return Response(
+                {'error': str(e), 'offset': e.offset},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Upload-Offset': str(e.offset)}
+            )
+        return Response(
+            {'offset': offset, 'size': session.size, 'complete': offset == session.size},
+            headers={'Upload-Offset': str(offset)}
         )
-        log.total_calories += scan.calories
-        log.total_protein += scan.protein
-        log.total_carbs += scan.carbs
-        log.total_fat += scan.fat
-        log.scan_count += 1
-        log.save()
+    
+    def destroy(self, request, pk=None):
+        session = self.get_object()
+        resumable.discard(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Run the completed upload through the process_image pipeline. Repeat calls return the same scan."""
+        session = self.get_object()
+        if session.scan_id is not None:
+            return Response(NutritionScanDetailSerializer(session.scan).data)
+        if session.offset < session.size:
+            return Response(
+                {'error': f'Upload is incomplete: {session.offset} of {session.size} bytes received',
+                 'offset': session.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            with resumable.completed_file(session) as image_file:
+                response = ingest_image(request.user, image_file, session.original_filename, session.analysis_mode)
+        except Exception as e:
+            logger.exception('Error processing image: %s', e)
+            return Response(
+                {'error': f'Failed to process image: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        if response.status_code == status.HTTP_201_CREATED:
+            resumable.discard(session)
+            session.scan_id = response.data['id']
+            session.save(update_fields=['scan', 'updated_at'])
+        elif response.status_code != status.HTTP_429_TOO_MANY_REQUESTS:
+            # Not an acceptable image; nothing to retry (an overloaded server can be retried)
+            resumable.discard(session)
+            session.delete()
+        return response
 
 
 class DailyNutritionLogViewSet(viewsets.ReadOnlyModelViewSet):
@@ -235,6 +637,7 @@ class DailyNutritionLogViewSet(viewsets.ReadOnlyModelViewSet):
     
     GET /api/daily-logs/ - List all daily logs for current user
     GET /api/daily-logs/{id}/ - Get specific daily log
+    POST /api/daily-logs/rebuild/ - Recompute the user's daily logs from their scans
     """
     queryset = DailyNutritionLog.objects.all()
     serializer_class = DailyNutritionLogSerializer
@@ -252,16 +655,29 @@ class DailyNutritionLogViewSet(viewsets.ReadOnlyModelViewSet):
         
         try:
             today = now().date()
-            log, created = DailyNutritionLog.objects.get_or_create(
-                user=request.user,
-                date=today
-            )
+            log, _ = get_or_create_log(request.user, today)
             serializer = self.get_serializer(log)
             return Response(serializer.data)
         except Exception as e:
             logger.error(f"Error fetching today's log: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['post'])
+    def rebuild(self, request):
+        """
+        Recompute the current user's daily logs from their scans.
+        Optional ?days=N limits it to the last N days.
+        """
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        try:
+            days = request.query_params.get('days')
+            start = now().date() - timedelta(days=int(days)) if days else None
+        except ValueError:
+            return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(rebuild_daily_logs(user_ids=[request.user.pk], start=start))
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get nutrition statistics for the last 30 days."""
@@ -270,20 +686,17 @@ class DailyNutritionLogViewSet(viewsets.ReadOnlyModelViewSet):
         
         try:
             days = int(request.query_params.get('days', 30))
-            start_date = now().date() - timedelta(days=days)
-            
-            logs = DailyNutritionLog.objects.filter(
-                user=request.user,
-                date__gte=start_date
-            )
+            # O(1) for the standard windows (api/rolling_stats.py)
+            sums = window_stats(request.user.pk, days)
+            log_days = max(sums['log_days'], 1)
             
             stats = {
                 'period_days': days,
-                'total_scans': sum(log.scan_count for log in logs),
-                'avg_daily_calories': sum(log.total_calories for log in logs) / max(len(logs), 1),
-                'avg_daily_protein': sum(log.total_protein for log in logs) / max(len(logs), 1),
-                'avg_daily_carbs': sum(log.total_carbs for log in logs) / max(len(logs), 1),
-                'avg_daily_fat': sum(log.total_fat for log in logs) / max(len(logs), 1),
+                'total_scans': sums['scan_count'],
+                'avg_daily_calories': sums['total_calories'] / log_days,
+                'avg_daily_protein': sums['total_protein'] / log_days,
+                'avg_daily_carbs': sums['total_carbs'] / log_days,
+                'avg_daily_fat': sums['total_fat'] / log_days,
             }
             
             return Response(stats)
@@ -301,3 +714,33 @@ class HealthCheckView(generics.GenericAPIView):
             'message': 'NutriScan API is running',
             'timestamp': now().isoformat()
         })
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    In-process analysis metrics for this worker (counters, timings, cascade exit
+    rates, cache hit rates, admission and pool state). Admins only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        snapshot = metrics.snapshot()
+        snapshot['cascade_exit_rates'] = cascade_exit_rates(snapshot)
+        snapshot['admission'] = get_admission().state()
+        snapshot['cache'] = cache_stats(snapshot)
+        if settings.NUTRISCAN_ANALYSIS_ISOLATION:
+            from .isolation import get_isolated_pool
+            snapshot['isolation'] = get_isolated_pool().state()
+        return Response(snapshot)
+
+
+class MemoryProfileView(generics.GenericAPIView):
+    """Latest memory profiles of uploads and analyses (NUTRISCAN_MEMORY_PROFILE), newest first. Admins only."""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response({
+            'enabled': settings.NUTRISCAN_MEMORY_PROFILE,
+            'skipped': metrics.snapshot()['counters'].get('memory_profile.skipped', 0),
+            'profiles': recent_profiles(),
+        })
@@ -0,0 +1,80 @@
+"""
+Pre-fork warm-up for production workers.
+
+With NUTRISCAN_WARMUP enabled, ApiConfig.ready() calls warm_up() while the
+app is being preloaded in the server's master process (see gunicorn.conf.py).
+Everything it builds (URL resolver, view modules, nutrition catalog, PIL
+plugins, the colour LUT mapping) is then inherited by every forked worker
+instead of being built on each worker's first request.
+
+Nothing here opens a database connection, starts a thread or creates a pool:
+none of those survive a fork.
+"""
+import io
+import logging
+import time
+
+from django.conf import settings
+
+from .log_pipeline import kv
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up() -> dict:
+    """Build the per-process structures a first request would need. Returns ms per step."""
+    timings = {}
+
+    def step(name, fn):
+        start = time.perf_counter()
+        fn()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    step('urls', _warm_urls)
+    step('catalog', _warm_catalog)
+    step('image_stack', _warm_image_stack)
+    step('synthetic_analysis', _run_synthetic_analysis)
+    logger.info('startup.warm_up', extra=kv(**timings))
+    return timings
+
+
+def _warm_urls():
+    """Import every view module and build the resolver's lookup tables."""
+    from django.urls import get_resolver, reverse
+
+    get_resolver().url_patterns
+    reverse('health-check')
+
+
+def _warm_catalog():
+    """Nutrition tables and the filename matcher, plus the memory-mapped LUT in 'lut' mode."""
+    from .color_lut import load_lut
+    from .ingest import match_filename
+
+    match_filename('warmup_biryani.jpg')
+    if settings.NUTRISCAN_DETECTOR_MODE == 'lut':
+        load_lut(settings.NUTRISCAN_COLOR_LUT_PATH)
+
+
+def _warm_image_stack():
+    """Import PIL and register all its format plugins (normally done on the first open)."""
+    from PIL import Image
+
+    Image.init()
+
+
+def _run_synthetic_analysis():
+    """Run each configured analysis path once on a generated image."""
+    from PIL import Image
+
+    from .services import NutritionAnalysisService
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (256, 192), (200, 150, 60)).save(buffer, format='JPEG')
+
+    service = NutritionAnalysisService()
+    for analyze in (service.analyze_image, service.analyze_image_coarse, service.analyze_plate):
+        analyze(io.BytesIO(buffer.getvalue()))
+    # Workers shouldn't inherit counters from the synthetic run
+    metrics.reset()
@@ -0,0 +1,193 @@
+"""
+Reading a ZIP archive front to back from a non-seekable stream.
+
+zipfile needs to seek to the central directory at the end of the archive, so
+the whole upload would have to be stored first. Every entry is also preceded
+by a local header, though, and reading those in order yields each entry as
+soon as its bytes have arrived, with nothing written to disk. Stored and
+deflated entries are supported, including deflated entries whose sizes
+follow their data (a data descriptor, as streaming zip writers produce).
+Encrypted, ZIP64 and other compression methods are refused.
+
+Limits are enforced while reading, before anything is buffered past them:
+the archive's compressed size, each entry's and all entries' uncompressed
+size, and the number of entries.
+"""
+import struct
+import zlib
+from collections import namedtuple
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_SIGNATURE = 0x04034b50
+# Records after the last entry; nothing past them is read
+END_SIGNATURES = {0x02014b50, 0x06054b50, 0x06064b50}
+DESCRIPTOR_SIGNATURE = 0x08074b50
+
+FLAG_ENCRYPTED = 0x1
+FLAG_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+STORED, DEFLATED = 0, 8
+ZIP64_EXTRA = 0x0001
+CHUNK = 64 * 1024
+
+ZipEntry = namedtuple('ZipEntry', ['name', 'data', 'error'])
+
+
+class ArchiveError(Exception):
+    """The archive can't be read any further; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Reader:
+    """Buffered reads from `stream` that can give bytes back, and stop at `limit` bytes in total."""
+
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.consumed = 0
+        self._buffer = b''
+
+    def read(self, size: int) -> bytes:
+        """Up to `size` bytes; b'' at the end of the stream."""
+        if not self._buffer:
+            self._buffer = self.stream.read(CHUNK)
+            self.consumed += len(self._buffer)
+            if self.consumed > self.limit:
+                raise ArchiveError(f'Archive exceeds {self.limit} bytes', status_code=413)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        parts = []
+        while size:
+            data = self.read(size)
+            if not data:
+                raise ArchiveError('Archive is truncated')
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def skip(self, size: int) -> None:
+        while size:
+            data = self.read(min(size, CHUNK))
+            if not data:
+                raise ArchiveError('Archive is truncated')
+            size -= len(data)
+
+    def unread(self, data: bytes) -> None:
+        self._buffer = data + self._buffer
+
+
+def iter_zip_entries(stream, max_archive_bytes: int, max_entry_bytes: int, max_total_bytes: int,
+                     max_entries: int):
+    """
+    Yield a ZipEntry(name, data, error) per file in the archive as it is read.
+    An entry whose header already shows it is too large is skipped without
+    decompressing it and yielded with data None and an `error`. Directories
+    and macOS metadata (__MACOSX/, ._ files) are skipped silently.
+
+    Raises ArchiveError when the archive is malformed, unsupported or over a
+    limit that can only be detected by decompressing; entries yielded before
+    that are complete and verified.
+    """
+    reader = _Reader(stream, max_archive_bytes)
+    entries = total = 0
+    while True:
+        signature = reader.read(4)
+        if not signature:
+            raise ArchiveError('Archive is truncated' if entries else 'Archive is empty')
+        signature += reader.read_exact(4 - len(signature))
+        (signature_value,) = struct.unpack('<I', signature)
+        if signature_value in END_SIGNATURES:
+            return
+        if signature_value != LOCAL_SIGNATURE:
+            raise ArchiveError('Not a ZIP archive' if not entries else 'Archive is corrupt')
+
+        (_, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length) = \
+            LOCAL_HEADER.unpack(signature + reader.read_exact(LOCAL_HEADER.size - 4))
+        raw_name = reader.read_exact(name_length)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437', errors='replace')
+        if _has_zip64(reader.read_exact(extra_length)):
+            raise ArchiveError('ZIP64 archives are not supported')
+        if flags & FLAG_ENCRYPTED:
+            raise ArchiveError(f'{name}: encrypted entries are not supported')
+        if method not in (STORED, DEFLATED):
+            raise ArchiveError(f'{name}: compression method {method} is not supported')
+        has_descriptor = bool(flags & FLAG_DESCRIPTOR)
+        if has_descriptor and method == STORED:
+            raise ArchiveError(f'{name}: stored entries without sizes are not supported')
+
+        entries += 1
+        if entries > max_entries:
+            raise ArchiveError(f'Archive has more than {max_entries} entries', status_code=413)
+        skipped = name.endswith('/') or name.startswith('__MACOSX/') or name.rsplit('/', 1)[-1].startswith('._')
+        if not has_descriptor and (skipped or size > max_entry_bytes):
+            reader.skip(compressed_size)
+            if not skipped:
+                yield ZipEntry(name, None, f'Image exceeds {max_entry_bytes} bytes')
+            continue
+
+        if method == STORED:
+            data = reader.read_exact(compressed_size)
+        else:
+            data = _inflate(reader, name, None if has_descriptor else compressed_size, max_entry_bytes)
+        if has_descriptor:
+            crc, _, size = _read_descriptor(reader)
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise ArchiveError(f'{name}: data is corrupt')
+        if skipped:
+            continue
+        total += len(data)
+        if total > max_total_bytes:
+            raise ArchiveError(f'Archive content exceeds {max_total_bytes} bytes', status_code=413)
+        yield ZipEntry(name, data, None)
+
+
+def _inflate(reader: _Reader, name: str, compressed_size, max_size: int) -> bytes:
+    """Decompress one deflated entry, reading no further than its end (`compressed_size` if known)."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    parts, size = [], 0
+    remaining = compressed_size
+    while not decompressor.eof:
+        chunk = reader.read(CHUNK if remaining is None else min(CHUNK, remaining))
+        if not chunk:
+            raise ArchiveError('Archive is truncated')
+        if remaining is not None:
+            remaining -= len(chunk)
+        try:
+            # Never inflate more than one byte past the limit (decompression bombs)
+            data = decompressor.decompress(chunk, max_size + 1 - size)
+            while decompressor.unconsumed_tail and size + len(data) <= max_size:
+                data += decompressor.decompress(decompressor.unconsumed_tail, max_size + 1 - size - len(data))
+        except zlib.error:
+            raise ArchiveError(f'{name}: data is corrupt')
+        size += len(data)
+        if size > max_size:
+            raise ArchiveError(f'{name}: image exceeds {max_size} bytes', status_code=413)
+        parts.append(data)
+    if decompressor.unused_data:
+        reader.unread(decompressor.unused_data)
+    if remaining:
+        reader.skip(remaining)
+    return b''.join(parts)
+
+
+def _read_descriptor(reader: _Reader):
+    """(crc, compressed size, size) from the data descriptor after an entry; its signature is optional."""
+    record = reader.read_exact(12)
+    if struct.unpack('<I', record[:4])[0] == DESCRIPTOR_SIGNATURE:
+        record = record[4:] + reader.read_exact(4)
+    return struct.unpack('<III', record)
+
+
+def _has_zip64(extra: bytes) -> bool:
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from('<HH', extra, offset)
+        if header_id == ZIP64_EXTRA:
+            return True
+        offset += 4 + length
+    return False
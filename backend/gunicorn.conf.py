@@ -0,0 +1,52 @@
+"""
+Production server config: gunicorn -c gunicorn.conf.py
+
+The app is loaded and warmed once in the master (see api/warmup.py), then
+workers are forked from it and share those pages copy-on-write. Workers are
+recycled after NUTRISCAN_MAX_REQUESTS requests (plus jitter, so they don't
+all restart together); replacements fork from the warm master instead of
+cold-starting.
+"""
+import gc
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutriscan.settings')
+os.environ.setdefault('NUTRISCAN_WARMUP', 'True')
+# Keep the connection each worker opens in post_fork for its later requests
+os.environ.setdefault('NUTRISCAN_DB_CONN_MAX_AGE', '60')
+
+wsgi_app = 'nutriscan.wsgi:application'
+bind = os.getenv('NUTRISCAN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('NUTRISCAN_WORKERS', str(os.cpu_count() or 2)))
+threads = int(os.getenv('NUTRISCAN_THREADS', '1'))
+timeout = int(os.getenv('NUTRISCAN_WORKER_TIMEOUT', '30'))
+
+preload_app = True
+max_requests = int(os.getenv('NUTRISCAN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('NUTRISCAN_MAX_REQUESTS_JITTER', str(max_requests // 10)))
+
+
+def when_ready(server):
+    """Master is loaded and warm: freeze what it built before the first fork."""
+    from django.db import connections
+
+    connections.close_all()
+    # Objects in the permanent generation are never touched by the collector,
+    # so its refcount/GC bookkeeping doesn't un-share the inherited pages
+    gc.collect()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # A connection opened in the master would be shared by every child
+    from django.db import connections
+
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    """Connect before the first request rather than during it."""
+    from django.db import connection
+
+    if connection.settings_dict.get('CONN_MAX_AGE'):
+        connection.ensure_connection()
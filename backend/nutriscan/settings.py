@@ -36,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so a profile covers the rest of the stack too
+    'api.middleware.RequestProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -71,6 +73,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a worker keeps its connection between requests (0 = reconnect per request)
+        'CONN_MAX_AGE': int(os.getenv('NUTRISCAN_DB_CONN_MAX_AGE', '0')),
     }
 }
 
@@ -105,6 +109,140 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Upload limits, checked from the image header before decoding or storing anything
+NUTRISCAN_MAX_UPLOAD_BYTES = int(os.getenv('NUTRISCAN_MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+NUTRISCAN_MAX_IMAGE_PIXELS = int(os.getenv('NUTRISCAN_MAX_IMAGE_PIXELS', str(40_000_000)))
+NUTRISCAN_MAX_IMAGE_FRAMES = int(os.getenv('NUTRISCAN_MAX_IMAGE_FRAMES', '4'))
+# 'downscale' re-encodes over-budget JPEGs to NUTRISCAN_STORAGE_MAX_DIMENSION; 'reject' refuses them
+NUTRISCAN_OVERSIZE_POLICY = os.getenv('NUTRISCAN_OVERSIZE_POLICY', 'downscale')
+NUTRISCAN_STORAGE_MAX_DIMENSION = int(os.getenv('NUTRISCAN_STORAGE_MAX_DIMENSION', '1024'))
+
+# ZIP archive uploads (POST /api/scans/process_archive/): the largest archive
+# accepted, the most image bytes it may inflate to in total, and the most entries.
+# Each image is also held to NUTRISCAN_MAX_UPLOAD_BYTES.
+NUTRISCAN_ARCHIVE_MAX_BYTES = int(os.getenv('NUTRISCAN_ARCHIVE_MAX_BYTES', str(200 * 1024 * 1024)))
+NUTRISCAN_ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv('NUTRISCAN_ARCHIVE_MAX_TOTAL_BYTES', str(500 * 1024 * 1024)))
+NUTRISCAN_ARCHIVE_MAX_ENTRIES = int(os.getenv('NUTRISCAN_ARCHIVE_MAX_ENTRIES', '500'))
+
+# Resumable uploads (/api/uploads/): where partial files are kept, the largest
+# accepted chunk, and how long an idle session is kept before it is purged
+NUTRISCAN_UPLOAD_TMP_DIR = os.getenv('NUTRISCAN_UPLOAD_TMP_DIR', str(BASE_DIR / 'data' / 'uploads'))
+NUTRISCAN_UPLOAD_MAX_CHUNK_BYTES = int(os.getenv('NUTRISCAN_UPLOAD_MAX_CHUNK_BYTES', str(4 * 1024 * 1024)))
+NUTRISCAN_UPLOAD_SESSION_TTL_HOURS = int(os.getenv('NUTRISCAN_UPLOAD_SESSION_TTL_HOURS', '24'))
+
+# Most scan ids accepted by one bulk request (/api/scans/bulk_update/, bulk_delete/)
+NUTRISCAN_BULK_MAX_IDS = int(os.getenv('NUTRISCAN_BULK_MAX_IDS', '500'))
+
+# Async upload path: executor for decode/analysis work ('thread' or 'process')
+NUTRISCAN_ANALYSIS_EXECUTOR = os.getenv('NUTRISCAN_ANALYSIS_EXECUTOR', 'thread')
+NUTRISCAN_ANALYSIS_WORKERS = int(os.getenv('NUTRISCAN_ANALYSIS_WORKERS', str(os.cpu_count() or 2)))
+
+# Isolated analysis (api/isolation.py): decode and analyze uploads in killable
+# subprocesses, one per admission slot. A task running longer than the timeout
+# is killed with its worker; each worker may grow by at most the memory limit
+# and is replaced after max-tasks analyses (0 = never). With
+# NUTRISCAN_OVERLOAD_DEGRADE, analyses degraded to the coarse stage get up to
+# NUTRISCAN_ANALYSIS_SPARE_WORKERS more workers and answer 429 when those are
+# busy, rather than wait. Keep NUTRISCAN_ANALYSIS_EXECUTOR at 'thread' when this is on.
+NUTRISCAN_ANALYSIS_ISOLATION = os.getenv('NUTRISCAN_ANALYSIS_ISOLATION', 'False') == 'True'
+NUTRISCAN_ANALYSIS_TASK_TIMEOUT = float(os.getenv('NUTRISCAN_ANALYSIS_TASK_TIMEOUT', '20'))
+NUTRISCAN_ANALYSIS_MEMORY_LIMIT_MB = int(os.getenv('NUTRISCAN_ANALYSIS_MEMORY_LIMIT_MB', '512'))
+NUTRISCAN_ANALYSIS_WORKER_MAX_TASKS = int(os.getenv('NUTRISCAN_ANALYSIS_WORKER_MAX_TASKS', '500'))
+NUTRISCAN_ANALYSIS_SPARE_WORKERS = int(os.getenv('NUTRISCAN_ANALYSIS_SPARE_WORKERS', '2'))
+
+# Request CPU profiling (api/middleware.py): requests sent with `X-Profile: <token>`
+# (disabled while the token is empty) or a random share of them are profiled with
+# cProfile into NUTRISCAN_PROFILE_DIR, which keeps the newest NUTRISCAN_PROFILE_KEEP files
+NUTRISCAN_PROFILE_TOKEN = os.getenv('NUTRISCAN_PROFILE_TOKEN', '')
+NUTRISCAN_PROFILE_SAMPLE_RATE = float(os.getenv('NUTRISCAN_PROFILE_SAMPLE_RATE', '0'))
+NUTRISCAN_PROFILE_DIR = os.getenv('NUTRISCAN_PROFILE_DIR', str(BASE_DIR / 'data' / 'profiles'))
+NUTRISCAN_PROFILE_KEEP = int(os.getenv('NUTRISCAN_PROFILE_KEEP', '200'))
+
+# Memory profiling (api/memory_profile.py): tracemalloc peaks, retained memory and
+# RSS change per upload, analysis and detector call, one request at a time.
+# The latest NUTRISCAN_MEMORY_PROFILE_KEEP profiles are served to admins at
+# /api/metrics/memory/, each with its top NUTRISCAN_MEMORY_PROFILE_TOP allocation sites.
+NUTRISCAN_MEMORY_PROFILE = os.getenv('NUTRISCAN_MEMORY_PROFILE', 'False') == 'True'
+NUTRISCAN_MEMORY_PROFILE_KEEP = int(os.getenv('NUTRISCAN_MEMORY_PROFILE_KEEP', '50'))
+NUTRISCAN_MEMORY_PROFILE_TOP = int(os.getenv('NUTRISCAN_MEMORY_PROFILE_TOP', '10'))
+
+# Windows (days) whose /api/daily-logs/stats/ sums are kept per user and updated
+# as logs change (api/rolling_stats.py); other windows are summed on each request
+NUTRISCAN_STATS_WINDOWS = tuple(
+    int(days) for days in os.getenv('NUTRISCAN_STATS_WINDOWS', '7,30,90').split(',') if days.strip()
+)
+
+# Admission control in front of the detector: concurrent analyses, bounded
+# wait queue and wait timeout. Overflow gets 429 + Retry-After, or with
+# NUTRISCAN_OVERLOAD_DEGRADE the cheap coarse cascade stage instead.
+NUTRISCAN_ANALYSIS_MAX_CONCURRENT = int(os.getenv('NUTRISCAN_ANALYSIS_MAX_CONCURRENT', str(os.cpu_count() or 2)))
+NUTRISCAN_ANALYSIS_MAX_QUEUE = int(os.getenv('NUTRISCAN_ANALYSIS_MAX_QUEUE', '16'))
+NUTRISCAN_ANALYSIS_QUEUE_TIMEOUT = float(os.getenv('NUTRISCAN_ANALYSIS_QUEUE_TIMEOUT', '5'))
+NUTRISCAN_OVERLOAD_DEGRADE = os.getenv('NUTRISCAN_OVERLOAD_DEGRADE', 'False') == 'True'
+
+# Food detector
+# 'average' = whole-image colour rules, 'lut' = per-pixel colour LUT voting
+NUTRISCAN_DETECTOR_MODE = os.getenv('NUTRISCAN_DETECTOR_MODE', 'average')
+# Built offline with `python manage.py build_color_lut`
+NUTRISCAN_COLOR_LUT_PATH = os.getenv('NUTRISCAN_COLOR_LUT_PATH', str(BASE_DIR / 'data' / 'food_color_lut.bin'))
+# Coarse-to-fine cascade: classify from a tiny decode first and only run the
+# full 200px analysis when that decision is ambiguous
+NUTRISCAN_CASCADE = os.getenv('NUTRISCAN_CASCADE', 'False') == 'True'
+NUTRISCAN_CASCADE_COARSE_SIZE = int(os.getenv('NUTRISCAN_CASCADE_COARSE_SIZE', '32'))
+# Colour perturbation a coarse label must survive to exit early (higher = fewer early exits)
+NUTRISCAN_CASCADE_MARGIN = int(os.getenv('NUTRISCAN_CASCADE_MARGIN', '6'))
+
+# Plate analysis (analysis_mode=plate): tile grid size and per-image CPU budget
+NUTRISCAN_PLATE_ANALYSIS = os.getenv('NUTRISCAN_PLATE_ANALYSIS', 'False') == 'True'
+NUTRISCAN_PLATE_GRID = int(os.getenv('NUTRISCAN_PLATE_GRID', '6'))
+NUTRISCAN_PLATE_BUDGET_MS = float(os.getenv('NUTRISCAN_PLATE_BUDGET_MS', '50'))
+
+# Store the detector features (ScanFeatures) of analyzed images, so later
+# re-classification runs without decoding them again. reanalyze_scans and
+# import_photos extract them as they go; uploads in the analysis executor after
+# responding, when an analysis slot is free (else the next backfill does).
+NUTRISCAN_FEATURE_STORE = os.getenv('NUTRISCAN_FEATURE_STORE', 'True') == 'True'
+
+# Shared cache tier (api/cache.py) for analysis results and catalog lookups,
+# seen by every worker: 'file' (default; one host), 'database' (run `manage.py
+# createcachetable` first), 'memcached' (needs pymemcache; LOCATION host:port),
+# 'locmem' (this process only) or 'dummy' (off). Raise NUTRISCAN_CACHE_VERSION
+# to invalidate everything; a miss waits up to the lock timeout for another
+# worker computing it.
+_CACHE_BACKENDS = {
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'data' / 'cache')),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'nutriscan_cache'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'nutriscan'),
+    'dummy': ('django.core.cache.backends.dummy.DummyCache', ''),
+}
+NUTRISCAN_CACHE_BACKEND = os.getenv('NUTRISCAN_CACHE_BACKEND', 'file')
+NUTRISCAN_CACHE_LOCATION = os.getenv('NUTRISCAN_CACHE_LOCATION', _CACHE_BACKENDS[NUTRISCAN_CACHE_BACKEND][1])
+NUTRISCAN_CACHE_VERSION = int(os.getenv('NUTRISCAN_CACHE_VERSION', '1'))
+NUTRISCAN_CACHE_LOCK_TIMEOUT = float(os.getenv('NUTRISCAN_CACHE_LOCK_TIMEOUT', '30'))
+# Seconds entries live: results per image content and analysis settings, the name -> FoodItem map
+NUTRISCAN_ANALYSIS_CACHE_TTL = int(os.getenv('NUTRISCAN_ANALYSIS_CACHE_TTL', str(7 * 24 * 3600)))
+NUTRISCAN_CATALOG_CACHE_TTL = int(os.getenv('NUTRISCAN_CATALOG_CACHE_TTL', '3600'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': _CACHE_BACKENDS[NUTRISCAN_CACHE_BACKEND][0],
+        'LOCATION': NUTRISCAN_CACHE_LOCATION,
+        'KEY_PREFIX': 'nutriscan',
+        'VERSION': NUTRISCAN_CACHE_VERSION,
+        'TIMEOUT': 3600,
+        # memcached evicts by itself; the others cull a third once they hold this many
+        'OPTIONS': {} if NUTRISCAN_CACHE_BACKEND == 'memcached' else {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Build URL tables, the nutrition catalog and the image stack and run one synthetic
+# analysis when the app loads, so preforked workers inherit them (see gunicorn.conf.py)
+NUTRISCAN_WARMUP = os.getenv('NUTRISCAN_WARMUP', 'False') == 'True'
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -132,23 +270,46 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_EXPOSE_HEADERS = ["Content-Type", "X-CSRFToken"]
 
 # Logging
+# Request threads only enqueue records; a listener thread formats them as
+# key=value lines and writes them to the 'nutriscan.sink' logger's handlers.
+NUTRISCAN_LOG_QUEUE_SIZE = int(os.getenv('NUTRISCAN_LOG_QUEUE_SIZE', '10000'))
+# Keep 1 in N INFO records per message template (warnings and errors always pass)
+NUTRISCAN_LOG_INFO_SAMPLE_RATE = int(os.getenv('NUTRISCAN_LOG_INFO_SAMPLE_RATE', '1'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
+        'kv': {
+            '()': 'api.log_pipeline.KeyValueFormatter',
+        },
+    },
+    'filters': {
+        'sample_info': {
+            '()': 'api.log_pipeline.SamplingFilter',
+            'rate': NUTRISCAN_LOG_INFO_SAMPLE_RATE,
         },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': 'kv',
+        },
+        'queue': {
+            '()': 'api.log_pipeline.QueueLogHandler',
+            'sink': 'nutriscan.sink',
+            'maxsize': NUTRISCAN_LOG_QUEUE_SIZE,
+            'filters': ['sample_info'],
+        },
+    },
+    'loggers': {
+        'nutriscan.sink': {
+            'handlers': ['console'],
+            'propagate': False,
         },
     },
     'root': {
-        'handlers': ['console'],
+        'handlers': ['queue'],
         'level': 'INFO',
     },
 }
@@ -6,6 +6,12 @@
 
 const API_ENDPOINT = "http://localhost:8000/api/scans/process_image/";
 
+// Photos are shrunk in the browser before upload. The server stores images at
+// most NUTRISCAN_STORAGE_MAX_DIMENSION (1024px) on the long side and analyzes a
+// 200px thumbnail, so camera originals only cost bandwidth and decode time.
+const UPLOAD_MAX_DIMENSION = 1024;
+const UPLOAD_JPEG_QUALITY = 0.85;
+
 // Elements
 const preview = document.getElementById('preview');
 const previewImg = document.getElementById('previewImg');
@@ -69,6 +75,57 @@ function dataURLToBlob(dataURL){
   return new Blob([arr], {type:mime});
 }
 
+// Decode an image blob, respecting EXIF orientation where the browser supports it
+async function decodeImage(blob){
+  if('createImageBitmap' in window){
+    try{
+      return await createImageBitmap(blob, {imageOrientation:'from-image'});
+    }catch(err){
+      // Fall back to an <img> element below
+    }
+  }
+  const url = URL.createObjectURL(blob);
+  try{
+    const img = new Image();
+    img.src = url;
+    await img.decode();
+    return img;
+  }finally{
+    URL.revokeObjectURL(url);
+  }
+}
+
+// Resize to UPLOAD_MAX_DIMENSION and re-encode as JPEG. Returns the original
+// blob when it is already small, can't be decoded (e.g. HEIC), or would grow.
+async function downscaleForUpload(blob){
+  try{
+    const img = await decodeImage(blob);
+    const width = img.width, height = img.height;
+    const scale = Math.min(1, UPLOAD_MAX_DIMENSION / Math.max(width, height));
+    if(scale === 1 && blob.type === 'image/jpeg') return blob;
+
+    const c = document.createElement('canvas');
+    c.width = Math.round(width * scale);
+    c.height = Math.round(height * scale);
+    const ctx = c.getContext('2d');
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(img, 0, 0, c.width, c.height);
+    if(img.close) img.close();
+
+    const resized = await new Promise(resolve => c.toBlob(resolve, 'image/jpeg', UPLOAD_JPEG_QUALITY));
+    if(!resized || resized.size >= blob.size) return blob;
+    console.log(`Downscaled ${width}x${height} (${blob.size} B) to ${c.width}x${c.height} (${resized.size} B)`);
+    return resized;
+  }catch(err){
+    console.warn('Could not downscale image, uploading the original:', err);
+    return blob;
+  }
+}
+
+function jpegName(filename){
+  return filename.replace(/\.[^./\\]+$/, '') + '.jpg';
+}
+
 // Drag & Drop
 preview.addEventListener('dragover', e => {
   e.preventDefault(); 
@@ -178,8 +235,9 @@ async function fakeSendToBackend(blob){
     const formData = new FormData();
     // Use original filename if available, otherwise use blob name
     const filename = blob.name || 'image.jpg';
-    formData.append('image', blob, filename);
-    // Also send original filename as a separate field for backend to use
+    const upload = await downscaleForUpload(blob);
+    formData.append('image', upload, upload === blob ? filename : jpegName(filename));
+    // The original name is what the backend matches foods against
     formData.append('original_filename', filename);
     
     const response = await fetch(API_ENDPOINT, {